@@ -0,0 +1,84 @@
+"""
+Benchmark: SQL statements and time of the /ppms/bookings queries by booking count
+Seeds one system with bookings on one day, each in its own project and collection
+with a few caches, then counts the statements crud.get_bookings_filter_system and
+get_bookings_filter_system_and_user run. The count must not grow with the bookings
+
+Writes to the database configured in [database], point PITSCHI_XAPI_CONFIG at a
+config for a scratch database. The seeded rows are deleted again at the end
+
+    python bench/bookings_queries.py [bookings ...]
+"""
+import sys, time, datetime
+from sqlalchemy import event
+import pitschi.db as pdb
+from pitschi.db.database import engine
+from sqlalchemy.orm import Session
+
+BASE = 990000000
+DAY = datetime.date(2099, 1, 1)
+CACHES = 3
+
+
+def seed(db, count: int):
+    m = pdb.models
+    db.add(m.Core(id=BASE, institution='bench', shortname='bench', longname='bench', rorid=''))
+    db.add(m.System(id=BASE, coreid=BASE, type='bench', name='bench', pid=''))
+    db.add(m.User(username='bench-user', name='Bench User', email='bench@example.edu.au'))
+    db.add_all([m.Cache(name=f'bench-cache-{c}', path=f'/bench/{c}') for c in range(CACHES)])
+    for i in range(count):
+        db.add(m.Collection(name=f'bench-collection-{i}'))
+        db.add(m.Project(id=BASE + i, coreid=BASE, name=f'bench {i}', type='bench', phase=0, collection=f'bench-collection-{i}'))
+        db.add_all([m.CollectionCache(collection_name=f'bench-collection-{i}', cache_name=f'bench-cache-{c}', priority=c)
+                    for c in range(CACHES)])
+        db.add(m.UserProject(username='bench-user', projectid=BASE + i, enabled=True))
+        db.add(m.Booking(id=BASE + i, bookingdate=DAY, starttime=datetime.time(9), duration=60, systemid=BASE,
+                         username='bench-user', projectid=BASE + i))
+    db.commit()
+
+
+def cleanup(db):
+    m = pdb.models
+    for model, column in [(m.Booking, m.Booking.id), (m.UserProject, m.UserProject.projectid),
+                          (m.Project, m.Project.id), (m.System, m.System.id), (m.Core, m.Core.id)]:
+        db.query(model).filter(column >= BASE).delete(synchronize_session=False)
+    db.query(m.CollectionCache).filter(m.CollectionCache.collection_name.like('bench-collection-%')).delete(synchronize_session=False)
+    db.query(m.Collection).filter(m.Collection.name.like('bench-collection-%')).delete(synchronize_session=False)
+    db.query(m.Cache).filter(m.Cache.name.like('bench-cache-%')).delete(synchronize_session=False)
+    db.query(m.User).filter(m.User.username == 'bench-user').delete(synchronize_session=False)
+    db.commit()
+
+
+def timed(name: str, count: int, query):
+    statements = []
+    _count = lambda *args: statements.append(1)
+    event.listen(engine, 'before_cursor_execute', _count)
+    with Session(engine) as db:
+        start = time.perf_counter()
+        bookings = query(db)
+        seconds = time.perf_counter() - start
+        assert len(bookings) == count, (name, len(bookings))
+        assert all([c['priority'] for c in b.project.caches] == list(range(CACHES))[::-1] for b in bookings)
+    event.remove(engine, 'before_cursor_execute', _count)
+    print(f'{name:>16} {count:6d} bookings: {len(statements):3d} statements, {seconds * 1000:8.1f}ms')
+    return len(statements)
+
+
+def main():
+    counts = [int(c) for c in sys.argv[1:]] or [1, 10, 100]
+    statements = set()
+    for count in counts:
+        with Session(engine) as db:
+            seed(db, count)
+        try:
+            statements.add(timed('system', count, lambda db: pdb.crud.get_bookings_filter_system(db, BASE, DAY)))
+            statements.add(timed('system and user', count,
+                                 lambda db: pdb.crud.get_bookings_filter_system_and_user(db, BASE, DAY, 'Bench-User')))
+        finally:
+            with Session(engine) as db:
+                cleanup(db)
+    print('constant statement count' if len(statements) == 1 else f'statement count varies: {sorted(statements)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark: crud writes per second with a commit per write vs one unit of work
+Upserts synthetic users with crud.create_ppms_user, first in the default
+autocommit mode, then inside crud.unit_of_work with and without a savepoint per user
+
+Writes to the database configured in [database], point PITSCHI_XAPI_CONFIG at a
+config for a scratch database. The users are deleted again at the end
+
+    python bench/crud_commits.py [users]
+"""
+import sys, time
+from sqlalchemy import event
+import pitschi.db as pdb
+from pitschi.db.database import engine
+from sqlalchemy.orm import Session
+
+PREFIX = 'bench-crud-'
+
+
+def users(count: int, run: int):
+    return [pdb.schemas.User(username=f'{PREFIX}{i:06d}', userid=900000000 + i,
+                             name=f'Bench User {i} run {run}', email=f'{PREFIX}{i:06d}@example.edu.au')
+            for i in range(count)]
+
+
+def timed(name: str, write, count: int):
+    # count real COMMITs, not savepoint releases
+    commits = []
+    _count = lambda conn: commits.append(1)
+    event.listen(engine, 'commit', _count)
+    with Session(engine) as db:
+        start = time.perf_counter()
+        write(db)
+        seconds = time.perf_counter() - start
+    event.remove(engine, 'commit', _count)
+    print(f'{name:>28}: {count / seconds:8.0f} users/s, {len(commits):6d} commits, {seconds:7.2f}s')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    # each run changes every user's name, so every call is a real write
+    def autocommit(db):
+        for u in users(count, 1):
+            pdb.crud.create_ppms_user(db, u)
+    def unit_of_work(db):
+        with pdb.crud.unit_of_work(db):
+            for u in users(count, 2):
+                pdb.crud.create_ppms_user(db, u)
+    def unit_of_work_savepoints(db):
+        with pdb.crud.unit_of_work(db):
+            for u in users(count, 3):
+                with pdb.crud.savepoint(db):
+                    pdb.crud.create_ppms_user(db, u)
+    try:
+        timed('commit per write', autocommit, count)
+        timed('unit of work', unit_of_work, count)
+        timed('unit of work + savepoints', unit_of_work_savepoints, count)
+    finally:
+        with Session(engine) as db:
+            db.query(pdb.models.User).filter(pdb.models.User.username.like(f'{PREFIX}%')).delete(synchronize_session=False)
+            db.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""
+Local stand-in for the PPMS pumapi and API2 endpoints, for benchmarking the
+booking and project syncs without touching production PPMS
+
+Serves the actions used in pitschi/ppms.py from a synthetic data set, or from a
+recording made by proxying a real PPMS server. Every request can be delayed by
+latency_ms (+/- jitter_ms) and fail with error_status at error_rate
+
+    # synthetic data
+    python bench/fake_ppms.py --port 8765 --projects 2000 --users 20000 --sessions 3000
+    # record from a real server, then replay the recording
+    python bench/fake_ppms.py --port 8765 --upstream https://ppms.example/ --record ppms.json
+    python bench/fake_ppms.py --port 8765 --replay ppms.json --latency-ms 80 --error-rate 0.01
+
+Point [ppms] ppms_url at http://127.0.0.1:<port>/, the api keys are not checked.
+The booking, training and rdm collection reports are site specific, their action
+names are taken from the BOOKING_QUERY, TRAINING_QUERY, QCOLLECTION(S)_ACTION constants
+"""
+import sys, csv, io, json, time, random, threading, datetime
+import argparse
+import requests
+from urllib.parse import parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOOKING_QUERY = 'FakeBookingReport'
+TRAINING_QUERY = 'FakeTrainingReport'
+QCOLLECTION_ACTION = 'FakeRdmCollection'
+QCOLLECTIONS_ACTION = 'FakeRdmCollections'
+Q_COLLECTION_FIELD = 'Q collection'
+TIMEZONE = 'Australia/Brisbane'
+
+
+def ppms_config(url: str, coreids: list) -> dict:
+    """ [ppms] options that point pitschi at a stand-in serving the synthetic data """
+    return {
+        'ppms_url': url, 'ppms_key': 'fake', 'api2_key': 'fake',
+        'coreids': json.dumps(coreids), 'timezone': TIMEZONE,
+        'booking_query': BOOKING_QUERY, 'training_query': TRAINING_QUERY,
+        'qcollection_action': QCOLLECTION_ACTION, 'qcollections_action': QCOLLECTIONS_ACTION,
+        'q_collection_field': Q_COLLECTION_FIELD, 'project_starting_ref': '0',
+    }
+
+
+class FakeData:
+    """
+    Synthetic PPMS data set: cores, systems, users, projects with members and rdm
+    collections, and booking sessions spread over a date range
+    """
+    def __init__(self, projects: int = 200, users: int = 2000, sessions: int = 500,
+                 coreids: list = [2], systems: int = 50, startdate: datetime.date = None,
+                 days: int = 10, seed: int = 1):
+        rnd = random.Random(seed)
+        self.coreids = coreids
+        self.startdate = startdate or datetime.date.today() - datetime.timedelta(days=2)
+        self.cores = [{'Core ID': c, 'Institution': 'University', 'Facility Short Name': f'CORE{c}',
+                       'Facility Long Name': f'Core facility {c}', 'ROR ID': f'ror{c}'} for c in coreids]
+        self.systems = [{'coreid': coreids[i % len(coreids)], 'systemid': 100 + i,
+                         'systemtype': rnd.choice(['Microscope', 'Cytometer', 'Workstation']),
+                         'systemname': f'System {100 + i}'} for i in range(systems)]
+        self.users = [{'id': 1000 + i, 'login': f'uqfake{i:06d}', 'lname': f'Last{i}', 'fname': f'First{i}',
+                       'name': f'First{i} Last{i}', 'email': f'uqfake{i:06d}@example.edu.au',
+                       'unitlogin': f'unit{i % 300}', 'active': True} for i in range(users)]
+        self.users_by_login = {u['login']: u for u in self.users}
+        self.users_by_id = {u['id']: u for u in self.users}
+        self.projects = []
+        self.members = {}
+        self.collections = {}
+        for i in range(projects):
+            _id = 5000 + i
+            self.projects.append({'ProjectRef': _id, 'CoreFacilityRef': coreids[i % len(coreids)],
+                                  'ProjectName': f'Project {_id}', 'Active': True, 'ProjectType': 'Research',
+                                  'Phase': 1, 'Descr': f'Synthetic project {_id}'})
+            self.members[_id] = rnd.sample(self.users, min(len(self.users), rnd.randint(1, 8)))
+            self.collections[_id] = f'Q{_id:04d}-FAKE' if rnd.random() < 0.8 else ''
+        self.sessions = []
+        self.details = {}
+        self.training = []
+        for i in range(sessions):
+            _id = 900000 + i
+            _project = rnd.choice(self.projects)
+            _user = rnd.choice(self.members[_project['ProjectRef']])
+            _system = rnd.choice([s for s in self.systems if s['coreid'] == _project['CoreFacilityRef']] or self.systems)
+            _date = self.startdate + datetime.timedelta(days=rnd.randrange(days))
+            _start = datetime.time(rnd.randint(7, 18), rnd.choice([0, 15, 30, 45]))
+            _session = {'Ref (session)': _id, 'coreid': _project['CoreFacilityRef'],
+                        'Date': _date.strftime('%Y/%m/%d'), 'Start time': _start.strftime('%H:%M'),
+                        'Duration booked (minutes)': rnd.choice([30, 60, 120, 240]),
+                        'Cancelled': rnd.random() < 0.05, 'System': _system['systemname'],
+                        'User': _user['name']}
+            self.sessions.append(_session)
+            _assisted = rnd.random() < 0.1
+            _assistant = rnd.choice(self.users)
+            self.details[_id] = {'systemId': _system['systemid'], 'systemType': _system['systemtype'],
+                                 'systemName': _system['systemname'], 'status': 'Booked',
+                                 'userId': _user['id'], 'userName': _user['name'],
+                                 'projectId': _project['ProjectRef'], 'projectName': _project['ProjectName'],
+                                 'assisted': _assisted,
+                                 'assistantId': _assistant['id'] if _assisted else None,
+                                 'assistant': _assistant['name'] if _assisted else None}
+            if rnd.random() < 0.05:
+                _trainer = rnd.choice(self.users)
+                self.training.append({'SessionID': _id, 'coreid': _project['CoreFacilityRef'], 'Date': _session['Date'],
+                                      'Training organised by': _trainer['name'], 'User full Name': _trainer['name'],
+                                      'UserID': _trainer['id'], 'ProjectID': _project['ProjectRef'],
+                                      'Project Name': _project['ProjectName']})
+
+    def respond(self, api: str, params: dict) -> tuple:
+        """ returns (status, content type, body) for one pumapi/API2 request """
+        action = params.get('action')
+        coreid = int(params['coreid']) if params.get('coreid') else None
+        if action == 'getuser':
+            _user = self.users_by_login.get(params.get('login'))
+            return self._json(_user) if _user else (204, 'text/plain', b'')
+        if action == 'GetUserDetailsById':
+            _user = self.users_by_id.get(int(params.get('checkUserId', 0)))
+            return self._json([_user] if _user else [])
+        if action == 'Report1335':
+            return self._json(self.users)
+        if action == 'Report2168':
+            return self._json([{'System ID': s['systemid'], 'PID': f'PID{s["systemid"]}'} for s in self.systems])
+        if action == 'Report2169':
+            return self._json(self.cores)
+        if action == 'getsystems':
+            return self._csv(['Core facility ref', 'System id', 'Type', 'Name', 'Localisation', 'Active'],
+                             [[s['coreid'], s['systemid'], s['systemtype'], s['systemname'], 'Level 1', 'True'] for s in self.systems])
+        if action == 'getsysrights':
+            return (200, 'text/plain', '\n'.join(f'A:{u["login"]}' for u in self.users[:20]).encode())
+        if action == 'getprojects':
+            return self._json(self.projects)
+        if action in ('getprojectmember', 'getprojectusers'):
+            _members = self.members.get(int(params.get('projectid', 0)), [])
+            if action == 'getprojectusers':
+                return (200, 'text/plain', '\n'.join(u['login'] for u in _members).encode())
+            return self._csv(['ProjectRef', 'UserRef', 'UserName', 'Email', 'Phone', 'Unit', 'Group', 'Active', 'Login'],
+                             [[params.get('projectid'), u['id'], u['name'], u['email'], '', u['unitlogin'], '', 'True', u['login']] for u in _members])
+        if action == 'GetSessionDetails':
+            _details = self.details.get(int(params.get('sessionid', 0)))
+            return self._json([_details] if _details else [])
+        if action == 'GetSessionsList':
+            return self._json([s for s in self.sessions if s['Date'] == params.get('date', '').replace('-', '/')
+                               and self.details[s['Ref (session)']]['systemId'] == int(params.get('systemid', 0))])
+        if action in (BOOKING_QUERY, TRAINING_QUERY):
+            _start = params.get('startdate', '').replace('-', '/')
+            _end = params.get('enddate', '').replace('-', '/')
+            _rows = self.sessions if action == BOOKING_QUERY else self.training
+            return self._json([{k: v for k, v in r.items() if k != 'coreid'} for r in _rows
+                               if r['coreid'] == coreid and _start <= r['Date'] <= _end])
+        if action in (QCOLLECTION_ACTION, QCOLLECTIONS_ACTION):
+            _projects = [p for p in self.projects if p['CoreFacilityRef'] == coreid]
+            if action == QCOLLECTION_ACTION:
+                _projects = [p for p in _projects if p['ProjectRef'] == int(params.get('projectId', 0))]
+            return self._json([{'PlateformID': p['CoreFacilityRef'], 'ProjectRef': p['ProjectRef'],
+                                Q_COLLECTION_FIELD: self.collections[p['ProjectRef']]} for p in _projects])
+        return (400, 'text/plain', f'unknown action {action}'.encode())
+
+    @staticmethod
+    def _json(data) -> tuple:
+        return (200, 'application/json', json.dumps(data).encode())
+
+    @staticmethod
+    def _csv(header: list, rows: list) -> tuple:
+        _out = io.StringIO()
+        _writer = csv.writer(_out, quoting=csv.QUOTE_NONNUMERIC)
+        _writer.writerow(header)
+        _writer.writerows(rows)
+        return (200, 'text/csv', _out.getvalue().encode())
+
+
+class Recording:
+    """
+    Responses captured from a real PPMS server, keyed by api and request parameters
+    (without the api key). With an upstream url, unknown requests are proxied and recorded
+    """
+    def __init__(self, path: str, upstream: str = None):
+        self.path = path
+        self.upstream = upstream
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.responses = json.load(f)
+        except FileNotFoundError:
+            self.responses = {}
+
+    @staticmethod
+    def key(api: str, params: dict) -> str:
+        return api + '?' + '&'.join(f'{k}={v}' for k, v in sorted(params.items()) if k != 'apikey')
+
+    def respond(self, api: str, params: dict, body: bytes) -> tuple:
+        _key = self.key(api, params)
+        _recorded = self.responses.get(_key)
+        if _recorded is None:
+            if not self.upstream:
+                return (404, 'text/plain', f'not recorded: {_key}'.encode())
+            _res = requests.post(f'{self.upstream}{api}/', data=body,
+                                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            _recorded = [_res.status_code, _res.headers.get('Content-Type', 'text/plain'), _res.text]
+            with self._lock:
+                self.responses[_key] = _recorded
+                with open(self.path, 'w') as f:
+                    json.dump(self.responses, f)
+        return (_recorded[0], _recorded[1], _recorded[2].encode())
+
+
+class FakePPMSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    # set on the server by serve()
+    source = None
+
+    def do_POST(self):
+        _body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        _api = self.path.strip('/').split('/')[-1]
+        _params = dict(parse_qsl(_body.decode()))
+        _server = self.server
+        with _server.lock:
+            _server.counts[_params.get('action')] = _server.counts.get(_params.get('action'), 0) + 1
+        if _server.latency_ms or _server.jitter_ms:
+            time.sleep(max(0, _server.latency_ms + random.uniform(-_server.jitter_ms, _server.jitter_ms)) / 1000)
+        if _server.error_rate and random.random() < _server.error_rate:
+            _status, _type, _payload = _server.error_status, 'text/plain', b'injected error'
+        elif isinstance(_server.source, Recording):
+            _status, _type, _payload = _server.source.respond(_api, _params, _body)
+        else:
+            _status, _type, _payload = _server.source.respond(_api, _params)
+        try:
+            self.send_response(_status)
+            self.send_header('Content-Type', _type)
+            self.send_header('Content-Length', str(len(_payload)))
+            self.end_headers()
+            self.wfile.write(_payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # client gave up on the request, e.g. a cancelled or timed out call
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(source, port: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+          error_rate: float = 0, error_status: int = 500) -> ThreadingHTTPServer:
+    """
+    Start the stand-in in a background thread, returns the server
+    server.url is the ppms_url to configure and server.counts the requests served per action
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakePPMSHandler)
+    server.daemon_threads = True
+    server.source = source
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.counts = {}
+    server.lock = threading.Lock()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--systems', type=int, default=50)
+    parser.add_argument('--coreids', type=json.loads, default=[2], help='json list, e.g. [2,3]')
+    parser.add_argument('--days', type=int, default=10, help='days the sessions are spread over, starting 2 days ago')
+    parser.add_argument('--replay', help='serve a recording instead of synthetic data')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--error-status', type=int, default=500)
+
+
+def source_from_args(args):
+    if args.replay:
+        return Recording(args.replay)
+    return FakeData(projects=args.projects, users=args.users, sessions=args.sessions,
+                    coreids=args.coreids, systems=args.systems, days=args.days)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in PPMS server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--upstream', help='real ppms url to proxy, used with --record')
+    parser.add_argument('--record', help='file to save proxied responses to')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.record:
+        source = Recording(args.record, upstream=args.upstream)
+    else:
+        source = source_from_args(args)
+    server = serve(source, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                   error_rate=args.error_rate, error_status=args.error_status)
+    print(f'fake ppms listening on {server.url}')
+    if isinstance(source, FakeData):
+        print(json.dumps(ppms_config(server.url, source.coreids), indent=2))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(server.counts, indent=2))
+
+
+if __name__ == '__main__':
+    main()
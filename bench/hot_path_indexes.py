@@ -0,0 +1,118 @@
+"""
+Benchmark: booking, dataset and file hot path queries with and without their indexes
+Seeds bookings across systems and days, a dataset per booking (a few still waiting
+for ingest) and files per dataset, then times each crud query with the composite
+indexes dropped and again after database.create_indexes() built them
+
+Writes to the database configured in [database], point PITSCHI_XAPI_CONFIG at a
+config for a scratch database. The seeded rows are deleted again at the end
+
+    python bench/hot_path_indexes.py [bookings] [files per dataset]
+"""
+import sys, time, datetime
+from sqlalchemy import text
+import pitschi.db as pdb
+from pitschi.db.database import engine
+from sqlalchemy.orm import Session
+
+BASE = 960000000
+SYSTEMS = 50
+DAY = datetime.date(2099, 3, 1)
+REPEAT = 20
+INDEXES = ['ix_booking_systemid_bookingdate_cancelled', 'ix_dataset_mode_status',
+           'ix_dataset_bookingid', 'ix_file_dataset_id_path']
+
+
+def seed(db, count: int, files: int):
+    m = pdb.models
+    db.add(m.Core(id=BASE, institution='bench', shortname='bench', longname='bench', rorid=''))
+    db.add_all([m.System(id=BASE + s, coreid=BASE, type='bench', name=f'bench {s}', pid='') for s in range(SYSTEMS)])
+    db.add(m.Project(id=BASE, coreid=BASE, name='bench', type='bench', phase=0))
+    db.add(m.Repo(name='bench-repo', url='', apiurl='', apikey=''))
+    db.add_all([m.User(username=f'bench-user-{u}', name=f'Bench User {u}', email=f'bench{u}@example.edu.au')
+                for u in range(count // 10)])
+    db.flush()
+    db.add_all([m.UserProject(username=f'bench-user-{u}', projectid=BASE, enabled=True) for u in range(count // 10)])
+    db.flush()
+    db.add_all([m.Booking(id=BASE + i, bookingdate=DAY + datetime.timedelta(days=(i // SYSTEMS) % 365),
+                          starttime=datetime.time(9), duration=60, systemid=BASE + i % SYSTEMS,
+                          username=f'bench-user-{i % (count // 10)}', projectid=BASE) for i in range(count)])
+    db.flush()
+    # one in a hundred datasets is still waiting for ingest
+    db.add_all([m.Dataset(id=BASE + i, originalmachine='bench', originalpath=f'/bench/{i}', networkpath='',
+                          relpathfromrootcollection='', name=f'bench {i}', bookingid=BASE + i, repo_name='bench-repo',
+                          mode=m.Mode.imported if i % 100 == 0 else m.Mode.ingested, status=m.Status.success)
+                for i in range(count)])
+    db.flush()
+    for i in range(count):
+        db.add_all([m.File(path=f'file-{f}.tif', size_kb=1, dataset_id=BASE + i) for f in range(files)])
+        if i % 1000 == 0:
+            db.flush()
+    db.commit()
+
+
+def cleanup(db):
+    m = pdb.models
+    db.query(m.File).filter(m.File.dataset_id >= BASE).delete(synchronize_session=False)
+    db.query(m.Dataset).filter(m.Dataset.id >= BASE).delete(synchronize_session=False)
+    db.query(m.Booking).filter(m.Booking.id >= BASE).delete(synchronize_session=False)
+    db.query(m.UserProject).filter(m.UserProject.projectid == BASE).delete(synchronize_session=False)
+    db.query(m.User).filter(m.User.username.like('bench-user-%')).delete(synchronize_session=False)
+    db.query(m.Repo).filter(m.Repo.name == 'bench-repo').delete(synchronize_session=False)
+    db.query(m.System).filter(m.System.id >= BASE).delete(synchronize_session=False)
+    for model in (m.Project, m.Core):
+        db.query(model).filter(model.id == BASE).delete(synchronize_session=False)
+    db.commit()
+
+
+def analyze():
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('ANALYZE'))
+
+
+def run(queries) -> dict:
+    timings = {}
+    with Session(engine) as db:
+        for name, query in queries:
+            query(db)
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                query(db)
+                db.expunge_all()
+            timings[name] = (time.perf_counter() - start) / REPEAT
+    return timings
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    middle = BASE + count // 2
+    queries = [
+        ('get_bookings_filter_system', lambda db: pdb.crud.get_bookings_filter_system(db, BASE + 7, DAY + datetime.timedelta(days=3))),
+        ('get_imported_success_datasets', lambda db: pdb.crud.get_imported_success_datasets(db)),
+        ('get_datasets', lambda db: pdb.crud.get_datasets(db, 'bench-user-7')),
+        ('get_files_in_dataset', lambda db: pdb.crud.get_files_in_dataset(db, middle)),
+        ('get_file_using_path', lambda db: pdb.crud.get_file_using_path(db, middle, 'file-3.tif')),
+    ]
+    with Session(engine) as db:
+        seed(db, count, files)
+    try:
+        with engine.begin() as conn:
+            for index in INDEXES:
+                conn.execute(text(f'DROP INDEX IF EXISTS {index}'))
+        analyze()
+        before = run(queries)
+        pdb.database.create_indexes(pdb.models.Base.metadata, engine)
+        analyze()
+        after = run(queries)
+        print(f'{count} bookings and datasets, {count * files} files, mean of {REPEAT} runs')
+        for name, _ in queries:
+            print(f'{name:>30}: {before[name] * 1000:9.2f}ms -> {after[name] * 1000:7.2f}ms')
+    finally:
+        pdb.database.create_indexes(pdb.models.Base.metadata, engine)
+        with Session(engine) as db:
+            cleanup(db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Microbenchmark: per-call latency of a fresh requests.request vs the pooled PPMSClient
+against a local stand-in PPMS server
+The stand-in delays every new connection by handshake_ms to emulate the TCP+TLS
+setup cost of reaching the real PPMS server
+
+    python bench/ppms_client.py [calls] [handshake_ms]
+"""
+import sys, time, statistics, threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pitschi.ppms import PPMSClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    handshake_ms = 0
+
+    def setup(self):
+        time.sleep(self.handshake_ms / 1000)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'[{"systemId": 1, "status": "ok"}]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(call, calls):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call().json()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name, latencies):
+    print(f'{name:>10}: mean {statistics.mean(latencies):.3f} ms, '
+          f'p50 {statistics.median(latencies):.3f} ms, '
+          f'p95 {sorted(latencies)[int(len(latencies) * 0.95) - 1]:.3f} ms')
+
+
+def main(calls: int = 500, handshake_ms: float = 20):
+    StandInHandler.handshake_ms = handshake_ms
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    payload = 'apikey=x&action=GetSessionDetails&sessionid=1&coreid=1'
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    report('per-call', timed(lambda: requests.request("POST", f'{url}API2/', headers=headers, data=payload), calls))
+    client = PPMSClient(url, 'x', 'x')
+    report('pooled', timed(lambda: client.api2('action=GetSessionDetails&sessionid=1&coreid=1'), calls))
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 20)
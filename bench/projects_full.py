@@ -0,0 +1,89 @@
+"""
+Benchmark: crud.get_projects_full (/ppms/projects, /dashboard/projects) by project count
+Seeds active projects, each with its own collection, a few enabled members and caches,
+then times the current query against the old loop of two queries per project
+
+Writes to the database configured in [database], point PITSCHI_XAPI_CONFIG at a
+config for a scratch database. The seeded rows are deleted again at the end
+
+    python bench/projects_full.py [projects ...]
+"""
+import sys, time
+from sqlalchemy import event
+import pitschi.db as pdb
+from pitschi.db.database import engine
+from sqlalchemy.orm import Session
+
+BASE = 980000000
+MEMBERS = 3
+CACHES = 2
+
+
+def seed(db, count: int):
+    m = pdb.models
+    db.add_all([m.Cache(name=f'bench-cache-{c}', path=f'/bench/{c}') for c in range(CACHES)])
+    db.add_all([m.User(username=f'bench-user-{u}', name=f'Bench User {u}', email=f'bench{u}@example.edu.au')
+                for u in range(count + MEMBERS)])
+    db.flush()
+    for i in range(count):
+        db.add(m.Collection(name=f'bench-collection-{i}'))
+        db.add(m.Project(id=BASE + i, coreid=BASE, name=f'bench {i}', type='bench', phase=0, collection=f'bench-collection-{i}'))
+    db.flush()
+    for i in range(count):
+        db.add_all([m.CollectionCache(collection_name=f'bench-collection-{i}', cache_name=f'bench-cache-{c}', priority=c)
+                    for c in range(CACHES)])
+        db.add_all([m.UserProject(username=f'bench-user-{i + u}', projectid=BASE + i, enabled=True) for u in range(MEMBERS)])
+    db.commit()
+
+
+def cleanup(db):
+    m = pdb.models
+    db.query(m.UserProject).filter(m.UserProject.projectid >= BASE).delete(synchronize_session=False)
+    db.query(m.Project).filter(m.Project.id >= BASE).delete(synchronize_session=False)
+    db.query(m.CollectionCache).filter(m.CollectionCache.collection_name.like('bench-collection-%')).delete(synchronize_session=False)
+    db.query(m.Collection).filter(m.Collection.name.like('bench-collection-%')).delete(synchronize_session=False)
+    db.query(m.Cache).filter(m.Cache.name.like('bench-cache-%')).delete(synchronize_session=False)
+    db.query(m.User).filter(m.User.username.like('bench-user-%')).delete(synchronize_session=False)
+    db.commit()
+
+
+def loop_per_project(db):
+    # get_projects_full before it loaded participants and caches for all projects at once
+    m = pdb.models
+    projects = db.query(m.Project).filter(m.Project.collection != None).filter(m.Project.active == True).all()
+    for _project in projects:
+        _project.participants = db.query(m.User).join(m.UserProject).filter(m.UserProject.enabled).\
+                                    filter(m.UserProject.projectid == _project.id).all()
+        _project.caches = db.query(m.CollectionCache).filter(m.CollectionCache.collection_name == _project.collection).all()
+    return projects
+
+
+def timed(name: str, count: int, query):
+    statements = []
+    _count = lambda *args: statements.append(1)
+    event.listen(engine, 'before_cursor_execute', _count)
+    with Session(engine) as db:
+        start = time.perf_counter()
+        projects = [p for p in query(db) if p.id >= BASE]
+        seconds = time.perf_counter() - start
+        assert len(projects) == count, (name, len(projects))
+        assert all(len(p.participants) == MEMBERS and len(p.caches) == CACHES for p in projects)
+    event.remove(engine, 'before_cursor_execute', _count)
+    print(f'{name:>16} {count:6d} projects: {len(statements):6d} statements, {seconds:8.3f}s')
+
+
+def main():
+    counts = [int(c) for c in sys.argv[1:]] or [1000, 5000, 10000]
+    for count in counts:
+        with Session(engine) as db:
+            seed(db, count)
+        try:
+            timed('per project', count, loop_per_project)
+            timed('get_projects_full', count, pdb.crud.get_projects_full)
+        finally:
+            with Session(engine) as db:
+                cleanup(db)
+
+
+if __name__ == '__main__':
+    main()
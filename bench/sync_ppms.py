@@ -0,0 +1,89 @@
+"""
+Benchmark runner: times a full project sync and a booking sync against the
+local stand-in PPMS (bench/fake_ppms.py) at a configurable scale
+
+The syncs write to the database configured in [database], point
+PITSCHI_XAPI_CONFIG at a config for a scratch database before running this
+
+    python bench/sync_ppms.py --projects 2000 --users 20000 --sessions 3000 --latency-ms 50
+    python bench/sync_ppms.py --replay ppms.json --skip-projects
+
+The booking sync runs --booking-runs times over the same window, runs after the
+first show the cost of a sync where nothing changed in PPMS
+"""
+import sys, os, json, time, asyncio, logging, datetime
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_ppms
+
+
+def configure(url: str, source):
+    import pitschi.config as config
+    if not config.config.has_section('ppms'):
+        config.config.add_section('ppms')
+    if not config.config.has_section('rdm'):
+        config.config.add_section('rdm')
+    if isinstance(source, fake_ppms.FakeData):
+        config.config.read_dict({'ppms': fake_ppms.ppms_config(url, source.coreids)})
+    else:
+        config.config.set('ppms', 'ppms_url', url)
+    for section, option, default in [('ppms', 'booking_sync_minute', '5'), ('ppms', 'project_sync_day', '7'),
+                                     ('rdm', 'cache_defaults', '{}')]:
+        if not config.config.has_option(section, option):
+            config.config.set(section, option, default)
+
+
+async def run(args, server, startdate: datetime.date, enddate: datetime.date) -> list:
+    # imported late, the modules read the config when they are loaded
+    import pitschi.async_http as async_http
+    from starlette.concurrency import run_in_threadpool
+    from pitschi.routers import ppms_utils, sync_ppms_bookings
+    timings = []
+    def timed(name, start, result=None):
+        timings.append({'sync': name, 'seconds': round(time.perf_counter() - start, 3),
+                        'requests': sum(server.counts.values()), 'result': result})
+        server.counts.clear()
+    try:
+        with sync_ppms_bookings.sessionmaker.context_session() as db:
+            if not args.skip_projects:
+                server.counts.clear()
+                _start = time.perf_counter()
+                await run_in_threadpool(ppms_utils.sync_ppms_projects, db)
+                timed('projects', _start)
+            for i in range(args.booking_runs):
+                server.counts.clear()
+                _start = time.perf_counter()
+                _counts = await run_in_threadpool(sync_ppms_bookings.sync_bookings, db, startdate, enddate)
+                timed(f'bookings #{i + 1}', _start, _counts)
+    finally:
+        await async_http.close()
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the PPMS syncs against a local stand-in')
+    fake_ppms.add_arguments(parser)
+    parser.add_argument('--startdate', type=datetime.date.fromisoformat, default=None,
+                        help='first day of the booking sync, default 2 days ago')
+    parser.add_argument('--booking-runs', type=int, default=2)
+    parser.add_argument('--skip-projects', action='store_true')
+    args = parser.parse_args(argv)
+    _build = time.perf_counter()
+    source = fake_ppms.source_from_args(args)
+    startdate = args.startdate or (source.startdate if isinstance(source, fake_ppms.FakeData)
+                                   else datetime.date.today() - datetime.timedelta(days=2))
+    enddate = startdate + datetime.timedelta(days=args.days - 1)
+    server = fake_ppms.serve(source, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                             error_rate=args.error_rate, error_status=args.error_status)
+    print(f'stand-in ppms on {server.url}, data ready in {time.perf_counter() - _build:.1f}s')
+    configure(server.url, source)
+    logging.getLogger('pitschixapi').setLevel(logging.WARNING)
+    for timing in asyncio.run(run(args, server, startdate, enddate)):
+        print(f'{timing["sync"]:>12}: {timing["seconds"]:8.3f}s, {timing["requests"]:6d} ppms requests'
+              + (f', {json.dumps(timing["result"])}' if timing['result'] else ''))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Memory benchmark: peak RSS of loading the PPMS full-user dump (Report1335)
+the old way (response.json() plus the two users_info dicts built in sync_projects)
+vs streaming it into a pitschi.ppms.UserIndex
+Each mode runs in its own process on the same synthetic dump
+
+    python bench/users_memory.py [users]
+"""
+import sys, os, json, random, subprocess, resource, tempfile
+
+CHUNK_SIZE = 65536
+
+
+def write_dump(path, users):
+    # Report1335 rows carry many more columns than the four the sync uses
+    rnd = random.Random(1335)
+    with open(path, 'w') as f:
+        f.write('[')
+        for i in range(users):
+            if i:
+                f.write(',')
+            login = f'uqusr{i:06d}'
+            json.dump({
+                'id': 100000 + i, 'login': login,
+                'lname': f'Last{rnd.randrange(10**6)}', 'fname': f'First{rnd.randrange(10**6)}',
+                'name': f'First{i} Last{i}', 'email': f'{login}@example.edu.au',
+                'phone': f'+61 7 {rnd.randrange(10**8):08d}', 'unitlogin': f'unit{rnd.randrange(500)}',
+                'unitname': f'School of Something {rnd.randrange(500)}', 'affiliation': 'University',
+                'department': f'Department {rnd.randrange(200)}', 'active': True, 'mustchbcode': False,
+                'mustchpwd': False, 'bcode': '', 'usertype': 'academic',
+            }, f)
+        f.write(']')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_json(path):
+    # what requests does for response.json(): content bytes, decoded text, then the parsed list
+    with open(path, 'rb') as f:
+        content = f.read()
+    text = content.decode('utf-8')
+    users = json.loads(text, strict=False)
+    _users_info = { u["login"]: { "id": u["id"], "email": u["email"], "name": u["name"] } for u in users }
+    _users_info_by_id = { u["id"]: { "login": u["login"], "email": u["email"], "name": u["name"] } for u in users }
+    return len(_users_info), len(_users_info_by_id)
+
+
+def load_stream(path):
+    from pitschi.ppms import JSONArrayStream, UserIndex
+    users = UserIndex()
+    parser = JSONArrayStream()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            for user in parser.feed(chunk):
+                users.add(user)
+    parser.close()
+    return len(users), len(users)
+
+
+def run_mode(mode, path):
+    import pitschi.ppms  # noqa: F401, count the module imports in the baseline
+    baseline = peak_rss_mb()
+    counts = {'json': load_json, 'stream': load_stream}[mode](path)
+    print(json.dumps({'baseline': baseline, 'peak': peak_rss_mb(), 'counts': counts}))
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'report1335.json')
+        write_dump(path, users)
+        print(f'{users} users, dump {os.path.getsize(path) / 2**20:.1f} MiB')
+        for mode in ('json', 'stream'):
+            out = subprocess.run([sys.executable, __file__, '--mode', mode, path],
+                                 check=True, capture_output=True, text=True).stdout
+            result = json.loads(out)
+            print(f'{mode:>7}: peak rss {result["peak"]:7.1f} MiB, '
+                  f'{result["peak"] - result["baseline"]:7.1f} MiB over baseline, users {result["counts"][0]}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--mode':
+        run_mode(sys.argv[2], sys.argv[3])
+    else:
+        main()
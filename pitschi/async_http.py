@@ -0,0 +1,37 @@
+import httpx
+import logging
+import pitschi.config as config
+
+logger = logging.getLogger('pitschixapi')
+
+##################
+# Shared asyncio http client for the scheduled jobs
+# One connection pool is used by both ppms_async and clowder_rest_async,
+# so the total number of sockets the jobs hold open is bounded by config
+##################
+
+_client = None
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared async client, creating it from config on first use
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(config.get('http', 'max_connections', default=20)),
+                max_keepalive_connections=int(config.get('http', 'max_keepalive_connections', default=10))),
+            timeout=httpx.Timeout(
+                float(config.get('http', 'read_timeout', default=120)),
+                connect=float(config.get('http', 'connect_timeout', default=10))))
+    return _client
+
+async def close():
+    """
+    Close the shared client, called on application shutdown
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
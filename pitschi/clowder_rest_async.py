@@ -0,0 +1,158 @@
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+import json
+import os
+import pitschi.async_http as async_http
+from pitschi.clowder_rest import _request_header
+##################
+# asyncio versions of the clowder_rest calls used by the scheduled ingest
+# Same endpoints and payloads, sent through the shared async http client
+# Functions that return a response return an httpx.Response
+##################
+
+async def get_spaces(key, api_url, name, canedit=True):
+    """
+    get spaces with given name
+    """
+    url = f"{api_url}/spaces"
+    if canedit:
+        url = f"{url}/canEdit"
+    else:
+        url = f"{url}?name={name}&limit=10000"
+    return await _get(url, key)
+
+async def list_dataset_in_space(key, api_url, space_id):
+    """
+    """
+    url = f"{api_url}/spaces/{space_id}/datasets"
+    return await _get(url, key)
+
+async def add_dataset_to_space(key, api_url, space_id, dataset_id):
+    url = f"{api_url}/spaces/{space_id}/addDatasetToSpace/{dataset_id}"
+    return await _post(url, key, content_type=None)
+
+async def get_file_list(key, api_url, dataset_id):
+    """
+    Get list of files in a dataset
+    """
+    url = f"{api_url}/datasets/{dataset_id}/files"
+    return await _get(url, key)
+
+async def move_existing_file_to_folder(key, api_url, dataset_id, folder_id, file_id):
+    url = f"{api_url}/datasets/{dataset_id}/moveFile/{folder_id}/{file_id}"
+    res = await _post(url, key, data=json.dumps({}))
+    if res.is_success:
+        return res.json()
+    else:
+        res.raise_for_status()
+
+async def add_server_file(key, api_url, dataset_id, file_path, parent_folderid=None, extract=True, check_duplicate=True):
+    """
+    Add files already in server side
+    """
+    if check_duplicate:
+        ds_files = await get_file_list(key, api_url, dataset_id)
+        if ds_files.is_success:
+            for f in ds_files.json():
+                if f['filename'] == os.path.basename(file_path):
+                    return {'id': f['id']}
+    url = f"{api_url}/uploadToDataset/{dataset_id}?extract={'true' if extract else 'false'}"
+    data = {
+        'path': file_path,
+        'dataset': dataset_id
+    }
+    m = MultipartEncoder({
+        'file': json.dumps(data)
+    })
+    res = await _post(url, key, data=m.to_string(), content_type=m.content_type)
+    if res.is_success:
+        # move file to folder
+        res_json = res.json()
+        if parent_folderid:
+            await move_existing_file_to_folder(key, api_url, dataset_id, parent_folderid, res_json['id'])
+        return res_json
+    else:
+        res.raise_for_status()
+
+async def upload_dataset_metadata(key, api_url, datasetid, metadata):
+    """
+    upload dataset metadaa
+    """
+    url = f"{api_url}/datasets/{datasetid}/metadata"
+    res = await _post(url, key, data=json.dumps(metadata))
+    if res.is_success:
+        return res.json()
+    else:
+        res.raise_for_status()
+
+async def add_dataset_tags(key, api_url, datasetid, tags):
+    """
+    upload dataset tags
+    """
+    url = f"{api_url}/datasets/{datasetid}/tags"
+    tag_data = {"tags": tags}
+    res = await _post(url, key, data=json.dumps(tag_data))
+    if res.is_success:
+        return res.json()
+    else:
+        res.raise_for_status()
+
+async def create_dataset(key, api_url, space_id, dataset_name, check_duplicate=True):
+    if check_duplicate:
+        res = await list_dataset_in_space(key, api_url, space_id)
+        if res.is_success:
+            for _dataset in res.json():
+                if _dataset.get('name') == dataset_name:
+                    return {'id': _dataset.get('id')}
+    url = f"{api_url}/datasets/createempty"
+    data = {
+        'name': dataset_name
+    }
+    res = await _post(url, key, data=json.dumps(data))
+    if res.is_success:
+        res_json = res.json()
+        res = await add_dataset_to_space(key, api_url, space_id, res_json.get('id'))
+        if res.is_success:
+            return res_json
+    res.raise_for_status()
+
+async def get_dataset_folders(key, api_url, dataset_id):
+    url = f"{api_url}/datasets/{dataset_id}/folders"
+    res = await _get(url, key)
+    if res.is_success:
+        return res.json()
+    res.raise_for_status()
+
+async def add_folder(key, api_url, dataset_id, folder_name, parent_folder_id=None):
+    """
+    Add a folder
+    """
+    url = f"{api_url}/datasets/{dataset_id}/newFolder"
+    if parent_folder_id:
+        parent_id = parent_folder_id
+        parent_type = 'folder'
+    else:
+        parent_id = dataset_id
+        parent_type = 'dataset'
+    data = {
+        "name": folder_name,
+        "parentId": parent_id,
+        "parentType": parent_type
+    }
+    res = await _post(url, key, data=json.dumps(data))
+    if res.is_success:
+        return res.json()
+    else:
+        res.raise_for_status()
+
+########################### miscs ########################################
+async def _post(url, key, data=None, content_type='application/json'):
+    """
+    POST
+    """
+    return await async_http.get_client().post(url, headers=_request_header(key, content_type=content_type), content=data)
+
+async def _get(url, key):
+    """
+    GET
+    """
+    return await async_http.get_client().get(url, headers=_request_header(key))
@@ -5,8 +5,13 @@ from .database import engine
 from .database import _get_fastapi_sessionmaker
 from typing import Iterator
 from sqlalchemy.orm import Session
+import pitschi.config as config
 
+# new tables come with their indexes, indexes added to existing tables are built by pitschi-migrate
 models.Base.metadata.create_all(bind=engine)
+# opt in, plain CREATE INDEX blocks writes to the table and every api/worker process would race on it
+if config.get('database', 'create_indexes', default = "no") == "yes":
+    database.create_indexes(models.Base.metadata, engine)
 
 # def get_db():
 #     db = SessionLocal()
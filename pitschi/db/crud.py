@@ -1,10 +1,13 @@
 import base64
 from sqlalchemy.orm import aliased, Session
-from sqlalchemy import inspect, and_, or_, func
+from sqlalchemy import inspect, and_, or_, func, literal_column, select, exists, true, case
+from sqlalchemy import MetaData, Table, Column, Integer, String
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from pydantic import parse_obj_as
 from urllib.parse import quote
 from . import models, schemas
-from typing import List
+from typing import List, NamedTuple, Optional
+from contextlib import contextmanager, nullcontext
 from datetime import datetime,timedelta
 import enum
 import pytz
@@ -28,6 +31,46 @@ class AlreadyExistException(Exception):
 class CannotChangeException(Exception):
     pass
 
+def _commit(db: Session, *refresh):
+    '''
+    commit and refresh the given objects, or only flush if the session is in a unit of work
+    '''
+    if db.info.get('unit_of_work'):
+        db.flush()
+    else:
+        db.commit()
+        for obj in refresh:
+            db.refresh(obj)
+
+@contextmanager
+def unit_of_work(db: Session):
+    '''
+    run the crud writes of a block in one transaction, committed at the end of the block
+    crud functions only flush inside the block, use savepoint() to isolate a failing entity
+    nested blocks join the outer unit of work
+    '''
+    if db.info.get('unit_of_work'):
+        yield db
+        return
+    db.info['unit_of_work'] = True
+    try:
+        yield db
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    finally:
+        db.info.pop('unit_of_work', None)
+
+def savepoint(db: Session):
+    '''
+    inside a unit of work, roll back only the writes of this block if it raises
+    outside of one every crud write is committed already, so it does nothing
+    '''
+    if db.info.get('unit_of_work'):
+        return db.begin_nested()
+    return nullcontext()
+
 def row2dict(row, keep_id = False):
     d = {}
     for column in row.__table__.columns:
@@ -40,6 +83,62 @@ def row2dict(row, keep_id = False):
     return d
 
 
+################# generic upsert
+def _upsert(db: Session, model, objects: list, key: str = 'id', ignore_case: bool = False, chunk_size: int = 1000):
+    '''
+    upsert and return the counts and the resulting rows, keyed by the (lower case) key value
+    '''
+    _column = getattr(model, key)
+    _norm = (lambda v: v.lower() if v else v) if ignore_case else (lambda v: v)
+    # last object wins if a key is repeated
+    _objects = { _norm(getattr(o, key)): o for o in objects }
+    _keys = list(_objects.keys())
+    _rows = {}
+    for i in range(0, len(_keys), chunk_size):
+        _chunk = _keys[i:i + chunk_size]
+        _query = db.query(model).filter((func.lower(_column) if ignore_case else _column).in_(_chunk))
+        _rows.update({ _norm(getattr(r, key)): r for r in _query.all() })
+    _columns = [c.name for c in model.__table__.columns]
+    _counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    _new = []
+    for _key, _obj in _objects.items():
+        _row = _rows.get(_key)
+        if _row is None:
+            logger.debug(f'creating {model.__tablename__} {_key}')
+            _row = model(**_obj.dict())
+            _new.append(_row)
+            _rows[_key] = _row
+            _counts['created'] += 1
+            continue
+        _update = { col: val for col, val in _obj.dict(exclude_unset=True).items()
+                        if col in _columns and getattr(_row, col) != val }
+        # keep the db key, e.g. the username case when matching case insensitive
+        _update.pop(key, None)
+        if _update:
+            logger.debug(f'updating {model.__tablename__} {_key}: {_update}')
+            for col, val in _update.items():
+                setattr(_row, col, val)
+            _counts['updated'] += 1
+        else:
+            _counts['unchanged'] += 1
+    db.add_all(_new)
+    # the flush batches the inserts, and the updates setting the same columns
+    if _counts['created'] or _counts['updated']:
+        _commit(db)
+    return _counts, _rows
+
+def upsert(db: Session, model, objects: list, key: str = 'id', ignore_case: bool = False):
+    '''
+    create or update a batch of pydantic objects as rows of model
+    - existing rows are fetched with one IN query on key, matched case insensitive if ignore_case
+    - new rows are created from all fields, like model(**obj.dict())
+    - existing rows only get the fields set on the object (exclude_unset) that differ from the db
+    - all inserts and updates are flushed together, then committed (unless in a unit of work)
+    returns the counts of created, updated and unchanged rows
+    '''
+    return _upsert(db, model, objects, key=key, ignore_case=ignore_case)[0]
+
+
 ################# system stats
 def set_stat(db: Session, name: str, value: str, desc: str = '', isstring: bool = True):
     _stat = db.query(models.SystemStats).filter(models.SystemStats.name == name).first()
@@ -50,12 +149,59 @@ def set_stat(db: Session, name: str, value: str, desc: str = '', isstring: bool
         db.query(models.SystemStats).\
             filter(models.SystemStats.name == name).\
             update({"value": value, "description": desc, 'isstring': isstring})
-    db.commit()
-    db.flush()
+    _commit(db)
 
 def get_stat(db: Session, name:str):
     return db.query(models.SystemStats).filter(models.SystemStats.name == name).first()
 
+################# job leases
+def acquire_lease(db: Session, name: str, owner: str, ttl: int) -> bool:
+    '''
+    take the lease on a job for ttl seconds, or renew it if owner holds it already
+    fails if another owner holds an unexpired lease, the check and the write are one statement
+    leases are committed right away so other workers see them, use a session of their own
+    '''
+    _stmt = pg_insert(models.JobLease).values(name=name, owner=owner, acquired=func.now(),
+                                              expires=func.now() + timedelta(seconds=ttl))
+    _stmt = _stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'owner': _stmt.excluded.owner,
+              'acquired': case((models.JobLease.owner == owner, models.JobLease.acquired), else_=_stmt.excluded.acquired),
+              'expires': _stmt.excluded.expires},
+        where=or_(models.JobLease.owner == owner, models.JobLease.expires <= func.now()))
+    _held = db.execute(_stmt.returning(models.JobLease.name)).first() is not None
+    db.commit()
+    return _held
+
+def renew_lease(db: Session, name: str, owner: str, ttl: int) -> bool:
+    '''
+    extend the unexpired lease owner holds on a job to ttl seconds from now
+    unlike acquire_lease this fails once the lease has expired or was released, so a holder
+    still running cannot take back a lease an admin reset
+    '''
+    _renewed = db.query(models.JobLease).\
+                filter(models.JobLease.name == name).\
+                filter(models.JobLease.owner == owner).\
+                filter(models.JobLease.expires > func.now()).\
+                update({'expires': func.now() + timedelta(seconds=ttl)}, synchronize_session=False)
+    db.commit()
+    return _renewed > 0
+
+def release_lease(db: Session, name: str, owner: str):
+    '''
+    expire the lease on a job now, only if owner still holds it
+    '''
+    db.query(models.JobLease).\
+        filter(models.JobLease.name == name).\
+        filter(models.JobLease.owner == owner).\
+        update({'expires': func.now()}, synchronize_session=False)
+    db.commit()
+
+def get_active_lease(db: Session, name: str):
+    return db.query(models.JobLease).\
+            filter(models.JobLease.name == name).\
+            filter(models.JobLease.expires > func.now()).first()
+
 ################# user
 def get_user(db: Session, username: str, password: str):
     return db.query(models.PUser).filter(models.PUser.username == username).filter(models.PUser.password == password).first()
@@ -63,8 +209,7 @@ def get_user(db: Session, username: str, password: str):
 def create_user(db: Session, username: str, password: str, desc: str):
     user = models.PUser(username=username, password=password, desc=desc)
     db.add(user)
-    db.commit()
-    db.flush()
+    _commit(db)
 
 def create_admin_if_not_exist(db: Session):
     _admin = db.query(models.PUser).filter(models.PUser.username == config.get("admin", "admin_username")).first()
@@ -91,6 +236,32 @@ def get_datasets(db: Session, username: str):
             join(models.Dataset.booking).\
             filter(func.lower(models.Booking.username) == username.lower()).all()
 
+DATASET_FIELDS = [c.name for c in models.Dataset.__table__.columns]
+
+def list_datasets(db: Session, username: str = None, bookingid: int = None, fields: list = None,
+                  after_id: int = None, limit: int = None, since: datetime.date = None, until: datetime.date = None):
+    '''
+    datasets of a user's bookings or of one booking, in id order, as rows of the given fields (id always included)
+    after_id and limit give the page after the last id a client has seen
+    since and until are days in the ppms timezone, inclusive, matched against modified
+    '''
+    _query = db.query(*[getattr(models.Dataset, f) for f in ['id'] + [f for f in (fields or DATASET_FIELDS) if f != 'id']])
+    if username:
+        _query = _query.join(models.Dataset.booking).\
+                    filter(func.lower(models.Booking.username) == username.lower())
+    if bookingid is not None:
+        _query = _query.filter(models.Dataset.bookingid == bookingid)
+    if after_id is not None:
+        _query = _query.filter(models.Dataset.id > after_id)
+    if since:
+        _query = _query.filter(models.Dataset.modified >= utils.ppms_day_range(since)[0])
+    if until:
+        _query = _query.filter(models.Dataset.modified < utils.ppms_day_range(until)[1])
+    _query = _query.order_by(models.Dataset.id)
+    if limit:
+        _query = _query.limit(limit)
+    return _query.all()
+
 def get_datasets_from_original(db: Session, username: str, origmachine: str, origpath: str):
     _usr = username.lower()
     return db.query(models.Dataset).\
@@ -100,10 +271,12 @@ def get_datasets_from_original(db: Session, username: str, origmachine: str, ori
             filter(or_(func.lower(models.Booking.username) == _usr, func.lower(models.Booking.assistant) == _usr)).all()
 
 def get_datasets_from_one_machine(db: Session, username: str, origmachine: str, date: datetime.date):
+    # the day in the ppms timezone, as a range on the bare column so the index can be used
+    _start, _end = utils.ppms_day_range(date)
     return db.query(models.Dataset).\
-            filter(and_(func.date(models.Dataset.modified) >= date),\
-                    (func.date(models.Dataset.modified) <= date )).\
             filter(models.Dataset.originalmachine == origmachine).\
+            filter(models.Dataset.modified >= _start).\
+            filter(models.Dataset.modified < _end).\
         join(models.Dataset.booking).\
             filter(func.lower(models.Booking.username) == username.lower()).all()
 
@@ -151,14 +324,25 @@ def create_dataset(db: Session, dataset: schemas.DatasetCreate):
         db.add(afile)
         db.flush()
         dataset.files.append(afile)
-    db.commit()
+    _commit(db)
     # send email
     if dataset.mode == models.Mode.imported and dataset.status == models.Status.success:
         # send email
         logger.debug("Send email about the import")
-        _dataset_info = summarize_dataset_info(db, datasetModel.id)
-        if _dataset_info:
-            send_import_email(db, _dataset_info)
+        _row = _dataset_with_relations(db, datasetModel.id)
+        if _row:
+            # the response carries the booking, user, system and project, up to the first one missing
+            _, _booking, _user, _, _system, _project = _row
+            if _booking:
+                datasetModel.booking = _booking
+                datasetModel.user = _user
+                if _user:
+                    datasetModel.system = _system
+                    if _system:
+                        datasetModel.project = _project
+            _dataset_info = _summarize(_row)
+            if _dataset_info:
+                send_import_email(db, _dataset_info)
     return datasetModel
 
 
@@ -167,18 +351,15 @@ def send_import_email(db, _dataset_info):
     send an import email
     """
     _title = f"Successfully imported dataset to RDM"
-    _to_address = _dataset_info.user.email
-    # if this dataset is a result of a assistance
-    if _dataset_info.booking and _dataset_info.booking.assistant:
-        _to_address = get_ppms_user(db, _dataset_info.booking.assistant).email
-    _cloud_rdm_url=f"https://cloud.rdm.uq.edu.au/index.php/apps/files/?dir=/{_dataset_info.project.collection}/{_dataset_info.relpathfromrootcollection}"
+    _to_address = _dataset_info.to_address
+    _cloud_rdm_url=f"https://cloud.rdm.uq.edu.au/index.php/apps/files/?dir=/{_dataset_info.collection}/{_dataset_info.relpathfromrootcollection}"
     _samba_url = 'smb:' + _dataset_info.networkpath.replace('\\', '/')
     _contents = f"""
                 <html>
                     <head></head>
                     <body>
-                        <p>Dear {_dataset_info.user.name},<br /></p>
-                        <p>Pitschi has successfully imported dataset from {_dataset_info.system.name} into RDM {_dataset_info.project.collection} for project "{_dataset_info.project.name}".</p>
+                        <p>Dear {_dataset_info.user_name},<br /></p>
+                        <p>Pitschi has successfully imported dataset from {_dataset_info.system_name} into RDM {_dataset_info.collection} for project "{_dataset_info.project_name}".</p>
 
                         <p>You can view the dataset using the following systems (please allow time for synchronization):</p>
                             <ul>
@@ -186,8 +367,8 @@ def send_import_email(db, _dataset_info):
                                 <li><b>Windows</b> Enter this text into File Explorer: <b>{_dataset_info.networkpath}</b>. Please use your UQ username (eg: uq\\uqxxxxxx) and password.</li>
                                 <li><b>MacOS</b> Go to Finder and then on the menu Go-> Connect to Server.... Enter this text: <b>{_samba_url}</b>. Please use your UQ username (eg: uq\\uqxxxxxx) and password.</li>
                                 <li><b>Linux</b> Enter this text into File Manager (Caja, Nautilus, etc): <b>{_samba_url}</b>. Please use your UQ username (eg: uq\\uqxxxxxx) and password.</li>
-                                <li><b>CVL</b> Look for collection: <b>{_dataset_info.project.collection.strip().split("-")[-1]}</b> and then {_dataset_info.relpathfromrootcollection}</li>
-                                <li><b>Image Processing Portal</b> <a href="https://ipp.rcc.uq.edu.au/?component=filesmanager&relpath={_dataset_info.project.collection.strip().split("-")[-1]}/{_dataset_info.relpathfromrootcollection}">here</a></li>
+                                <li><b>CVL</b> Look for collection: <b>{_dataset_info.collection.strip().split("-")[-1]}</b> and then {_dataset_info.relpathfromrootcollection}</li>
+                                <li><b>Image Processing Portal</b> <a href="https://ipp.rcc.uq.edu.au/?component=filesmanager&relpath={_dataset_info.collection.strip().split("-")[-1]}/{_dataset_info.relpathfromrootcollection}">here</a></li>
                             </ul>
                         </p>
                         You will receive another email once the dataset has been successfully ingested into Pitschi.
@@ -209,9 +390,7 @@ def create_file(db: Session, file: schemas.FileCreate):
     afile = models.File(**file.dict())
     afile.dataset_id = file.dataset_id
     db.add(afile)
-    db.flush()
-    db.commit()
-    db.refresh(afile)
+    _commit(db, afile)
 
 def update_dataset_space_datasetid(db: Session, datasetid: int, spaceid: str, clowderdatasetid: str):
     updateObj = {}
@@ -222,7 +401,7 @@ def update_dataset_space_datasetid(db: Session, datasetid: int, spaceid: str, cl
     db.query(models.Dataset).\
         filter(models.Dataset.id == datasetid).\
         update(updateObj)
-    db.commit()
+    _commit(db)
 
 def update_dataset_mode_status(db: Session, datasetid: int, mode: models.Mode, status: models.Status):
     update_obj = {"mode": mode, "status": status}
@@ -231,7 +410,7 @@ def update_dataset_mode_status(db: Session, datasetid: int, mode: models.Mode, s
     db.query(models.Dataset).\
         filter(models.Dataset.id == datasetid).\
         update(update_obj)
-    db.commit()
+    _commit(db)
 
 def update_file_mode_status(db: Session, fileid: int, mode: models.Mode, status: models.Status):
     update_obj = {"mode": mode, "status": status}
@@ -240,7 +419,7 @@ def update_file_mode_status(db: Session, fileid: int, mode: models.Mode, status:
     db.query(models.File).\
         filter(models.File.id == fileid).\
         update(update_obj)
-    db.commit()
+    _commit(db)
 
 def update_file(db: Session, fileid: int, updatedata: dict):
     _file_in_db = get_file(db, fileid)
@@ -249,8 +428,7 @@ def update_file(db: Session, fileid: int, updatedata: dict):
         stored_f_model = schemas.File(**existing_f_dic)
         updated_f_item = stored_f_model.copy(update=updatedata)
         db.query(models.File).filter(models.File.id == fileid).update(updated_f_item.dict())
-        db.flush()
-        db.commit()
+        _commit(db)
             
 
 def update_dataset(db: Session, datasetid: int , dataset: schemas.DatasetCreate):
@@ -278,8 +456,6 @@ def update_dataset(db: Session, datasetid: int , dataset: schemas.DatasetCreate)
         logger.debug(f"updated dataset: {updated_ds_item_dict}")
         db.query(models.Dataset).filter(models.Dataset.id == datasetid).update(updated_ds_item_dict)
         ## TODO: send an email here if the update is about imported successfully, saying the data is already in RDM, but not yet ingester
-        db.flush()
-        db.commit()
         for file in files:
             if file.received:
                 file.received = utils.convert_to_utc(file.received)
@@ -298,8 +474,8 @@ def update_dataset(db: Session, datasetid: int , dataset: schemas.DatasetCreate)
                 afile = models.File(**file.dict())
                 afile.dataset_id = datasetid
                 db.add(afile)
-                db.flush()
-            db.commit()
+        # the dataset and all its files in one commit
+        _commit(db)
         logger.debug(f"@update dataset: dataset mode={dataset.mode} dataset status= {dataset.status}")
         if _ds_mode_db == models.Mode.imported and  _ds_status_db == models.Status.ongoing and \
             dataset.mode == models.Mode.imported and dataset.status == models.Status.success:
@@ -319,27 +495,7 @@ def create_core(db: Session, core: schemas.Core):
     """
     Create a PPMS core, or update if needed
     """
-    _a_core = get_core(db, core.id)
-    if _a_core:
-        core_update = core.dict(exclude_unset=True)
-        for col in [c.name for c in _a_core.__table__.columns]:
-            if col in core_update:
-                if getattr(_a_core, col) == core_update[col]:
-                    core_update.pop(col)
-        if core_update:
-            logger.debug(f'updating core {core.id}: {core_update}')
-            db.query(models.Core).filter(models.Core.id == core.id).update(core_update)
-            db.flush()
-            db.commit()
-            db.refresh(_a_core)
-    else:
-        logger.debug(f'creating core {core.id}')
-        _a_core = models.Core(**core.dict())
-        db.add(_a_core)
-        db.flush()
-        db.commit()
-        db.refresh(_a_core)
-    return _a_core
+    return _upsert(db, models.Core, [core])[1][core.id]
 
 def get_system(db: Session, systemid: int):
     return db.query(models.System).\
@@ -361,27 +517,7 @@ def create_system(db: Session, system: schemas.System):
     """
     Create a PPMS system, or update if needed
     """
-    _a_system = get_system(db, system.id)
-    if _a_system:
-        system_update = system.dict(exclude_unset=True)
-        for col in [c.name for c in _a_system.__table__.columns]:
-            if col in system_update:
-                if getattr(_a_system, col) == system_update[col]:
-                    system_update.pop(col)
-        if system_update:
-            logger.debug(f'updating system {system.id}: {system_update}')
-            db.query(models.System).filter(models.System.id == system.id).update(system_update)
-            db.flush()
-            db.commit()
-            db.refresh(_a_system)
-    else:
-        logger.debug(f'creating system {system.id}')
-        _a_system = models.System(**system.dict())
-        db.add(_a_system)
-        db.flush()
-        db.commit()
-        db.refresh(_a_system)
-    return _a_system
+    return _upsert(db, models.System, [system])[1][system.id]
 
 def get_ppms_user(db: Session, username: str):
     _user = username.lower() if username else username
@@ -392,6 +528,15 @@ def get_ppms_user_by_uid(db: Session, uid: int):
     return db.query(models.User).\
             filter(models.User.userid == uid).all()
 
+def get_ppms_usernames_by_uid(db: Session, uids: list):
+    '''
+    db usernames of the given ppms user ids, keyed by user id
+    '''
+    if not uids:
+        return {}
+    return { u.userid: u.username for u in db.query(models.User).\
+                filter(models.User.userid.in_(set(uids))).all() }
+
 def get_ppms_user_by_email(db: Session, email: str):
     return db.query(models.User).\
             filter(models.User.email == email).first()
@@ -400,49 +545,72 @@ def create_ppms_user(db: Session, user: schemas.User):
     '''
     create user, or update if needed
     '''
-    _a_user = get_ppms_user(db, user.username)
-    if _a_user:
-        user_update = user.dict(exclude_unset=True)
-        for col in [c.name for c in _a_user.__table__.columns]:
-            if col in user_update:
-                if getattr(_a_user, col) == user_update[col]:
-                    user_update.pop(col)
-        if user_update:
-            logger.debug(f'updating user {user.username}: {user_update}')
-            db.query(models.User).filter(func.lower(models.User.username) == user.username.lower()).update(user_update, synchronize_session='fetch')
-            db.flush()
-            db.commit()
-            db.refresh(_a_user)
-    else:
-        logger.debug(f'creating user {user.username}')
-        _a_user = models.User(**user.dict())
-        db.add(_a_user)
-        db.flush()
-        db.commit()
-        db.refresh(_a_user)
-    return _a_user
-    
+    return _upsert(db, models.User, [user], key='username', ignore_case=True)[1][user.username.lower()]
+
+def upsert_ppms_users(db: Session, users: list, chunk_size: int = 1000):
+    '''
+    create or update many users in one transaction, chunk_size users per statement
+    usernames are matched case insensitive, an existing user keeps its username
+    returns the counts of inserted, updated and unchanged users
+    '''
+    _users = { u.username.lower(): u for u in parse_obj_as(List[schemas.User], users) }
+    _counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    if not _users:
+        return _counts
+    _db_usernames = { u.username.lower(): u.username for u in db.query(models.User.username).\
+                        filter(func.lower(models.User.username).in_(list(_users.keys()))).all() }
+    _rows = [ {'username': _db_usernames.get(k, u.username), 'userid': u.userid, 'name': u.name, 'email': u.email}
+                for k, u in _users.items() ]
+    _table = models.User.__table__
+    _written = []
+    for i in range(0, len(_rows), chunk_size):
+        _stmt = pg_insert(_table).values(_rows[i:i + chunk_size])
+        _stmt = _stmt.on_conflict_do_update(
+            index_elements=['username'],
+            set_={ c: _stmt.excluded[c] for c in ('userid', 'name', 'email') },
+            where=or_(*[_table.c[c].is_distinct_from(_stmt.excluded[c]) for c in ('userid', 'name', 'email')]))
+        # xmax is 0 for a freshly inserted row, rows skipped by the where clause are not returned
+        _written.extend(db.execute(_stmt.returning(_table.c.username, literal_column('xmax = 0').label('inserted'))).all())
+    _commit(db)
+    _counts['inserted'] = sum(1 for r in _written if r.inserted)
+    _counts['updated'] = len(_written) - _counts['inserted']
+    _counts['unchanged'] = len(_rows) - len(_written)
+    logger.debug(f'upserted {len(_rows)} users: {_counts}')
+    return _counts
+
+def get_duplicate_userids(db: Session, uids: list = None):
+    '''
+    ppms user ids shared by more than one user, with their usernames
+    only the given user ids are checked if uids is set
+    '''
+    _query = db.query(models.User.userid, func.array_agg(models.User.username)).\
+                filter(models.User.userid.isnot(None))
+    if uids is not None:
+        if not uids:
+            return {}
+        _query = _query.filter(models.User.userid.in_(set(uids)))
+    return { userid: usernames for userid, usernames in _query.\
+                group_by(models.User.userid).\
+                having(func.count() > 1).all() }
+
 def update_ppms_user_id(db: Session, userlogin: str, uid: int):
     _ppms_user = get_ppms_user(db, userlogin)
     if _ppms_user:
         _ppms_user.userid = uid
-        db.flush()
-        db.commit()
+        _commit(db)
         
 
 def update_ppms_user_email(db: Session, userlogin: str, email: str):
     _ppms_user = get_ppms_user(db, userlogin)
     if _ppms_user:
         _ppms_user.email = email
-        db.flush()
-        db.commit()
+        _commit(db)
 
 def update_ppms_user_name(db: Session, userlogin: str, name: str):
     _ppms_user = get_ppms_user(db, userlogin)
     if _ppms_user:
         _ppms_user.name = name
-        db.flush()
-        db.commit()
+        _commit(db)
 
 def get_booking(db: Session, bookingid: int):
     return db.query(models.Booking).\
@@ -453,64 +621,58 @@ def get_bookings(db: Session, bookingdate: datetime.date):
             filter(models.Booking.bookingdate == bookingdate). \
             filter(models.Booking.cancelled == False).all()
 
+def _with_project_caches(db: Session, query):
+    '''
+    run a booking query with the project of each booking joined in, and load the caches
+    of all their collections in one more query, whatever the number of bookings
+    booking.project.caches is highest priority first, each cache a dict of name, path and priority
+    '''
+    _rows = query.add_entity(models.Project).\
+                outerjoin(models.Project, models.Project.id == models.Booking.projectid).all()
+    _collections = { _project.collection for _, _project in _rows if _project and _project.collection }
+    _caches = {}
+    if _collections:
+        _cache_rows = db.query(models.CollectionCache.collection_name, models.CollectionCache.priority, models.Cache.name, models.Cache.path).\
+                        join(models.Cache, models.Cache.name == models.CollectionCache.cache_name).\
+                        filter(models.CollectionCache.collection_name.in_(_collections)).\
+                        order_by(models.CollectionCache.collection_name, models.CollectionCache.priority.desc()).all()
+        for _c_name, _priority, _name, _path in _cache_rows:
+            _caches.setdefault(_c_name, []).append({'name': _name, 'path': _path, 'priority': _priority})
+    bookings = []
+    for booking, _project in _rows:
+        if booking.projectid:
+            booking.project = _project
+            if _project and _project.collection:
+                _project.caches = _caches.get(_project.collection, [])
+        bookings.append(booking)
+    return bookings
+
 def get_bookings_filter_system(db: Session, systemid: int, bookingdate: datetime.date):
-    # there may be a better way
-    bookings =  db.query(models.Booking).\
+    return _with_project_caches(db, db.query(models.Booking).\
                 filter(models.Booking.systemid == systemid). \
                 filter(models.Booking.username != None). \
                 filter(models.Booking.bookingdate == bookingdate). \
-                filter(models.Booking.cancelled == False).all()
-    for booking in bookings:
-        if booking.projectid:
-            booking.project = get_project(db, booking.projectid)
-            if booking.project.collection:
-                _c_caches = db.query(models.CollectionCache).\
-                            filter(models.CollectionCache.collection_name == booking.project.collection).\
-                            order_by(models.CollectionCache.priority.desc()).all()
-                _caches = []
-                for _c_cache in _c_caches:
-                    _cache = db.query(models.Cache).filter(models.Cache.name == _c_cache.cache_name).one_or_none()
-                    if _cache:
-                        _cache.priority = _c_cache.priority
-                        _caches.append(_cache)
-                booking.project.caches = _caches
-    return bookings
+                filter(models.Booking.cancelled == False))
 
 
 def get_bookings_filter_system_and_user(db: Session, systemid: int, bookingdate: datetime.date, username: str):
     _usr = username.lower()
-    bookings =  db.query(models.Booking).\
+    return _with_project_caches(db, db.query(models.Booking).\
                 filter(models.Booking.systemid == systemid). \
                 filter(or_(func.lower(models.Booking.username) == _usr, func.lower(models.Booking.assistant) == _usr)). \
                 filter(models.Booking.bookingdate == bookingdate). \
                 filter(models.Booking.cancelled == False).\
-                join(models.UserProject).\
+                join(models.Booking.userproject).\
                 filter(func.lower(models.UserProject.username) == func.lower(models.Booking.username)).\
                 filter(models.UserProject.projectid == models.Booking.projectid).\
-                filter(models.UserProject.enabled).all()
-    for booking in bookings:
-        if booking.projectid:
-            booking.project = get_project(db, booking.projectid)
-            if booking.project.collection:
-                _c_caches = db.query(models.CollectionCache).\
-                            filter(models.CollectionCache.collection_name == booking.project.collection).\
-                            order_by(models.CollectionCache.priority.desc()).all()
-                _caches = []
-                for _c_cache in _c_caches:
-                    _cache = db.query(models.Cache).filter(models.Cache.name == _c_cache.cache_name).one_or_none()
-                    if _cache:
-                        _cache.priority = _c_cache.priority
-                        _caches.append(_cache)
-                booking.project.caches = _caches
-    return bookings
+                filter(models.UserProject.enabled))
 
 
 def cancel_booking(db: Session, bookingid: int):
     booking = get_booking(db, bookingid)
     if booking:
         booking.cancelled = True
-        db.flush()
-        db.commit()
+        _commit(db)
 
 def create_booking(db: Session, booking_session: schemas.Booking):
     '''
@@ -526,28 +688,110 @@ def create_booking(db: Session, booking_session: schemas.Booking):
             userprojectobj = models.UserProject(username=session.username, projectid=session.projectid, enabled=False)
             db.add(userprojectobj)
             db.flush()
-    booking = get_booking(db, session.id)
-    if booking:
-        # update -> important
-        booking_update = session.dict(exclude_unset=True)
-        for col in [c.name for c in booking.__table__.columns]:
-            if col in booking_update:
-                if getattr(booking, col) == booking_update[col]:
-                    booking_update.pop(col)
-        if booking_update:
-            logger.debug(f'updating booking {session.id}: {booking_update}')
-            db.query(models.Booking).filter(models.Booking.id == session.id).update(booking_update)
-            db.flush()
-            db.commit()
-            db.refresh(booking)
-    else:
-        logger.debug(f'creating booking {session.id}')
-        booking = models.Booking(**session.dict())
-        db.add(booking)
-        db.flush()
-        db.commit()
-        db.refresh(booking)
-    return booking
+    return _upsert(db, models.Booking, [session])[1][session.id]
+
+def upsert_bookings(db: Session, booking_sessions: list, chunk_size: int = 1000):
+    '''
+    create or update many bookings in one transaction
+    - adds the disabled project members needed for the booking foreign key in bulk
+    - upserts bookings with INSERT ... ON CONFLICT DO UPDATE, rows are only written if a value changed
+    like create_booking, only the fields that were set on a booking are updated
+    returns the counts of inserted, updated and unchanged bookings
+    '''
+    # a booking can only be upserted once per statement, keep the last one
+    sessions = list({ s.id: s for s in parse_obj_as(List[schemas.Booking], booking_sessions) }.values())
+    _counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    if not sessions:
+        return _counts
+    # need to add a disabled project member for booking foreign key constraint with userproject
+    _members = { (s.username, s.projectid) for s in sessions if s.username and s.projectid }
+    if _members:
+        _existing = { (u.username.lower(), u.projectid) for u in db.query(models.UserProject).\
+                        filter(models.UserProject.projectid.in_({ m[1] for m in _members })).\
+                        filter(func.lower(models.UserProject.username).in_({ m[0].lower() for m in _members })).all() }
+        _missing = [ {'username': m[0], 'projectid': m[1], 'enabled': False} for m in _members if (m[0].lower(), m[1]) not in _existing ]
+        if _missing:
+            logger.debug(f'adding {len(_missing)} booking project members')
+            db.execute(pg_insert(models.UserProject).values(_missing).on_conflict_do_nothing())
+    # bookings with the same set fields share a statement
+    _groups = {}
+    for s in sessions:
+        _row = s.dict(exclude_unset=True)
+        _groups.setdefault(tuple(sorted(_row.keys())), []).append(_row)
+    _table = models.Booking.__table__
+    for _cols, _rows in _groups.items():
+        _update_cols = [c for c in _cols if c != 'id']
+        for i in range(0, len(_rows), chunk_size):
+            _stmt = pg_insert(_table).values(_rows[i:i + chunk_size])
+            _stmt = _stmt.on_conflict_do_update(
+                index_elements=['id'],
+                set_={ c: _stmt.excluded[c] for c in _update_cols },
+                where=or_(*[_table.c[c].is_distinct_from(_stmt.excluded[c]) for c in _update_cols]))
+            # xmax is 0 for a freshly inserted row, rows skipped by the where clause are not returned
+            _written = db.execute(_stmt.returning(_table.c.id, literal_column('xmax = 0').label('inserted'))).all()
+            _inserted = sum(1 for r in _written if r.inserted)
+            _counts['inserted'] += _inserted
+            _counts['updated'] += len(_written) - _inserted
+    _counts['unchanged'] = len(sessions) - _counts['inserted'] - _counts['updated']
+    _commit(db)
+    logger.debug(f'upserted {len(sessions)} bookings: {_counts}')
+    return _counts
+
+def get_booking_fingerprints(db: Session, bookingids: list):
+    '''
+    stored fingerprints of the given bookings, as dicts keyed by booking id
+    '''
+    if not bookingids:
+        return {}
+    return { fp.id: row2dict(fp, True) for fp in db.query(models.BookingFingerprint).\
+                filter(models.BookingFingerprint.id.in_(bookingids)).all() }
+
+def set_booking_fingerprints(db: Session, fingerprints: list):
+    '''
+    store many (booking id, report hash, fingerprint) in one statement
+    '''
+    if not fingerprints:
+        return
+    _now = datetime.now(pytz.utc)
+    _stmt = pg_insert(models.BookingFingerprint).values([
+        {'id': i, 'reporthash': r, 'fingerprint': f, 'checked': _now} for i, r, f in { fp[0]: fp for fp in fingerprints }.values() ])
+    db.execute(_stmt.on_conflict_do_update(
+        index_elements=['id'],
+        set_={'reporthash': _stmt.excluded.reporthash, 'fingerprint': _stmt.excluded.fingerprint, 'checked': _stmt.excluded.checked}))
+    _commit(db)
+
+def touch_booking_fingerprints(db: Session, bookingids: list):
+    '''
+    mark the given bookings as checked now, without changing their fingerprints
+    '''
+    if bookingids:
+        db.query(models.BookingFingerprint).\
+            filter(models.BookingFingerprint.id.in_(bookingids)).\
+            update({'checked': datetime.now(pytz.utc)}, synchronize_session=False)
+        _commit(db)
+
+def get_project_fingerprints(db: Session, projectids: list):
+    '''
+    stored member list hashes of the given projects, keyed by project id
+    '''
+    if not projectids:
+        return {}
+    return { fp.id: fp.members for fp in db.query(models.ProjectFingerprint).\
+                filter(models.ProjectFingerprint.id.in_(projectids)).all() }
+
+def set_project_fingerprints(db: Session, fingerprints: dict):
+    '''
+    store the member list hashes of many projects, keyed by project id, in one statement
+    '''
+    if not fingerprints:
+        return
+    _now = datetime.now(pytz.utc)
+    _stmt = pg_insert(models.ProjectFingerprint).values([
+        {'id': i, 'members': m, 'checked': _now} for i, m in fingerprints.items() ])
+    db.execute(_stmt.on_conflict_do_update(
+        index_elements=['id'],
+        set_={'members': _stmt.excluded.members, 'checked': _stmt.excluded.checked}))
+    _commit(db)
 
 def get_project(db: Session, projectid: int):
     return db.query(models.Project).\
@@ -559,88 +803,80 @@ def get_project_users(db: Session, projectid: int):
             filter(models.UserProject.projectid == projectid).all()
 
 def update_project_users(db: Session, projectid: int, members: list):
-    _dedup_members = list(set([m.lower() for m in members]))
-    if len(_dedup_members) < len(members):
-        _usrs = ','.join(members)
-        logger.warning(f'ignore duplicate project {projectid} members: {_usrs}')
-    _all_members = db.query(models.UserProject).\
-            filter(models.UserProject.projectid == projectid).all()
-    # add new members
-    _new_members = [m for m in _dedup_members if m not in [u.username.lower() for u in _all_members]]
-    if len(_new_members) > 0:
-        _usrs = ','.join(_new_members)
-        logger.debug(f'add new project {projectid} members: {_usrs}')
-        for _new_member in _new_members:
-            # get db username so we don't break foreign key constraint with wrong case
-            _username = get_ppms_user(db, _new_member).username
-            # add to user's list of projects
-            userprojectobj = models.UserProject(username=_username, projectid=projectid)
-            db.add(userprojectobj)
-        db.flush()
-        db.commit()
+    return reconcile_project_users(db, { projectid: members })
+
+def reconcile_project_users(db: Session, members_by_project: dict):
+    '''
+    make the enabled members of each project in members_by_project the given logins
+    - adds missing members, enables disabled members and disables non-members
+    - logins are matched case insensitive, logins without a db user are ignored
+    the member lists are loaded into a temp table and applied with a few set based statements
+    returns the counts of added, enabled and disabled project members
+    '''
+    _counts = {'added': 0, 'enabled': 0, 'disabled': 0}
+    if not members_by_project:
+        return _counts
+    _rows = []
+    for projectid, members in members_by_project.items():
+        _dedup_members = set([m.lower() for m in members])
+        if len(_dedup_members) < len(members):
+            _usrs = ','.join(members)
+            logger.warning(f'ignore duplicate project {projectid} members: {_usrs}')
+        _rows.extend({'projectid': projectid, 'login': m} for m in _dedup_members)
+    # dropped at the end, or when the transaction commits or rolls back
+    _members = Table('tmp_project_members', MetaData(),
+                     Column('projectid', Integer, nullable=False),
+                     Column('login', String, nullable=False),
+                     prefixes=['TEMPORARY'], postgresql_on_commit='DROP')
+    _members.create(bind=db.connection())
+    if _rows:
+        db.execute(_members.insert(), _rows)
+    _userproject = models.UserProject.__table__
+    _user = models.User.__table__
+    _is_member = and_(_userproject.c.projectid == _members.c.projectid,
+                      func.lower(_userproject.c.username) == _members.c.login)
+    # add new members, with the db username so we don't break foreign key constraint with wrong case
+    _new_members = select(_user.c.username, _members.c.projectid, true()).\
+            distinct(_members.c.projectid, _members.c.login).\
+            select_from(_members.join(_user, func.lower(_user.c.username) == _members.c.login)).\
+            where(~exists().where(_is_member))
+    _counts['added'] = db.execute(pg_insert(_userproject).\
+            from_select(['username', 'projectid', 'enabled'], _new_members).\
+            on_conflict_do_nothing()).rowcount
     # enable members that are currently disabled
-    _disabled_members = db.query(models.UserProject).\
-            filter(~models.UserProject.enabled).\
-            filter(models.UserProject.projectid == projectid).\
-            filter(func.lower(models.UserProject.username).in_(_dedup_members))
-    if _disabled_members.count() > 0:
-        _usrs = ','.join([u.username for u in _disabled_members.all()])
-        logger.debug(f'enable disabled project {projectid} members: {_usrs}')
-        _disabled_members.update({ models.UserProject.enabled: True }, synchronize_session='fetch')
-        db.flush()
-        db.commit()
+    _counts['enabled'] = db.execute(_userproject.update().\
+            where(~_userproject.c.enabled).\
+            where(_is_member).\
+            values(enabled=True)).rowcount
     # disable non-members that are currently enabled
-    _non_members = db.query(models.UserProject).\
-            filter(models.UserProject.enabled).\
-            filter(models.UserProject.projectid == projectid).\
-            filter(~func.lower(models.UserProject.username).in_(_dedup_members))
-    if _non_members.count() > 0:
-        _usrs = ','.join([u.username for u in _non_members.all()])
-        logger.debug(f'disable enabled project {projectid} non-members: {_usrs}')
-        _non_members.update({ models.UserProject.enabled: False }, synchronize_session='fetch')
-        db.flush()
-        db.commit()
+    _counts['disabled'] = db.execute(_userproject.update().\
+            where(_userproject.c.enabled).\
+            where(_userproject.c.projectid.in_(list(members_by_project.keys()))).\
+            where(~exists().where(_is_member)).\
+            values(enabled=False)).rowcount
+    _members.drop(bind=db.connection())
+    _commit(db)
+    logger.debug(f'reconciled members of {len(members_by_project)} projects: {_counts}')
+    return _counts
 
 def create_project(db: Session, project: schemas.Project):
     """
     Create a new project, or update if needed
     """
-    _a_project = get_project(db, project.id)
-    if _a_project:
-        project_update = project.dict(exclude_unset=True)
-        for col in [c.name for c in _a_project.__table__.columns]:
-            if col in project_update:
-                if getattr(_a_project, col) == project_update[col]:
-                    project_update.pop(col)
-        if project_update:
-            logger.debug(f'updating project {project.id}: {project_update}')
-            db.query(models.Project).filter(models.Project.id == project.id).update(project_update)
-            db.flush()
-            db.commit()
-            db.refresh(_a_project)
-    else:
-        logger.debug(f'creating project {project.id}')
-        _a_project = models.Project(**project.dict())
-        db.add(_a_project)
-        db.flush()
-        db.commit()
-        db.refresh(_a_project)
-    return _a_project
+    return _upsert(db, models.Project, [project])[1][project.id]
 
 def update_project_collection(db: Session, id: int, q_collection: str):
     project = get_project(db, id)
     if project and (project.collection != q_collection):
         logger.debug(f'updating project {project.id} collection: {project.collection} -> {q_collection}')
         project.collection = q_collection
-        db.flush()
-        db.commit()
+        _commit(db)
 
 def update_project_name(db: Session, id: int, name: str):
     project = get_project(db, id)
     if project:
         project.name = name
-        db.flush()
-        db.commit()
+        _commit(db)
 
 def get_imported_success_datasets(db: Session):
     return db.query(models.Dataset).\
@@ -661,28 +897,79 @@ def get_booking_datasets(db: Session, bookingid: int):
             all()
 
 
+class DatasetInfo(NamedTuple):
+    '''
+    read-only summary of a dataset with its booking, user, system and project, enough to render a notification
+    '''
+    id: int
+    datasetid: str
+    space: str
+    originalmachine: str
+    originalpath: str
+    networkpath: str
+    relpathfromrootcollection: str
+    bookingid: int
+    systemid: int
+    username: str
+    projectid: int
+    assistant: Optional[str]
+    user_name: Optional[str]
+    user_email: Optional[str]
+    assistant_email: Optional[str]
+    system_name: Optional[str]
+    project_name: Optional[str]
+    collection: Optional[str]
+
+    @property
+    def to_address(self):
+        # if this dataset is a result of a assistance
+        if self.assistant and self.assistant_email:
+            return self.assistant_email
+        return self.user_email
+
+def _dataset_with_relations(db: Session, datasetid: int):
+    '''
+    dataset, booking, user, assistant's email, system and project of a dataset in one query
+    any but the dataset is None if missing
+    '''
+    _assistant = aliased(models.User)
+    return db.query(models.Dataset, models.Booking, models.User, _assistant.email, models.System, models.Project).\
+            outerjoin(models.Booking, models.Booking.id == models.Dataset.bookingid).\
+            outerjoin(models.User, func.lower(models.User.username) == func.lower(models.Booking.username)).\
+            outerjoin(_assistant, func.lower(_assistant.username) == func.lower(models.Booking.assistant)).\
+            outerjoin(models.System, models.System.id == models.Booking.systemid).\
+            outerjoin(models.Project, models.Project.id == models.Booking.projectid).\
+            filter(models.Dataset.id == datasetid).first()
+
+def _summarize(row):
+    '''
+    DatasetInfo of a _dataset_with_relations row, or None if any of them is missing
+    '''
+    dataset, booking, user, assistant_email, system, project = row
+    if not booking:
+        logger.error(f'booking not found: dataset id {dataset.id}')
+        return None
+    if not user:
+        logger.error(f'booking user not found: dataset id {dataset.id}, booking id {booking.id}')
+        return None
+    if not system:
+        logger.error(f'booking system not found: dataset id {dataset.id}, booking id {booking.id}')
+        return None
+    if not project:
+        logger.error(f'booking project found: dataset id {dataset.id}, booking id {booking.id}')
+        return None
+    return DatasetInfo(dataset.id, dataset.datasetid, dataset.space, dataset.originalmachine, dataset.originalpath,
+                       dataset.networkpath, dataset.relpathfromrootcollection, booking.id, booking.systemid,
+                       booking.username, booking.projectid, booking.assistant, user.name, user.email,
+                       assistant_email, system.name, project.name, project.collection)
+
 def summarize_dataset_info(db: Session, datasetid: int):
-    dataset = get_dataset(db, datasetid)
-    if dataset:
-        booking = get_booking(db, dataset.bookingid)
-        if booking:
-            dataset.booking = booking
-            dataset.user = get_ppms_user(db, booking.username)
-            if not dataset.user:
-                logger.error(f'booking user not found: dataset id {datasetid}, booking id {booking.id}')
-                return None
-            dataset.system = get_system(db, booking.systemid)
-            if not dataset.system:
-                logger.error(f'booking system not found: dataset id {datasetid}, booking id {booking.id}')
-                return None
-            dataset.project = get_project(db, booking.projectid)
-            if not dataset.project:
-                logger.error(f'booking project found: dataset id {datasetid}, booking id {booking.id}')
-                return None
-        else:
-            logger.error(f'booking not found: dataset id {datasetid}')
-            return None
-    return dataset
+    '''
+    dataset, booking, user, assistant, system and project of a dataset in one query
+    returns a DatasetInfo, or None if the dataset or any of them is missing
+    '''
+    _row = _dataset_with_relations(db, datasetid)
+    return _summarize(_row) if _row else None
 
 
 
@@ -698,9 +985,7 @@ def create_collection(db: Session, acollection: schemas.CollectionBase):
         logger.info(f'create collection: {acollection.name}')
         collection = models.Collection(**acollection.dict())
         db.add(collection)
-        db.flush()
-        db.commit()
-        db.refresh(collection)
+        _commit(db, collection)
     return collection
 
 def get_collection_cache(db: Session, collection_name: str, cache_name: str):
@@ -720,9 +1005,7 @@ def create_collection_cache(db: Session, acollectioncache: schemas.CollectionCac
     if not collectioncache:
         collectioncache = models.CollectionCache(**acollectioncache.dict())
         db.add(collectioncache)
-        db.flush()
-        db.commit()
-        db.refresh(collectioncache)
+        _commit(db, collectioncache)
     return collectioncache
 
 
@@ -737,7 +1020,7 @@ def delete_collection_cache(db: Session, collectionid: str, cache_name: str):
                 first()
     if _collection_cache:
         db.delete(_collection_cache)
-        db.commit()
+        _commit(db)
 
 
 #################### get projects info
@@ -745,17 +1028,27 @@ def delete_collection_cache(db: Session, collectionid: str, cache_name: str):
 def get_projects_full(db: Session, userinfo: bool = True, collectioninfo: bool = True):
     """
     Get projects and all its information: collections, users
+    one query for the projects, one for all their participants and one for all their caches
     """
-    projects =  db.query(models.Project).\
-                filter(models.Project.collection != None).\
-                filter(models.Project.active == True).all()
-    for _project in projects:
-        if userinfo:
-            _users = db.query(models.User).join(models.UserProject).filter(models.UserProject.enabled).filter(models.UserProject.projectid == _project.id).all()
-            _project.participants = _users
-        if collectioninfo:
-            _caches = db.query(models.CollectionCache).filter(models.CollectionCache.collection_name == _project.collection).all()
-            _project.caches = _caches
+    _filters = (models.Project.collection != None, models.Project.active == True)
+    projects = db.query(models.Project).filter(*_filters).all()
+    if userinfo:
+        _participants = {}
+        for _projectid, _user in db.query(models.UserProject.projectid, models.User).\
+                            join(models.User, models.User.username == models.UserProject.username).\
+                            join(models.Project, models.Project.id == models.UserProject.projectid).\
+                            filter(models.UserProject.enabled).filter(*_filters).all():
+            _participants.setdefault(_projectid, []).append(_user)
+        for _project in projects:
+            _project.participants = _participants.get(_project.id, [])
+    if collectioninfo:
+        _caches = {}
+        for _c_cache in db.query(models.CollectionCache).\
+                            filter(models.CollectionCache.collection_name.in_(
+                                select(models.Project.collection).filter(*_filters))).all():
+            _caches.setdefault(_c_cache.collection_name, []).append(_c_cache)
+        for _project in projects:
+            _project.caches = _caches.get(_project.collection, [])
     return projects
 
 
@@ -790,9 +1083,7 @@ def update_collection(db: Session, collectionid: str, collectioncacheinfo: schem
         # create a new one
         collectioncache = models.CollectionCache(**collectioncacheinfo.dict())
         db.add(collectioncache)
-        db.flush()
-        db.commit()
-        db.refresh(collectioncache)
+        _commit(db, collectioncache)
     else:
         existing_cc_dic = row2dict(_collection_cache_in_db, True)
         stored_cc_model = schemas.CollectionCacheBase(**existing_cc_dic)
@@ -821,9 +1112,7 @@ def add_daily_task(db: Session, task: schemas.DailyTaskBase):
     """
     dailytask = models.DailyTask(**task.dict())
     db.add(dailytask)
-    db.flush()
-    db.commit()
-    db.refresh(dailytask)
+    _commit(db, dailytask)
     return dailytask
 
 
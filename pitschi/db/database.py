@@ -1,10 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from fastapi_utils.session import FastAPISessionMaker
 import pitschi.config as config
 
 from functools import lru_cache
+import logging
+
+logger = logging.getLogger('pitschixapi')
 
 
 SQLALCHEMY_DATABASE_URL = (f"{config.get('database', 'type')}://"
@@ -24,3 +28,31 @@ Base = declarative_base()
 def _get_fastapi_sessionmaker() -> FastAPISessionMaker:
     """ This function could be replaced with a global variable if preferred """
     return FastAPISessionMaker(SQLALCHEMY_DATABASE_URL)
+
+
+def create_indexes(metadata, bind, concurrently: bool = False):
+    """
+    Create the indexes of metadata that do not exist yet
+    create_all skips tables that exist already, so indexes added to a model later are created here,
+    checkfirst is no use as expression indexes are not reflected
+    concurrently (postgresql) builds each index without blocking writes to its table, an invalid
+    index left behind by an interrupted concurrent build is dropped and built again
+    """
+    _indexes = [index for table in metadata.sorted_tables for index in table.indexes]
+    if not concurrently:
+        with bind.begin() as conn:
+            for index in _indexes:
+                _ddl = str(CreateIndex(index).compile(dialect=bind.dialect))
+                conn.execute(text(_ddl.replace(' INDEX ', ' INDEX IF NOT EXISTS ', 1)))
+        return
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    with bind.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        _invalid = set(conn.execute(text('SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                                         'WHERE NOT i.indisvalid')).scalars())
+        for index in _indexes:
+            if index.name in _invalid:
+                logger.warning(f'dropping invalid index {index.name}')
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+            logger.info(f'creating index {index.name} on {index.table.name}')
+            _ddl = str(CreateIndex(index).compile(dialect=bind.dialect))
+            conn.execute(text(_ddl.replace(' INDEX ', ' INDEX CONCURRENTLY IF NOT EXISTS ', 1)))
@@ -0,0 +1,28 @@
+import logging
+import sys
+
+import pitschi.db as pdb
+
+logger = logging.getLogger('pitschixapi')
+
+
+def main(argv=None):
+    """
+    build the indexes of the models on an existing database without blocking writes
+    pitschi-migrate (python -m pitschi.db.migrate) [--blocking]
+    run it after an upgrade that adds indexes, api and worker processes do not build them
+    unless create_indexes=yes in [database]
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Create missing database indexes')
+    parser.add_argument('--blocking', action='store_true',
+                        help='plain CREATE INDEX in one transaction, for databases other than postgresql')
+    args = parser.parse_args(argv)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+    pdb.database.create_indexes(pdb.models.Base.metadata, pdb.engine,
+                                concurrently=not args.blocking and pdb.engine.dialect.name == 'postgresql')
+    logger.info('indexes up to date')
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import enum, datetime
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Enum, DateTime, func, Date, Time, Interval, ForeignKeyConstraint, null
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Enum, DateTime, func, Date, Time, Interval, ForeignKeyConstraint, Index, null
 from sqlalchemy.orm import relationship
 
 from sqlalchemy.ext.mutable import MutableList
@@ -35,6 +35,18 @@ class SystemStats(Base):
     description = Column(String, unique=False, primary_key=False, index=False, nullable=True)
 
 
+class JobLease(Base):
+    """
+    Cluster wide lock on a scheduled job, held by one worker until expires
+    the holder keeps pushing expires forward while the job runs
+    """
+    __tablename__ = 'joblease'
+    name = Column(String, primary_key=True, index=True, nullable=False)
+    owner = Column(String, primary_key=False, index=False, nullable=False)
+    acquired = Column(DateTime(timezone=True), primary_key=False, index=False, nullable=False)
+    expires = Column(DateTime(timezone=True), primary_key=False, index=False, nullable=False)
+
+
 class PUser(Base):
     __tablename__ = 'puser'
     username = Column(String, unique=True, primary_key=True, index=True, nullable=False)
@@ -67,6 +79,12 @@ class Dataset(Base):
     booking = relationship("Booking", back_populates="datasets")
 
     files = relationship("File", back_populates="dataset")
+    # datasets waiting for ingest, datasets of a booking, and datasets of a machine on a day
+    __table_args__ = (
+        Index('ix_dataset_mode_status', mode, status),
+        Index('ix_dataset_bookingid', bookingid),
+        Index('ix_dataset_originalmachine_modified', originalmachine, modified),
+    )
 
 # not being used atm
 class Repo(Base):
@@ -95,6 +113,10 @@ class File(Base):
     fileid = Column(String, unique=False, primary_key=False, index=False, nullable=False, default="")
     dataset_id = Column(Integer, ForeignKey("dataset.id"), nullable=False)
     dataset =  relationship("Dataset", back_populates="files")
+    # files of a dataset, and a file by its path in a dataset
+    __table_args__ = (
+        Index('ix_file_dataset_id_path', dataset_id, path),
+    )
 
 class Core(Base):
     __tablename__ = 'core'
@@ -131,6 +153,10 @@ class UserProject(Base):
     project = relationship("Project", back_populates="users")
     user = relationship("User", back_populates="projects")
     bookings = relationship("Booking", back_populates="userproject") 
+    # logins are compared case insensitively
+    __table_args__ = (
+        Index('ix_userproject_username_lower_projectid', func.lower(username), projectid),
+    )
     
 class User(Base):
     __tablename__ = 'user'
@@ -139,6 +165,10 @@ class User(Base):
     name = Column(String, primary_key=False, index=False, nullable=False)
     email = Column(String, primary_key=False, index=False, nullable=False)
     projects = relationship("UserProject", back_populates="user")    
+    # logins are compared case insensitively
+    __table_args__ = (
+        Index('ix_user_username_lower', func.lower(username)),
+    )
 
 
 class Project(Base):
@@ -190,6 +220,29 @@ class Collection(Base):
     caches = relationship("CollectionCache", back_populates="collection")
 
 
+class BookingFingerprint(Base):
+    """
+    Hashes of the last synced PPMS booking report row and session details
+    so a booking sync can skip sessions that have not changed
+    """
+    __tablename__ = 'bookingfingerprint'
+    id = Column(Integer, primary_key=True, index=True)
+    reporthash = Column(String, primary_key=False, index=False, nullable=False)
+    fingerprint = Column(String, primary_key=False, index=False, nullable=True)
+    checked = Column(DateTime(timezone=True), primary_key=False, index=False, nullable=False, default=func.timezone('UTC', func.now()))
+
+
+class ProjectFingerprint(Base):
+    """
+    Hash of the last synced PPMS project member list (logins with user details)
+    so a project sync only updates the members of projects that changed
+    """
+    __tablename__ = 'projectfingerprint'
+    id = Column(Integer, ForeignKey('project.id'), primary_key=True, index=True)
+    members = Column(String, primary_key=False, index=False, nullable=False)
+    checked = Column(DateTime(timezone=True), primary_key=False, index=False, nullable=False, default=func.timezone('UTC', func.now()))
+
+
 class Booking(Base):
     __tablename__ = 'booking'
     id = Column(Integer, primary_key=True, index=True)
@@ -213,4 +266,9 @@ class Booking(Base):
             ['username', 'projectid'],
             ['userproject.username', 'userproject.projectid'],
         ),
+        # logins are compared case insensitively
+        Index('ix_booking_username_lower', func.lower(username)),
+        Index('ix_booking_assistant_lower', func.lower(assistant)),
+        # bookings of a system on a day
+        Index('ix_booking_systemid_bookingdate_cancelled', systemid, bookingdate, cancelled),
     )
@@ -0,0 +1,77 @@
+import os
+import asyncio
+import socket
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from sqlalchemy.orm import Session
+import pitschi.config as config
+import pitschi.db as pdb
+
+logger = logging.getLogger('pitschixapi')
+
+##################
+# Cluster wide locks for the scheduled jobs
+# repeat_every starts every job in every uvicorn worker, a run only goes ahead
+# in the worker holding the job's lease in the joblease table. The holder renews
+# the lease from a thread while the job runs, so a worker that dies lets it
+# expire after lease_ttl seconds instead of blocking the job for good
+##################
+
+# one owner per process, the uuid tells apart pids reused by restarted workers
+owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+def _acquire(name: str, ttl: int) -> bool:
+    with Session(pdb.engine) as db:
+        return pdb.crud.acquire_lease(db, name, owner, ttl)
+
+def _extend(name: str, ttl: int) -> bool:
+    with Session(pdb.engine) as db:
+        return pdb.crud.renew_lease(db, name, owner, ttl)
+
+def _release(name: str):
+    with Session(pdb.engine) as db:
+        pdb.crud.release_lease(db, name, owner)
+
+def _renew(name: str, ttl: int, stop: threading.Event):
+    # renew at a third of the ttl, two renewals can fail before the lease runs out
+    while not stop.wait(ttl / 3):
+        try:
+            if not _extend(name, ttl):
+                # expired, reset from the dashboard or taken by another worker, the job runs on unlocked
+                logger.warning(f'job {name}: lease lost, no longer renewing it')
+                return
+        except:
+            logger.warning(f'job {name}: lease renewal failed', exc_info=True)
+
+@contextmanager
+def hold(name: str, ttl: int = None):
+    """
+    Yields True if this worker got the lease on job name, False if another worker holds it
+    The lease is renewed until the block exits and released then
+    The lease queries block, so jobs take it from their sync body in the threadpool
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError(f'job {name}: job_lock.hold blocks the event loop, take it in a threadpool thread')
+    ttl = ttl or int(config.get('jobs', 'lease_ttl', default=300))
+    if not _acquire(name, ttl):
+        logger.debug(f'job {name}: running in another worker')
+        yield False
+        return
+    _stop = threading.Event()
+    _renewer = threading.Thread(target=_renew, args=(name, ttl, _stop), name=f'lease-{name}', daemon=True)
+    _renewer.start()
+    try:
+        yield True
+    finally:
+        _stop.set()
+        _renewer.join()
+        try:
+            _release(name)
+        except:
+            logger.warning(f'job {name}: lease release failed, it expires in {ttl}s', exc_info=True)
@@ -3,8 +3,8 @@ import logging
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 
-from .routers import clowder, ppms, user, scheduledingest, credentials
-from .routers import sync_ppms_bookings, sync_ppms_projects, mail, dailytask
+from .routers import clowder, ppms, user, credentials
+from .routers import mail, dailytask
 
 from .routers.dashboard import projects, collections, cache, admin, dataset
 
@@ -12,6 +12,8 @@ import pitschi.config as config
 from logging.handlers import TimedRotatingFileHandler
 
 import pitschi.keycloak as keycloak
+import pitschi.async_http as async_http
+import pitschi.worker as worker
 
 logger = logging.getLogger('pitschixapi')
 logger.setLevel(logging.DEBUG)
@@ -35,6 +37,8 @@ pitschixapi.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # next page of the dataset listings, browsers only let scripts read exposed headers
+    expose_headers=["X-Next-After-Id"],
 )
 
 
@@ -84,30 +88,14 @@ pitschixapi.include_router(
 )
 
 
-# scheduledtasks
-if config.get('ppms', 'syncing_ppms_project', default = "no") == "yes":
-    logger.debug("Syncing project on")
-    pitschixapi.include_router(
-        sync_ppms_projects.router
-    )
+# scheduledtasks, api only processes leave them to pitschi-worker
+if config.get('api', 'scheduled_jobs', default = "yes") == "yes":
+    for _job_router in worker.job_routers():
+        pitschixapi.include_router(
+            _job_router
+        )
 else:
-    logger.debug("Syncing projects with ppms off")
-
-if config.get('ppms', 'syncing_ppms_bookings', default = "no") == "yes":
-    logger.debug("Syncing bookings on")
-    pitschixapi.include_router(
-        sync_ppms_bookings.router
-    )
-else:
-    logger.debug("Syncing bookings with ppms off")
-    
-if config.get('clowder', 'ingesting', default = "yes") == "yes":
-    logger.debug("ingsting on")
-    pitschixapi.include_router(
-        scheduledingest.router
-    )
-else:
-    logger.debug("ingesting off")
+    logger.debug("Scheduled jobs off, they run in pitschi-worker")
 
 ###############dashboard
 pitschixapi.include_router(
@@ -148,5 +136,9 @@ pitschixapi.include_router(
 )
 
 
+@pitschixapi.on_event('shutdown')
+async def close_http_client():
+    await async_http.close()
+
 
 logger.info("Start xapi")
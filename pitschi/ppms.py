@@ -1,18 +1,453 @@
 import json, csv
+import codecs
 import requests
+from requests.adapters import HTTPAdapter
 import datetime
 import logging
+import threading
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
 import pitschi.config as config
 
 logger = logging.getLogger('pitschixapi')
 
+
+class RetryPolicy:
+    """
+    Retry PPMS calls that failed with a 5xx/429 status or a timeout/connection error
+    The delay before retry n is drawn uniformly from [0, min(backoff_max, backoff * 2**n)]
+    """
+    def __init__(self, retries: int = 3, backoff: float = 0.5, backoff_max: float = 10):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_config(cls):
+        return cls(retries=int(config.get('ppms', 'retries', default=3)),
+                   backoff=float(config.get('ppms', 'retry_backoff', default=0.5)),
+                   backoff_max=float(config.get('ppms', 'retry_backoff_max', default=10)))
+
+    @staticmethod
+    def retryable(status_code: int) -> bool:
+        return status_code >= 500 or status_code == 429
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+
+class AIMDLimiter:
+    """
+    Adaptive limit on the number of PPMS calls in flight
+    The limit grows by one for every `limit` calls that succeed under latency_target seconds
+    (additive increase) and is halved when a call fails or is slower (multiplicative decrease),
+    at most once per cooldown seconds so a burst of failures only counts once
+    This class blocks threads, ppms_async has the asyncio version
+    """
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 32,
+                 latency_target: float = 5, decrease: float = 0.5, cooldown: float = 1):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls):
+        return cls(initial=int(config.get('ppms', 'concurrency_initial', default=8)),
+                   minimum=int(config.get('ppms', 'concurrency_min', default=1)),
+                   maximum=int(config.get('ppms', 'concurrency_max', default=32)),
+                   latency_target=float(config.get('ppms', 'latency_target', default=5)))
+
+    def _available(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def _record(self, latency: float, ok: bool):
+        if ok and latency <= self.latency_target:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif time.monotonic() - self._last_decrease > self.cooldown:
+            self._last_decrease = time.monotonic()
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            logger.info(f'ppms {"slow" if ok else "failed"} call ({latency:.1f}s), concurrency limit down to {int(self.limit)}')
+
+    def acquire(self):
+        with self._cond:
+            self._cond.wait_for(self._available)
+            self.in_flight += 1
+
+    def release(self, latency: float, ok: bool):
+        with self._cond:
+            self.in_flight -= 1
+            self._record(latency, ok)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {'limit': int(self.limit), 'in_flight': self.in_flight}
+
+
+class PPMSClient:
+    """
+    Keep-alive http client for the PPMS pumapi and API2 endpoints
+    Connections are pooled in a requests session, so back to back calls
+    during a sync reuse the same TCP/TLS connections
+    Calls go through the retry policy and the adaptive concurrency limiter
+    """
+    def __init__(self, ppms_url: str, ppms_key: str, api2_key: str, pool_size: int = 10,
+                 connect_timeout: float = 10, read_timeout: float = 120,
+                 retry: RetryPolicy = None, limiter: AIMDLimiter = None):
+        self.pumapi_url = f"{ppms_url}pumapi/"
+        self.api2_url = f"{ppms_url}API2/"
+        self.ppms_key = ppms_key
+        self.api2_key = api2_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry = retry or RetryPolicy()
+        self.limiter = limiter or AIMDLimiter()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Connection': 'keep-alive'
+        })
+
+    def pumapi(self, payload: str) -> requests.Response:
+        return self._post(self.pumapi_url, f"apikey={self.ppms_key}&{payload}")
+
+    def api2(self, payload: str, stream: bool = False) -> requests.Response:
+        return self._post(self.api2_url, f"apikey={self.api2_key}&{payload}", stream=stream)
+
+    def _post(self, url: str, payload: str, stream: bool = False) -> requests.Response:
+        # send the body as bytes so http.client writes headers and body together,
+        # a separate body write stalls on delayed ACKs once the connection is reused
+        _data = payload.encode()
+        _action = _payload_action(payload)
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            _start = time.monotonic()
+            response = None
+            _failed = True
+            try:
+                response = self.session.post(url, data=_data, timeout=self.timeout, stream=stream)
+                _failed = self.retry.retryable(response.status_code)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if attempt >= self.retry.retries:
+                    raise
+                logger.warning(f'ppms {_action} timed out or connection failed, retry {attempt + 1}/{self.retry.retries}')
+            finally:
+                self.limiter.release(time.monotonic() - _start, not _failed)
+            if response is not None:
+                if not _failed:
+                    return response
+                if attempt >= self.retry.retries:
+                    logger.warning(f'ppms {_action} failed with status {response.status_code} after {attempt} retries')
+                    return response
+                logger.warning(f'ppms {_action} failed with status {response.status_code}, retry {attempt + 1}/{self.retry.retries}')
+                response.close()
+            time.sleep(self.retry.delay(attempt))
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> PPMSClient:
+    """
+    Returns the shared PPMS client, creating it from config on first use
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PPMSClient(
+                    config.get('ppms', 'ppms_url'),
+                    config.get('ppms', 'ppms_key'),
+                    config.get('ppms', 'api2_key'),
+                    pool_size=int(config.get('ppms', 'pool_size', default=10)),
+                    connect_timeout=float(config.get('ppms', 'connect_timeout', default=10)),
+                    read_timeout=float(config.get('ppms', 'read_timeout', default=120)),
+                    retry=RetryPolicy.from_config(),
+                    limiter=AIMDLimiter.from_config())
+    return _client
+
+
+def _payload_action(payload: str) -> str:
+    # action name for log messages, never log the payload, it has the api key
+    for _param in payload.split('&'):
+        if _param.startswith('action='):
+            return _param[len('action='):]
+    return ''
+
+
+class ReferenceCache:
+    """
+    In-process cache for PPMS reference reports that rarely change (users, system pids, cores, systems)
+    Each report has its own TTL in seconds, [ppms] <name>_cache_ttl, 0 disables caching it
+    Cached values are shared between callers and must not be modified
+    """
+    def __init__(self, default_ttls: dict):
+        self.default_ttls = default_ttls
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def ttl(self, name: str) -> float:
+        return float(config.get('ppms', f'{name}_cache_ttl', default=self.default_ttls.get(name, 0)))
+
+    def get(self, name: str):
+        with self._lock:
+            _entry = self._entries.get(name)
+            if _entry and _entry[0] > time.monotonic():
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return _entry[1]
+            self.misses[name] = self.misses.get(name, 0) + 1
+            return None
+
+    def set(self, name: str, value):
+        # empty results are usually failed requests, don't keep them
+        _ttl = self.ttl(name)
+        if _ttl > 0 and value:
+            with self._lock:
+                self._entries[name] = (time.monotonic() + _ttl, value)
+
+    def invalidate(self, name: str = None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self) -> dict:
+        _now = time.monotonic()
+        with self._lock:
+            return { name: {
+                        'hits': self.hits.get(name, 0),
+                        'misses': self.misses.get(name, 0),
+                        'expires_in': round(self._entries[name][0] - _now) if name in self._entries and self._entries[name][0] > _now else 0
+                    } for name in set(self.default_ttls) | set(self.hits) | set(self.misses) }
+
+
+reference_cache = ReferenceCache({'users': 3600, 'system_pids': 3600, 'cores': 86400, 'systems': 3600})
+
+
+class JSONArrayStream:
+    """
+    Incremental parser for a top level JSON array
+    feed() takes the raw response bytes as they arrive and returns the elements
+    completed so far, so the whole document never has to be held in memory
+    """
+    def __init__(self):
+        self._decoder = json.JSONDecoder(strict=False)
+        self._text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._buffer = ''
+        self._started = False
+        self._done = False
+
+    def feed(self, chunk: bytes) -> list:
+        if self._done:
+            return []
+        self._buffer += self._text.decode(chunk)
+        items = []
+        pos = 0
+        _len = len(self._buffer)
+        while True:
+            while pos < _len and self._buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= _len:
+                break
+            if not self._started:
+                if self._buffer[pos] != '[':
+                    raise ValueError(f'expected a json array, got "{self._buffer[pos:pos + 80]}"')
+                self._started = True
+                pos += 1
+                continue
+            if self._buffer[pos] == ']':
+                self._done = True
+                pos = _len
+                break
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                # element is split across chunks, wait for the rest
+                break
+            if not isinstance(item, (dict, list)):
+                # a number may be cut short anywhere (-3. or 1.5e decode as -3 and 1.5),
+                # a scalar only counts once the , or ] after it has arrived
+                _next = end
+                while _next < _len and self._buffer[_next] in ' \t\r\n':
+                    _next += 1
+                if _next >= _len or self._buffer[_next] not in ',]':
+                    break
+            items.append(item)
+            pos = end
+        self._buffer = self._buffer[pos:]
+        return items
+
+    def close(self):
+        if not self._done and (self._started or self._buffer.strip()):
+            raise ValueError('json array is truncated')
+
+
+class UserIndex:
+    """
+    Compact lookup of the PPMS user directory (Report1335) by login and by id
+    Only id, login, email and name are kept, the rest of the report is dropped while parsing
+    """
+    __slots__ = ('_by_login', '_login_by_id')
+
+    def __init__(self):
+        self._by_login = {}
+        self._login_by_id = {}
+
+    def add(self, user: dict):
+        _login = user.get('login')
+        if not _login:
+            return
+        self._by_login[_login] = (user.get('id'), user.get('email'), user.get('name'))
+        self._login_by_id[user.get('id')] = _login
+
+    def get(self, login: str, default=None):
+        """ user info by login as a dict of id, email and name, same as the old users_info lookup """
+        _usr = self._by_login.get(login)
+        if _usr is None:
+            return default
+        return { 'id': _usr[0], 'email': _usr[1], 'name': _usr[2] }
+
+    def __getitem__(self, login: str) -> dict:
+        _usr = self.get(login)
+        if _usr is None:
+            raise KeyError(login)
+        return _usr
+
+    def __contains__(self, login: str) -> bool:
+        return login in self._by_login
+
+    def login(self, userid: int) -> str:
+        return self._login_by_id[userid]
+
+    def get_login(self, userid: int, default: str = None) -> str:
+        return self._login_by_id.get(userid, default)
+
+    def __len__(self) -> int:
+        return len(self._by_login)
+
+
+def _ok(response) -> bool:
+    # works for both requests and httpx responses
+    return response.status_code < 400
+
+def _json_or_empty(response):
+    if _ok(response) and response.status_code != 204:
+        return response.json(strict=False)
+    return []
+
+def _json_or_raise(response):
+    """
+    Like _json_or_empty, but a response still failing after the last retry raises
+    so callers can tell a failed lookup from an empty one
+    """
+    if not _ok(response):
+        raise Exception(f'ppms request failed: status_code={response.status_code}, text="{response.text[:200]}"')
+    return _json_or_empty(response)
+
+def _parse_cores(response, coreids: list):
+    if _ok(response) and response.status_code != 204:
+        cores = response.json(strict=False)
+        if type(cores) == list and len(cores) > 0:
+            return [c for c in cores if c.get('Core ID') in coreids]
+    logger.warning(f'response status_code={response.status_code}, text="{response.text}"')
+    return []
+
+def _parse_system_pids(response):
+    if _ok(response) and response.status_code != 204:
+        pids = response.json(strict=False)
+        if type(pids) == list and len(pids) > 0:
+            return pids
+    logger.warning(f'response status_code={response.status_code}, text="{response.text}"')
+    return []
+
+def _parse_systems(response, coreids: list):
+    if _ok(response) and response.status_code != 204:
+        # format is in csv
+        _systems_text = response.text
+        _csv_reader = csv.reader(_systems_text.split('\n'), delimiter=',')
+        _csv_reader.__next__()
+        systems = []
+        for row in _csv_reader:
+            if(len(row) > 3):
+                _coreid = int(row[0])
+                if _coreid in coreids:
+                    _systemid = int(row[1])
+                    _systemtype = row[2]
+                    _systemname = row[3]
+                    systems.append({'coreid': _coreid, 'systemid': _systemid, 'systemtype': _systemtype, 'systemname': _systemname})
+        return systems
+    logger.warning(f'response status_code={response.status_code}, text="{response.text}"')
+    return []
+
+def _parse_projects(response, coreids: list):
+    if _ok(response) and response.status_code != 204:
+        return [p for p in response.json(strict=False) if p.get('CoreFacilityRef') in coreids]
+    return []
+
+def _parse_project_members(response):
+    if _ok(response) and response.status_code != 204:
+        response_txt = response.text
+        _csv_reader = csv.reader(response_txt.split('\n'), delimiter=',')
+        _csv_reader.__next__()
+        members = []
+        for row in _csv_reader:
+            if (len(row) > 8):
+                _userid = int(row[1])
+                _userlogin = row[8]
+                if _userid > 0 and _userlogin:
+                    members.append({'id': _userid, 'login': _userlogin})
+        return members
+    if _ok(response):
+        return []
+    # None, not [], a failed lookup must not read as a project without members
+    logger.warning(f'response status_code={response.status_code}, text="{response.text}"')
+    return None
+
+def _parse_rdm_collections(response, rdm_key: str):
+    _rdms = response.json(strict=False)
+    return [{ 'coreid': r['PlateformID'], 'projectid': r['ProjectRef'], 'rdm': r[rdm_key] } for r in _rdms]
+
+
+def _per_core(fetch, coreids: list) -> list:
+    """
+    Call fetch(coreid) for all cores in parallel, results are returned in coreids order
+    A core that fails or does not answer within [ppms] core_timeout seconds gives []
+    """
+    _timeout = float(config.get('ppms', 'core_timeout', default=60))
+    _executor = ThreadPoolExecutor(max_workers=max(1, len(coreids)))
+    _futures = [_executor.submit(fetch, coreid) for coreid in coreids]
+    _deadline = time.monotonic() + _timeout
+    results = []
+    for coreid, future in zip(coreids, _futures):
+        try:
+            results.append(future.result(timeout=max(0, _deadline - time.monotonic())))
+        except Exception:
+            logger.warning(f'ppms request for core {coreid} failed or timed out', exc_info=True)
+            results.append([])
+    # don't wait for a slow core, its worker thread finishes in the background
+    _executor.shutdown(wait=False)
+    return results
+
+
 def get_ppms_user(login):
-    url = f"{config.get('ppms', 'ppms_url')}pumapi/"
-    payload=f"apikey={config.get('ppms', 'ppms_key')}&action=getuser&login={login}&format=json"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
+    payload=f"action=getuser&login={login}&format=json"
+    response = get_client().pumapi(payload)
     if response.ok:
         if response.status_code == 204:
             raise Exception('Not found')
@@ -25,193 +460,124 @@ def get_ppms_user(login):
 
 def get_ppms_user_by_id(uid:int, coreid:int):
     logger.debug(f'@get_ppms_user_by_id: get user by id: {uid}')
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    payload=f"outformat=json&apikey={config.get('ppms', 'api2_key')}&action=GetUserDetailsById&checkUserId={uid}&coreid={coreid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            return response.json(strict=False)
-    return []
+    payload=f"outformat=json&action=GetUserDetailsById&checkUserId={uid}&coreid={coreid}"
+    return _json_or_empty(get_client().api2(payload))
 
 
 def get_ppms_users():
-    logger.debug("@get_ppms_users: get all ppms users")
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    payload=f"outformat=json&apikey={config.get('ppms', 'api2_key')}&action=Report1335"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            return response.json(strict=False)
-    return []
+    users = reference_cache.get('users')
+    if users is None:
+        logger.debug("@get_ppms_users: get all ppms users")
+        payload="outformat=json&action=Report1335"
+        users = UserIndex()
+        with get_client().api2(payload, stream=True) as response:
+            if _ok(response) and response.status_code != 204:
+                _parser = JSONArrayStream()
+                for chunk in response.iter_content(chunk_size=65536):
+                    for user in _parser.feed(chunk):
+                        users.add(user)
+                _parser.close()
+        reference_cache.set('users', users)
+    return users
 
 
 def get_daily_bookings_one_system(coreid: int, systemid: int, date: datetime.date):
     logger.debug("@get_daily_bookings_one_system: get bookings for given date")
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
     datestr = f"{date.strftime('%Y-%m-%d')}"
-    payload=f"apikey={config.get('ppms', 'api2_key')}&action=GetSessionsList&filter=day&systemid={systemid}&date={datestr}&coreid={coreid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            return response.json(strict=False)
-    return []
+    payload=f"action=GetSessionsList&filter=day&systemid={systemid}&date={datestr}&coreid={coreid}"
+    return _json_or_empty(get_client().api2(payload))
+
+
+def get_bookings_by_coreid(coreid:int, startdate: datetime.date, enddate: datetime.date):
+    logger.debug(f"@get_bookings: get bookings from {startdate} to {enddate}")
+    payload=f"dateformat=print&outformat=json&action={config.get('ppms', 'booking_query')}&startdate={startdate.strftime('%Y-%m-%d')}&enddate={enddate.strftime('%Y-%m-%d')}&coreid={coreid}"
+    return _json_or_empty(get_client().api2(payload))
 
 
 def get_daily_bookings_by_coreid(coreid:int, date: datetime.date):
-    logger.debug("@get_daily_bookings: get bookings for given date")
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    datestr = f"{date.strftime('%Y-%m-%d')}"
-    payload=f"dateformat=print&outformat=json&apikey={config.get('ppms', 'api2_key')}&action={config.get('ppms', 'booking_query')}&startdate={datestr}&enddate={datestr}&coreid={coreid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            return response.json(strict=False)
-    return []
+    return get_bookings_by_coreid(coreid, date, date)
 
 
-def get_daily_bookings(date: datetime.date):
+def get_bookings(startdate: datetime.date, enddate: datetime.date):
+    coreids = json.loads(config.get('ppms', 'coreids'))
     sessions = []
-    for coreid in json.loads(config.get('ppms', 'coreids')):
-        for session in get_daily_bookings_by_coreid(coreid, date):
+    for coreid, core_sessions in zip(coreids, _per_core(lambda c: get_bookings_by_coreid(c, startdate, enddate), coreids)):
+        for session in core_sessions:
             session['coreid'] = coreid
             sessions.append(session)
     return sessions
 
 
+def get_daily_bookings(date: datetime.date):
+    return get_bookings(date, date)
+
+
 def get_booking_details(coreid:int , sessionid: int):
     logger.debug(f'get booking id {sessionid} details')
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    payload=f"apikey={config.get('ppms', 'api2_key')}&action=GetSessionDetails&sessionid={sessionid}&coreid={coreid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            return response.json(strict=False)
-    return []
+    payload=f"action=GetSessionDetails&sessionid={sessionid}&coreid={coreid}"
+    return _json_or_raise(get_client().api2(payload))
+
+
+def get_training_by_coreid(coreid:int, startdate: datetime.date, enddate: datetime.date):
+    logger.debug(f"@get_training: get training from {startdate} to {enddate}")
+    payload=f"dateformat=print&outformat=json&action={config.get('ppms', 'training_query')}&startdate={startdate.strftime('%Y-%m-%d')}&enddate={enddate.strftime('%Y-%m-%d')}&coreid={coreid}"
+    return _json_or_empty(get_client().api2(payload))
 
 
 def get_daily_training_by_coreid(coreid:int, date: datetime.date):
-    logger.debug("@get_daily_training: get training for given date")
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    datestr = f"{date.strftime('%Y-%m-%d')}"
-    payload=f"dateformat=print&outformat=json&apikey={config.get('ppms', 'api2_key')}&action={config.get('ppms', 'training_query')}&startdate={datestr}&enddate={datestr}&coreid={coreid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            return response.json(strict=False)
-    return []
+    return get_training_by_coreid(coreid, date, date)
 
 
-def get_daily_training(date: datetime.date):
+def get_training(startdate: datetime.date, enddate: datetime.date):
+    coreids = json.loads(config.get('ppms', 'coreids'))
     sessions = []
-    for coreid in json.loads(config.get('ppms', 'coreids')):
-        for session in get_daily_training_by_coreid(coreid, date):
+    for coreid, core_sessions in zip(coreids, _per_core(lambda c: get_training_by_coreid(c, startdate, enddate), coreids)):
+        for session in core_sessions:
             session['coreid'] = coreid
             sessions.append(session)
     return sessions
 
 
+def get_daily_training(date: datetime.date):
+    return get_training(date, date)
+
+
 def get_cores():
     coreids = json.loads(config.get('ppms', 'coreids'))
     logger.debug(f'get cores for core ids: {",".join(str(c) for c in coreids)}')
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    payload=f"outformat=json&apikey={config.get('ppms', 'api2_key')}&action=Report2169"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code != 204:
-            cores = response.json(strict=False)
-            if type(cores) == list and len(cores) > 0:
-                return [c for c in cores if c.get('Core ID') in coreids]
-    logger.warning(f'response status_code={response.status_code}, text="{response.text}"')
-    return []
+    cores = reference_cache.get('cores')
+    if cores is None:
+        payload="outformat=json&action=Report2169"
+        cores = _parse_cores(get_client().api2(payload), coreids)
+        reference_cache.set('cores', cores)
+    return cores
 
 
 def get_system_pids():
-    logger.debug(f'get all system pids')
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    payload=f"outformat=json&apikey={config.get('ppms', 'api2_key')}&action=Report2168"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code != 204:
-            pids = response.json(strict=False)
-            if type(pids) == list and len(pids) > 0:
-                return pids
-    logger.warning(f'response status_code={response.status_code}, text="{response.text}"')
-    return []
+    pids = reference_cache.get('system_pids')
+    if pids is None:
+        logger.debug(f'get all system pids')
+        payload="outformat=json&action=Report2168"
+        pids = _parse_system_pids(get_client().api2(payload))
+        reference_cache.set('system_pids', pids)
+    return pids
 
 
 def get_systems():
     coreids = json.loads(config.get('ppms', 'coreids'))
     logger.debug(f'get systems for core ids: {",".join(str(c) for c in coreids)}')
-    url = f"{config.get('ppms', 'ppms_url')}pumapi/"
-    payload=f"apikey={config.get('ppms', 'ppms_key')}&action=getsystems"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code != 204:
-            # format is in csv
-            _systems_text = response.text
-            _csv_reader = csv.reader(_systems_text.split('\n'), delimiter=',')
-            _csv_reader.__next__()
-            systems = []
-            for row in _csv_reader:
-                if(len(row) > 3):
-                    _coreid = int(row[0])
-                    if _coreid in coreids:
-                        _systemid = int(row[1])
-                        _systemtype = row[2]
-                        _systemname = row[3]
-                        systems.append({'coreid': _coreid, 'systemid': _systemid, 'systemtype': _systemtype, 'systemname': _systemname})
-            return systems
-    logger.warning(f'response status_code={response.status_code}, text="{response.text}"')
-    return []
+    systems = reference_cache.get('systems')
+    if systems is None:
+        payload="action=getsystems"
+        systems = _parse_systems(get_client().pumapi(payload), coreids)
+        reference_cache.set('systems', systems)
+    return systems
 
 
 def get_system_rights(systemid: int):
     logger.debug("get systems")
-    url = f"{config.get('ppms', 'ppms_url')}pumapi/"
-    payload=f"apikey={config.get('ppms', 'ppms_key')}&action=getsysrights&id={systemid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
+    payload=f"action=getsysrights&id={systemid}"
+    response = get_client().pumapi(payload)
     if response.ok:
         if response.status_code == 204:
             return {}
@@ -227,30 +593,15 @@ def get_system_rights(systemid: int):
 def get_projects():
     coreids = json.loads(config.get('ppms', 'coreids'))
     logger.debug(f'get projects for core ids: {",".join(str(c) for c in coreids)}')
-    url = f"{config.get('ppms', 'ppms_url')}pumapi/"
-    payload=f"apikey={config.get('ppms', 'ppms_key')}&action=getprojects&active=true&format=json"
-    # payload=f"apikey={config.get('ppms', 'ppms_key')}&action=getprojects&format=json"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            return [p for p in response.json(strict=False) if p.get('CoreFacilityRef') in coreids]
-    else:
-        return []
+    payload="action=getprojects&active=true&format=json"
+    # payload="action=getprojects&format=json"
+    return _parse_projects(get_client().pumapi(payload), coreids)
 
 
 def get_project_user(projectid: int):
     logger.debug(f'get project id {projectid} users')
-    url = f"{config.get('ppms', 'ppms_url')}pumapi/"
-    payload=f"apikey={config.get('ppms', 'ppms_key')}&action=getprojectusers&withdeactivated=false&projectid={projectid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
+    payload=f"action=getprojectusers&withdeactivated=false&projectid={projectid}"
+    response = get_client().pumapi(payload)
     if response.ok:
         if response.status_code == 204:
             return []
@@ -265,37 +616,12 @@ def get_project_members(projectid: int):
     Similar to project_user but with user id as well
     """
     logger.debug(f'get project id {projectid} members')
-    url = f"{config.get('ppms', 'ppms_url')}pumapi/"
-    payload=f"apikey={config.get('ppms', 'ppms_key')}&action=getprojectmember&projectid={projectid}"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.ok:
-        if response.status_code == 204:
-            return []
-        else:
-            response_txt = response.text
-            _csv_reader = csv.reader(response_txt.split('\n'), delimiter=',')
-            _csv_reader.__next__()
-            members = []
-            for row in _csv_reader:
-                if (len(row) > 8):
-                    _userid = int(row[1])
-                    _userlogin = row[8]
-                    if _userid > 0 and _userlogin:
-                        members.append({'id': _userid, 'login': _userlogin})
-            return members
-    else:
-        return []
+    payload=f"action=getprojectmember&projectid={projectid}"
+    return _parse_project_members(get_client().pumapi(payload))
 
 def get_rdm_collection(coreid: int, projectid: int):
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    payload=f"apikey={config.get('ppms', 'api2_key')}&action={config.get('ppms', 'qcollection_action')}&projectId={projectid}&coreid={coreid}&outformat=json"
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
+    payload=f"action={config.get('ppms', 'qcollection_action')}&projectId={projectid}&coreid={coreid}&outformat=json"
+    response = get_client().api2(payload)
     if response.ok:
         if response.status_code == 204:
             return ""
@@ -305,23 +631,20 @@ def get_rdm_collection(coreid: int, projectid: int):
         return qcollection
     return ""
 
+def get_rdm_collections_by_coreid(coreid: int):
+    payload = f"action={config.get('ppms', 'qcollections_action')}&coreid={coreid}&outformat=json"
+    response = get_client().api2(payload)
+    if response.ok and response.status_code != 204:
+        return _parse_rdm_collections(response, config.get('ppms', 'q_collection_field'))
+    return []
+
 def get_rdm_collections(coreid: int = None):
-    url = f"{config.get('ppms', 'ppms_url')}API2/"
-    headers = { 'Content-Type': 'application/x-www-form-urlencoded' }
-    action = config.get('ppms', 'qcollections_action')
-    rdm_key = config.get('ppms', 'q_collection_field')
-    rdms = []
     if coreid is None:
         coreids = json.loads(config.get('ppms', 'coreids'))
     else:
         coreids = [coreid]
     logger.debug(f'get rdm collections for core ids: {",".join(str(c) for c in coreids)}')
-    for coreid in coreids:
-        payload = f"apikey={config.get('ppms', 'api2_key')}&action={action}&coreid={coreid}&outformat=json"
-        response = requests.request("POST", url, headers=headers, data=payload)
-        if response.ok:
-            if response.status_code == 204:
-                break
-            if len(response.json()) > 0:
-                rdms.extend([{ 'coreid': r['PlateformID'], 'projectid': r['ProjectRef'], 'rdm': r[rdm_key] } for r in response.json()])
+    rdms = []
+    for core_rdms in _per_core(get_rdm_collections_by_coreid, coreids):
+        rdms.extend(core_rdms)
     return rdms
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import time
+import httpx
+import datetime
+import logging
+from functools import lru_cache
+import pitschi.config as config
+import pitschi.async_http as async_http
+from pitschi import ppms
+
+logger = logging.getLogger('pitschixapi')
+
+##################
+# asyncio versions of the pitschi.ppms calls used by the scheduled jobs
+# Requests go through the shared async client and responses are parsed
+# with the same helpers as the blocking functions
+##################
+
+@lru_cache()
+def _endpoints():
+    _url = config.get('ppms', 'ppms_url')
+    return {
+        'pumapi': (f"{_url}pumapi/", config.get('ppms', 'ppms_key')),
+        'api2': (f"{_url}API2/", config.get('ppms', 'api2_key'))
+    }
+
+def _request(api: str, payload: str) -> dict:
+    url, key = _endpoints()[api]
+    return { 'url': url, 'content': f"apikey={key}&{payload}".encode(),
+             'headers': {'Content-Type': 'application/x-www-form-urlencoded'} }
+
+class AsyncAIMDLimiter(ppms.AIMDLimiter):
+    """
+    asyncio version of ppms.AIMDLimiter, waiting tasks are woken in arrival order
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiters = []
+
+    async def acquire(self):
+        while not self._available():
+            _waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(_waiter)
+            try:
+                await _waiter
+            except asyncio.CancelledError:
+                # pass on a wake up this task can no longer use
+                if _waiter.done() and not _waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if _waiter in self._waiters:
+                    self._waiters.remove(_waiter)
+        self.in_flight += 1
+
+    def release(self, latency: float, ok: bool):
+        self.in_flight -= 1
+        self._record(latency, ok)
+        self._wake()
+
+    def _wake(self):
+        for _waiter in self._waiters[:max(0, int(self.limit) - self.in_flight)]:
+            if not _waiter.done():
+                _waiter.set_result(None)
+
+
+@lru_cache()
+def _retry() -> ppms.RetryPolicy:
+    return ppms.RetryPolicy.from_config()
+
+@lru_cache()
+def limiter() -> AsyncAIMDLimiter:
+    return AsyncAIMDLimiter.from_config()
+
+
+async def _post(api: str, payload: str, stream: bool = False):
+    """
+    Post to PPMS through the retry policy and the adaptive concurrency limiter
+    With stream=True the body is not read, the caller must aclose() the response
+    """
+    _client = async_http.get_client()
+    _action = ppms._payload_action(payload)
+    attempt = 0
+    while True:
+        await limiter().acquire()
+        _start = time.monotonic()
+        response = None
+        _failed = True
+        try:
+            response = await _client.send(_client.build_request('POST', **_request(api, payload)), stream=stream)
+            _failed = _retry().retryable(response.status_code)
+        except (httpx.TimeoutException, httpx.TransportError):
+            if attempt >= _retry().retries:
+                raise
+            logger.warning(f'ppms {_action} timed out or connection failed, retry {attempt + 1}/{_retry().retries}')
+        finally:
+            limiter().release(time.monotonic() - _start, not _failed)
+        if response is not None:
+            if not _failed:
+                return response
+            if attempt >= _retry().retries:
+                logger.warning(f'ppms {_action} failed with status {response.status_code} after {attempt} retries')
+                return response
+            logger.warning(f'ppms {_action} failed with status {response.status_code}, retry {attempt + 1}/{_retry().retries}')
+            await response.aclose()
+        await asyncio.sleep(_retry().delay(attempt))
+        attempt += 1
+
+async def pumapi(payload: str):
+    return await _post('pumapi', payload)
+
+async def api2(payload: str):
+    return await _post('api2', payload)
+
+
+async def _per_core(fetch, coreids: list) -> list:
+    """
+    Await fetch(coreid) for all cores concurrently, results are returned in coreids order
+    A core that fails or does not answer within [ppms] core_timeout seconds gives []
+    """
+    _timeout = float(config.get('ppms', 'core_timeout', default=60))
+    async def _fetch(coreid):
+        try:
+            return await asyncio.wait_for(fetch(coreid), _timeout)
+        except Exception:
+            logger.warning(f'ppms request for core {coreid} failed or timed out', exc_info=True)
+            return []
+    return await asyncio.gather(*[_fetch(coreid) for coreid in coreids])
+
+
+async def get_ppms_users():
+    users = ppms.reference_cache.get('users')
+    if users is None:
+        logger.debug("@get_ppms_users: get all ppms users")
+        payload="outformat=json&action=Report1335"
+        users = ppms.UserIndex()
+        response = await _post('api2', payload, stream=True)
+        try:
+            if ppms._ok(response) and response.status_code != 204:
+                _parser = ppms.JSONArrayStream()
+                async for chunk in response.aiter_bytes(65536):
+                    for user in _parser.feed(chunk):
+                        users.add(user)
+                _parser.close()
+        finally:
+            await response.aclose()
+        ppms.reference_cache.set('users', users)
+    return users
+
+
+async def get_bookings_by_coreid(coreid:int, startdate: datetime.date, enddate: datetime.date):
+    logger.debug(f"@get_bookings: get bookings from {startdate} to {enddate}")
+    payload=f"dateformat=print&outformat=json&action={config.get('ppms', 'booking_query')}&startdate={startdate.strftime('%Y-%m-%d')}&enddate={enddate.strftime('%Y-%m-%d')}&coreid={coreid}"
+    return ppms._json_or_empty(await api2(payload))
+
+
+async def get_daily_bookings_by_coreid(coreid:int, date: datetime.date):
+    return await get_bookings_by_coreid(coreid, date, date)
+
+
+async def get_bookings(startdate: datetime.date, enddate: datetime.date):
+    coreids = json.loads(config.get('ppms', 'coreids'))
+    sessions = []
+    for coreid, core_sessions in zip(coreids, await _per_core(lambda c: get_bookings_by_coreid(c, startdate, enddate), coreids)):
+        for session in core_sessions:
+            session['coreid'] = coreid
+            sessions.append(session)
+    return sessions
+
+
+async def get_daily_bookings(date: datetime.date):
+    return await get_bookings(date, date)
+
+
+async def get_booking_details(coreid:int , sessionid: int):
+    logger.debug(f'get booking id {sessionid} details')
+    payload=f"action=GetSessionDetails&sessionid={sessionid}&coreid={coreid}"
+    return ppms._json_or_raise(await api2(payload))
+
+
+async def get_training_by_coreid(coreid:int, startdate: datetime.date, enddate: datetime.date):
+    logger.debug(f"@get_training: get training from {startdate} to {enddate}")
+    payload=f"dateformat=print&outformat=json&action={config.get('ppms', 'training_query')}&startdate={startdate.strftime('%Y-%m-%d')}&enddate={enddate.strftime('%Y-%m-%d')}&coreid={coreid}"
+    return ppms._json_or_empty(await api2(payload))
+
+
+async def get_daily_training_by_coreid(coreid:int, date: datetime.date):
+    return await get_training_by_coreid(coreid, date, date)
+
+
+async def get_training(startdate: datetime.date, enddate: datetime.date):
+    coreids = json.loads(config.get('ppms', 'coreids'))
+    sessions = []
+    for coreid, core_sessions in zip(coreids, await _per_core(lambda c: get_training_by_coreid(c, startdate, enddate), coreids)):
+        for session in core_sessions:
+            session['coreid'] = coreid
+            sessions.append(session)
+    return sessions
+
+
+async def get_daily_training(date: datetime.date):
+    return await get_training(date, date)
+
+
+async def get_cores():
+    coreids = json.loads(config.get('ppms', 'coreids'))
+    logger.debug(f'get cores for core ids: {",".join(str(c) for c in coreids)}')
+    cores = ppms.reference_cache.get('cores')
+    if cores is None:
+        payload="outformat=json&action=Report2169"
+        cores = ppms._parse_cores(await api2(payload), coreids)
+        ppms.reference_cache.set('cores', cores)
+    return cores
+
+
+async def get_system_pids():
+    pids = ppms.reference_cache.get('system_pids')
+    if pids is None:
+        logger.debug(f'get all system pids')
+        payload="outformat=json&action=Report2168"
+        pids = ppms._parse_system_pids(await api2(payload))
+        ppms.reference_cache.set('system_pids', pids)
+    return pids
+
+
+async def get_systems():
+    coreids = json.loads(config.get('ppms', 'coreids'))
+    logger.debug(f'get systems for core ids: {",".join(str(c) for c in coreids)}')
+    systems = ppms.reference_cache.get('systems')
+    if systems is None:
+        payload="action=getsystems"
+        systems = ppms._parse_systems(await pumapi(payload), coreids)
+        ppms.reference_cache.set('systems', systems)
+    return systems
+
+
+async def get_projects():
+    coreids = json.loads(config.get('ppms', 'coreids'))
+    logger.debug(f'get projects for core ids: {",".join(str(c) for c in coreids)}')
+    payload="action=getprojects&active=true&format=json"
+    return ppms._parse_projects(await pumapi(payload), coreids)
+
+
+async def get_project_members(projectid: int):
+    logger.debug(f'get project id {projectid} members')
+    payload=f"action=getprojectmember&projectid={projectid}"
+    return ppms._parse_project_members(await pumapi(payload))
+
+
+async def get_rdm_collections_by_coreid(coreid: int):
+    payload = f"action={config.get('ppms', 'qcollections_action')}&coreid={coreid}&outformat=json"
+    response = await api2(payload)
+    if ppms._ok(response) and response.status_code != 204:
+        return ppms._parse_rdm_collections(response, config.get('ppms', 'q_collection_field'))
+    return []
+
+
+async def get_rdm_collections(coreid: int = None):
+    if coreid is None:
+        coreids = json.loads(config.get('ppms', 'coreids'))
+    else:
+        coreids = [coreid]
+    logger.debug(f'get rdm collections for core ids: {",".join(str(c) for c in coreids)}')
+    rdms = []
+    for core_rdms in await _per_core(get_rdm_collections_by_coreid, coreids):
+        rdms.extend(core_rdms)
+    return rdms
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, FastAPI, HTTPException, status
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, status, Query, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import pytz
 import logging
@@ -13,6 +13,38 @@ import os
 router = APIRouter()
 logger = logging.getLogger('pitschixapi')
 security = HTTPBasic()
+
+def parse_dataset_fields(fields: str):
+    """
+    comma separated dataset columns of a fields= parameter, None for all of them
+    """
+    if not fields:
+        return None
+    _fields = [f.strip() for f in fields.split(',') if f.strip()]
+    _unknown = [f for f in _fields if f not in pdb.crud.DATASET_FIELDS]
+    if _unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"unknown dataset fields: {', '.join(_unknown)}"
+        )
+    return _fields
+
+def dataset_page(response: Response, rows: list, limit: int):
+    """
+    dataset rows as dicts with times in the ppms timezone
+    a full page sets X-Next-After-Id to the after_id of the next one
+    pages are 100 datasets unless the client asks for up to 1000, a listing is never unbounded
+    """
+    datasets = []
+    for row in rows:
+        dataset = row._asdict()
+        for field in ('received', 'finished', 'modified'):
+            if dataset.get(field):
+                dataset[field] = utils.convert_utc_to_ppms(dataset[field])
+        datasets.append(dataset)
+    if limit and len(rows) == limit:
+        response.headers['X-Next-After-Id'] = str(rows[-1].id)
+    return datasets
     
 # look at background asks: https://fastapi.tiangolo.com/tutorial/background-tasks/
 # to be replaced by a call to clowder - needs to be implemented
@@ -33,8 +65,10 @@ async def ingest(dataset: pdb.schemas.DatasetCreate, \
 
 
 @router.get("/datasets")
-async def get_datasets(login: str, machine: str="", localpath: str="", \
-                        date: datetime.date=datetime.datetime.now(pytz.timezone(config.get('ppms', 'timezone'))).date(), \
+async def get_datasets(login: str, response: Response, machine: str="", localpath: str="", \
+                        date: datetime.date=None, \
+                        after_id: int=None, limit: int=Query(100, ge=1, le=1000), fields: str=None, \
+                        since: datetime.date=None, until: datetime.date=None, \
                         credentials: HTTPBasicCredentials = Depends(security), db: Session = Depends(pdb.get_db)):
     user = pdb.crud.get_user(db, credentials.username, credentials.password)
     if not user:
@@ -51,11 +85,17 @@ async def get_datasets(login: str, machine: str="", localpath: str="", \
         )
     datasets = []
     if  machine.strip()!="" and localpath.strip()=="":
+        # today in the ppms timezone, worked out per request
+        if not date:
+            date = datetime.datetime.now(pytz.timezone(config.get('ppms', 'timezone'))).date()
         datasets =  pdb.crud.get_datasets_from_one_machine(db, login, machine, date)
     elif machine.strip()!="" and localpath.strip()!="":
         datasets =  pdb.crud.get_datasets_from_original(db, login, machine, localpath)
     else:
-        datasets =  pdb.crud.get_datasets(db, login)
+        # all datasets of the login, paged and filtered in the query
+        _rows = pdb.crud.list_datasets(db, username=login, fields=parse_dataset_fields(fields),
+                                       after_id=after_id, limit=limit, since=since, until=until)
+        return dataset_page(response, _rows, limit)
     for dataset in datasets:
         if dataset.received:
             dataset.received = utils.convert_utc_to_ppms(dataset.received)
@@ -134,7 +174,9 @@ async def get_dataset(datasetid: int, \
     
 
 @router.get("/bookings/{bookingid}/datasets")
-async def get_booking_datasets(bookingid: int, \
+async def get_booking_datasets(bookingid: int, response: Response, \
+                            after_id: int=None, limit: int=Query(100, ge=1, le=1000), fields: str=None, \
+                            since: datetime.date=None, until: datetime.date=None, \
                             credentials: HTTPBasicCredentials = Depends(security), \
                             db: Session = Depends(pdb.get_db)):
     user = pdb.crud.get_user(db, credentials.username, credentials.password)
@@ -144,12 +186,6 @@ async def get_booking_datasets(bookingid: int, \
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Basic"},
         )
-    datasets = pdb.crud.get_booking_datasets(db, bookingid)
-    for dataset in datasets:
-        if dataset.received:
-            dataset.received = utils.convert_utc_to_ppms(dataset.received)
-        if dataset.finished:
-            dataset.finished = utils.convert_utc_to_ppms(dataset.finished)    
-        if dataset.modified:
-            dataset.modified = utils.convert_utc_to_ppms(dataset.modified)
-    return datasets
+    _rows = pdb.crud.list_datasets(db, bookingid=bookingid, fields=parse_dataset_fields(fields),
+                                   after_id=after_id, limit=limit, since=since, until=until)
+    return dataset_page(response, _rows, limit)
@@ -2,12 +2,14 @@ from fastapi import APIRouter, Depends
 
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+import datetime
 import pitschi.db as pdb
 from sqlalchemy.orm import Session
 
-from pitschi.routers import ppms_utils
+from pitschi.routers import ppms_utils, sync_ppms_bookings
 import pitschi.keycloak as keycloak
+from pitschi.ppms import reference_cache
 
 
 router = APIRouter()
@@ -29,8 +31,79 @@ async def reset_ppms_sync_stats(user: dict = Depends(keycloak.decode), db: Sessi
                 detail="Not authorised. Only dashboard can do this."
             )
         else:
-            _syncing_stat = pdb.crud.get_stat(db, "syncing_projects") 
-            if _syncing_stat and _syncing_stat.value == "True":
-                logger.debug(">>>>>>>>>>>> Reset PPMS Sync status")
-                pdb.crud.set_stat(db, name='syncing_projects', value='False')
+            # a dead worker's lease expires by itself, this frees it right away
+            # a holder still running cannot renew it after this
+            _lease = pdb.crud.get_active_lease(db, 'sync_ppms_projects')
+            if _lease:
+                logger.debug(f">>>>>>>>>>>> Reset PPMS Sync status, lease held by {_lease.owner}")
+                # only the lease seen here, not one another worker took in the meantime
+                pdb.crud.release_lease(db, 'sync_ppms_projects', _lease.owner)
 
+
+@router.post("/bookings/backfill")
+async def backfill_ppms_bookings(startdate: datetime.date, enddate: datetime.date, background_tasks: BackgroundTasks,
+                                 user: dict = Depends(keycloak.decode), db: Session = Depends(pdb.get_db)):
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authorised"
+        )
+    else: 
+        realm_access = user.get('realm_access')
+        has_dashboard_access = realm_access and 'dashboard' in realm_access.get('roles')
+        if not has_dashboard_access:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authorised. Only dashboard can do this."
+            )
+    if enddate < startdate:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="enddate is before startdate"
+        )
+    if pdb.crud.get_active_lease(db, 'sync_ppms_bookings'):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A booking sync is running, try again later"
+        )
+    logger.debug(f">>>>>>>>>>>> Backfill PPMS bookings from {startdate} to {enddate}")
+    # a sync function, the background task runs it in the threadpool under the booking sync lease
+    background_tasks.add_task(sync_ppms_bookings.run_backfill, startdate, enddate)
+    return {"startdate": startdate, "enddate": enddate, "status": "started"}
+
+
+@router.get("/ppmscache")
+async def get_ppms_cache_stats(user: dict = Depends(keycloak.decode)):
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authorised"
+        )
+    else: 
+        realm_access = user.get('realm_access')
+        has_dashboard_access = realm_access and 'dashboard' in realm_access.get('roles')
+        if not has_dashboard_access:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authorised. Only dashboard can do this."
+            )
+    return reference_cache.stats()
+
+
+@router.delete("/ppmscache")
+async def invalidate_ppms_cache(name: str = None, user: dict = Depends(keycloak.decode)):
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authorised"
+        )
+    else: 
+        realm_access = user.get('realm_access')
+        has_dashboard_access = realm_access and 'dashboard' in realm_access.get('roles')
+        if not has_dashboard_access:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authorised. Only dashboard can do this."
+            )
+    logger.debug(f">>>>>>>>>>>> Invalidate PPMS reference cache: {name or 'all'}")
+    reference_cache.invalidate(name)
@@ -6,6 +6,7 @@ import logging
 from fastapi import APIRouter, Depends, HTTPException, status
 import pitschi.db as pdb
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from pitschi.routers import ppms_utils
 import pitschi.keycloak as keycloak
@@ -31,7 +32,7 @@ async def sync_ppms_projects(user: dict = Depends(keycloak.decode), db: Session
                 detail="Not authorised. Only dashboard can do this."
             )
     logger.debug(">>>>>>>>>>>> Manual syncing PPMS projects")
-    ppms_utils.sync_ppms_projects(db, logger)
+    await run_in_threadpool(ppms_utils.sync_ppms_projects, db, logger)
 
 
 @router.get("/projects")
@@ -91,6 +92,9 @@ async def get_system_stats(field: str="syncing_projects", user: dict = Depends(k
         realm_access = user.get('realm_access')
         has_dashboard_access = realm_access and 'dashboard' in realm_access.get('roles')
         if has_dashboard_access:
+            if field == 'syncing_projects':
+                # taken from the job lease, so it cannot get stuck when a sync dies
+                return {field: pdb.crud.get_active_lease(db, 'sync_ppms_projects') is not None}
             field_value = pdb.crud.get_stat(db, field) 
             if not field_value:
                 return {field: ""}
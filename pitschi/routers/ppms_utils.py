@@ -1,47 +1,83 @@
-import json
+import asyncio
+import hashlib, json
 import logging
+import time
+from anyio import from_thread
 import pitschi.config as config
 import pitschi.db as pdb
-from pitschi.ppms import get_ppms_user, get_ppms_user_by_id, get_ppms_users, get_cores, get_system_pids, get_systems, get_projects, get_rdm_collections, get_project_members
+from pitschi.ppms import get_ppms_user, get_ppms_user_by_id, reference_cache, UserIndex
+import pitschi.ppms_async as ppms_async
 import pitschi.mail as mail
+import pitschi.job_lock as job_lock
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger('pitschixapi')
 
 
-def de_dup_userid(db: Session, login: str, userid: int, users_info: dict, alert: bool = False):
+def fix_duplicate_user(db: Session, username: str, userid: int, users_info: UserIndex, alert: bool = False):
+    '''
+    db user username shares its id userid with another user
+    update its id if rims has a different one for it, otherwise report the duplicate
+    '''
+    # check if their id needs to be updated
+    _usr = {}
+    if users_info:
+        if users_info.get(username):
+            _usr = { 'login': username, **users_info[username] }
+    else:
+        try:
+            _usr_info = get_ppms_user(username)
+            if _usr_info:
+                _usr = _usr_info
+        except:
+            pass
+    if _usr and userid != _usr.get('id'):
+        msg = f'fixing user {username} id - updating {userid} to {_usr.get("id")}'
+        logger.warning(msg)
+        pdb.crud.update_ppms_user_id(db, username, _usr.get('id'))
+        if (alert):
+            contents = msg[:1].upper() + msg[1:] + ', was username changed in RIMS?'
+            mail.send_mail(config.get('email', 'address'), '[WARNING] RIMS sync duplicate userid', contents)
+    else:
+        msg = f'User {username} has duplicate id {userid}'
+        logger.error(msg)
+        if (alert):
+            contents = msg + ', was username deleted in RIMS?'
+            mail.send_mail(config.get('email', 'address'), '[ERROR] RIMS sync duplicate userid', contents)
+
+
+def de_dup_userid(db: Session, login: str, userid: int, users_info: UserIndex, alert: bool = False):
     # user name was changed in rims, try to find and fix users with wrong id
     for _fix_user in pdb.crud.get_ppms_user_by_uid(db, userid):
         # look for user with same id and different login
         if _fix_user.username != login:
-            # check if their id needs to be updated
-            _usr = {}
-            if users_info:
-                if users_info.get(_fix_user.username):
-                    _usr = { 'login': _fix_user.username, **users_info[_fix_user.username] }
-            else:
-                try:
-                    _usr_info = get_ppms_user(_fix_user.username)
-                    if _usr_info:
-                        _usr = _usr_info
-                except:
-                    pass
-            if _usr and _fix_user.userid != _usr.get('id'):
-                msg = f'fixing user {_fix_user.username} id - updating {_fix_user.userid} to {_usr.get("id")}'
-                logger.warning(msg)
-                pdb.crud.update_ppms_user_id(db, _fix_user.username, _usr.get('id'))
-                if (alert):
-                    contents = msg[:1].upper() + msg[1:] + ', was username changed in RIMS?'
-                    mail.send_mail(config.get('email', 'address'), '[WARNING] RIMS sync duplicate userid', contents)
-            else:
-                msg = f'User {_fix_user.username} has duplicate id {userid}'
-                logger.error(msg)
-                if (alert):
-                    contents = msg + ', was username deleted in RIMS?'
-                    mail.send_mail(config.get('email', 'address'), '[ERROR] RIMS sync duplicate userid', contents)
-
-
-def get_db_user(db: Session, login: str = None, userid: int = None, coreid: int = None, users_info: dict = None, alert: bool = False):
+            fix_duplicate_user(db, _fix_user.username, _fix_user.userid, users_info, alert=alert)
+
+
+def sync_users(db: Session, logins: list, users_info: UserIndex, alert: bool = False) -> dict:
+    '''
+    add or update the db users for the given logins from the rims user directory in one statement,
+    then fix users that now share an id, found with one query over the synced ids
+    logins missing from the directory are skipped
+    '''
+    _users = []
+    for _login in set(logins):
+        _usr = users_info.get(_login)
+        if not _usr or _usr.get('name') is None or _usr.get('email') is None:
+            logger.warning(f'user {_login} not found in rims user directory, or has no name/email')
+            continue
+        _users.append(pdb.schemas.User(username=_login, userid=_usr.get('id'), name=_usr.get('name'), email=_usr.get('email')))
+    _counts = pdb.crud.upsert_ppms_users(db, _users)
+    # user name was changed in rims, try to find and fix users with wrong id
+    for _userid, _usernames in pdb.crud.get_duplicate_userids(db, [u.userid for u in _users]).items():
+        _owner = users_info.get_login(_userid, '')
+        for _username in _usernames:
+            if _username.lower() != _owner.lower():
+                fix_duplicate_user(db, _username, _userid, users_info, alert=alert)
+    return _counts
+
+
+def get_db_user(db: Session, login: str = None, userid: int = None, coreid: int = None, users_info: UserIndex = None, alert: bool = False):
     '''
     get user info by login or userid from db
     use users_info to add missing user to db, or update db user if needed
@@ -94,123 +130,184 @@ def notify_failed_datasets(db: Session, alert: bool = False):
         logger.info(f'No datasets failed in past {days} day/s')
 
 def sync_cores(db: Session):
-    cores = get_cores()
-    for core in cores:
-        pdb.crud.create_core(db, pdb.schemas.Core(
+    cores = from_thread.run(ppms_async.get_cores)
+    _counts = pdb.crud.upsert(db, pdb.models.Core, [pdb.schemas.Core(
             id = core.get('Core ID'),
             institution = core.get('Institution'),
             shortname = core.get('Facility Short Name'),
             longname = core.get('Facility Long Name'),
-            rorid = core.get('ROR ID'))
-        )
+            rorid = core.get('ROR ID')) for core in cores])
+    logger.debug(f'synced {len(cores)} cores: {_counts}')
+
+
+def fingerprint(*parts) -> str:
+    '''
+    stable hash of the given ppms records, used to skip unchanged bookings and project members
+    '''
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def get_projects_members(project_ids: list) -> list:
+    '''
+    fetch the member list of each project, at most project_member_concurrency at a time
+    results are returned in the same order as project_ids, a failed lookup gives None
+    '''
+    _semaphore = asyncio.Semaphore(max(1, int(config.get('ppms', 'project_member_concurrency', default=8))))
+    async def _get_members(project_id):
+        async with _semaphore:
+            try:
+                return await ppms_async.get_project_members(project_id)
+            except:
+                logger.warning(f'get project members error: project id {project_id}', exc_info=True)
+                return None
+    return await asyncio.gather(*[_get_members(_project_id) for _project_id in project_ids])
 
 
-def sync_projects(db: Session, project_ids: dict = {}, alogger: logging.Logger = logger, alert: bool = False):
+def sync_projects(db: Session, project_ids: dict = {}, alogger: logging.Logger = logger, alert: bool = False) -> dict:
     '''
     sync projects from rims
     - sync all projects from rims if projects_ids is empty list
     - otherwise just sync the projects in projects_ids
+    project members are only updated for projects whose member list changed since the last sync
+    returns the project counts and the time spent fetching from rims and updating the db
+    must run in a threadpool thread, the rims requests are run on the event loop with from_thread
     '''
-    users = get_ppms_users()
-    _rdms_by_pid = { r['projectid']: r['rdm'] for r in get_rdm_collections() }
-    # convert to dict to allow easy lookup by login
-    _users_info = { u["login"]: { "id": u["id"], "email": u["email"], "name": u["name"] } for u in users }
-    _users_info_by_id = { u["id"]: { "login": u["login"], "email": u["email"], "name": u["name"] } for u in users }
-    _projects_by_id = {p['ProjectRef']: {k: v for k, v in p.items() if k != 'ProjectRef'} for p in get_projects()}
+    _fetch_start = time.perf_counter()
+    # compact index of the rims users, lookup by login or by id
+    _users_info = from_thread.run(ppms_async.get_ppms_users)
+    # the directory is cached, a booking by a user added to rims since needs a fresh one
+    if any(_users_info.get_login(u) is None for _usrids in project_ids.values() for u in _usrids):
+        alogger.debug('unknown booking user ids, fetching the rims users again')
+        reference_cache.invalidate('users')
+        _users_info = from_thread.run(ppms_async.get_ppms_users)
+    _rdms_by_pid = { r['projectid']: r['rdm'] for r in from_thread.run(ppms_async.get_rdm_collections) }
+    _projects_by_id = {p['ProjectRef']: {k: v for k, v in p.items() if k != 'ProjectRef'} for p in from_thread.run(ppms_async.get_projects)}
     if len(project_ids) > 0:
         # partial project sync
         _project_ids = list(project_ids.keys())
     else:
         # full project sync
         _project_ids = list(_projects_by_id.keys())
-    #now get projects
-    _validated_db_users = [] # list of validated users
+    _starting_ref = int(config.get('ppms', 'project_starting_ref', default=0))
     for _project_id in _project_ids:
-        if _project_id < int(config.get('ppms', 'project_starting_ref', default=0)):
-            continue
-        project = _projects_by_id.get(_project_id)
-        if project is None:
+        if _project_id >= _starting_ref and _project_id not in _projects_by_id:
             alogger.error(f'project id {_project_id} not found - is it inactive?')
-            continue
-        # note that this information is already available in the get projects query --> quick
-        ### add project
-        _projectSchema = pdb.schemas.Project(
+    _project_ids = [p for p in _project_ids if p >= _starting_ref and p in _projects_by_id]
+    _members_by_pid = dict(zip(_project_ids, from_thread.run(get_projects_members, _project_ids)))
+    _fetch_time = time.perf_counter() - _fetch_start
+
+    _db_start = time.perf_counter()
+    # db updates of the whole phase in one transaction, one savepoint per project
+    with pdb.crud.unit_of_work(db):
+        _fingerprints = pdb.crud.get_project_fingerprints(db, _project_ids)
+        _changed_members = {}
+        _changed_fingerprints = {}
+        _failed = 0
+        _project_schemas = { _project_id: pdb.schemas.Project(
                 id = _project_id,
-                coreid = project.get('CoreFacilityRef'),
-                name = project.get('ProjectName'),
-                active = bool(project.get('Active')),
-                type = project.get('ProjectType'),
-                phase = project.get('Phase'),
-                description = project.get('Descr')
-            )
-        _project_in_db = pdb.crud.create_project(db, _projectSchema)
-        ###### get more information
-        _q_collection = _rdms_by_pid.get(_project_id)
-        if (_q_collection and '-' in _q_collection) or _q_collection == '':
-            if _q_collection == '':
-                _q_collection = None
-            if _q_collection and not pdb.crud.get_collection(db, _q_collection):
-                # create collection and default collection caches
-                pdb.crud.create_collection(db, pdb.schemas.CollectionBase(name=_q_collection))
-                for cn, cp in json.loads(config.get('rdm', 'cache_defaults')).items():
-                    pdb.crud.create_collection_cache(db, pdb.schemas.CollectionCacheBase(collection_name=_q_collection, cache_name=cn, priority=cp))
-            if _project_in_db.collection != _q_collection:
-                pdb.crud.update_project_collection(db, _project_in_db.id, _q_collection)
-
-        # now with project users
-        _project_users = [n for n in [m['login'] for m in get_project_members(_project_id) if m.get('login')] if n.strip()]
-        # and extra users listed with project id, ie. booking users/assistants
-        for usrid in project_ids.get(_project_id, []):
-            usrname = _users_info_by_id[usrid]['login']
-            if usrname not in _project_users:
-                _project_users.append(usrname)
-        alogger.debug(f'project {_project_id} users: {_project_users}')
-        _validated_project_users = []
-        for _project_user in _project_users:
-            if _project_user not in _validated_db_users:
-                alogger.debug(f"checking project user: {_project_user}")
-                if not _project_user:
-                    alogger.debug(f"{_project_user} is empty. ignore")
+                coreid = _projects_by_id[_project_id].get('CoreFacilityRef'),
+                name = _projects_by_id[_project_id].get('ProjectName'),
+                active = bool(_projects_by_id[_project_id].get('Active')),
+                type = _projects_by_id[_project_id].get('ProjectType'),
+                phase = _projects_by_id[_project_id].get('Phase'),
+                description = _projects_by_id[_project_id].get('Descr')
+            ) for _project_id in _project_ids }
+        # note that this information is already available in the get projects query --> quick
+        ### add projects
+        try:
+            with pdb.crud.savepoint(db):
+                _project_counts = pdb.crud.upsert(db, pdb.models.Project, list(_project_schemas.values()))
+        except Exception:
+            alogger.error(f'problem upserting {len(_project_schemas)} projects, syncing them one by one', exc_info=True)
+            _project_counts = None
+        #now get projects
+        for _project_id in _project_ids:
+            try:
+                with pdb.crud.savepoint(db):
+                    if _project_counts is None:
+                        pdb.crud.create_project(db, _project_schemas[_project_id])
+                    ###### get more information
+                    _q_collection = _rdms_by_pid.get(_project_id)
+                    if (_q_collection and '-' in _q_collection) or _q_collection == '':
+                        if _q_collection == '':
+                            _q_collection = None
+                        if _q_collection and not pdb.crud.get_collection(db, _q_collection):
+                            # create collection and default collection caches
+                            pdb.crud.create_collection(db, pdb.schemas.CollectionBase(name=_q_collection))
+                            for cn, cp in json.loads(config.get('rdm', 'cache_defaults')).items():
+                                pdb.crud.create_collection_cache(db, pdb.schemas.CollectionCacheBase(collection_name=_q_collection, cache_name=cn, priority=cp))
+                        pdb.crud.update_project_collection(db, _project_id, _q_collection)
+            except Exception:
+                alogger.error(f'problem syncing project id {_project_id}', exc_info=True)
+                _failed += 1
+                continue
+
+            # now with project users
+            _members = _members_by_pid[_project_id]
+            if _members is None:
+                # keep the current members rather than dropping them all
+                _failed += 1
+                continue
+            _project_users = [n for n in [m['login'] for m in _members if m.get('login')] if n.strip()]
+            # and extra users listed with project id, ie. booking users/assistants
+            for usrid in project_ids.get(_project_id, []):
+                usrname = _users_info.get_login(usrid)
+                if usrname is None:
+                    alogger.warning(f'project {_project_id}: user id {usrid} not found in rims users, skipping')
                     continue
-                _db_user = get_db_user(db, login=_project_user, coreid=_project_in_db.coreid, users_info=_users_info, alert=alert)
-                _validated_db_users.append(_project_user)
-            else:
-                alogger.debug(f"already checked project user: {_project_user}")
-            _validated_project_users.append(_project_user)
-        pdb.crud.update_project_users(db, _project_id, _validated_project_users)
+                if usrname not in _project_users:
+                    _project_users.append(usrname)
+            # members and their rims details, a change in either needs the users checked again
+            _members_hash = fingerprint([(u, _users_info.get(u)) for u in sorted(set(_project_users))])
+            if _fingerprints.get(_project_id) == _members_hash:
+                alogger.debug(f'project {_project_id} members unchanged')
+                continue
+            alogger.debug(f'project {_project_id} users: {_project_users}')
+            _changed_members[_project_id] = _project_users
+            _changed_fingerprints[_project_id] = _members_hash
+        # add/update the users of all changed projects at once, then apply all member changes
+        _changed_users = { u for users in _changed_members.values() for u in users }
+        _user_counts = sync_users(db, _changed_users, _users_info, alert=alert)
+        pdb.crud.reconcile_project_users(db, _changed_members)
+        pdb.crud.set_project_fingerprints(db, _changed_fingerprints)
+    _changed = len(_changed_members)
+    _db_time = time.perf_counter() - _db_start
 
-    alogger.debug(f'projects: {len(_project_ids)}, unique project users {len(_validated_db_users)}')
+    alogger.debug(f'projects: {len(_project_ids)}, unique changed project users {len(_changed_users)}: {_user_counts}')
+    _counts = {'projects': len(_project_ids), 'projects_created': _project_counts['created'] if _project_counts else None,
+               'projects_updated': _project_counts['updated'] if _project_counts else None,
+               'members_changed': _changed, 'failed': _failed,
+               'fetch_seconds': round(_fetch_time, 2), 'db_seconds': round(_db_time, 2)}
+    alogger.info(f'synced {len(_project_ids)} projects: {_changed} member lists changed, {_failed} failed, '
+                 f'rims fetch {_fetch_time:.1f}s, db update {_db_time:.1f}s')
 
     # done syncing
     alogger.debug('--> done syncing')
     # db.close()
+    return _counts
 
 def sync_ppms_projects(db: Session, alogger: logging.Logger = logger):
-    _syncing_stat = pdb.crud.get_stat(db, 'syncing_projects')
-    if not _syncing_stat:
-        alogger.debug("--> syncing_projects not exist, create it")
-        pdb.crud.set_stat(db, name='syncing_projects', value='True', desc='is system syncing projects', isstring=False)
-    else:
-        ### in the middle of a sync
-        if eval(_syncing_stat.value):
+    with job_lock.hold('sync_ppms_projects') as _held:
+        if not _held:
             alogger.debug("--> the system is in the middle of a project sync")
             return
-        else:
-            pdb.crud.set_stat(db, name='syncing_projects', value='True')
+        _sync_ppms_projects(db, alogger)
+
+def _sync_ppms_projects(db: Session, alogger: logging.Logger = logger):
     alogger.debug("--> sync PPMS info: checking for import/ingest fails")
     notify_failed_datasets(db, alert=True)
     alogger.debug("--> sync PPMS info: cores, systems, projects, users")
+    # a full sync always starts from fresh reference reports
+    reference_cache.invalidate()
     sync_cores(db)
-    pids = {p['System ID']: p['PID'] for p in get_system_pids() if p.get('PID')}
-    systems = get_systems()
-    for system in systems:
-        _id = system.get('systemid')
-        pdb.crud.create_system(db, pdb.schemas.System(
-            id = _id,
+    pids = {p['System ID']: p['PID'] for p in from_thread.run(ppms_async.get_system_pids) if p.get('PID')}
+    systems = from_thread.run(ppms_async.get_systems)
+    _counts = pdb.crud.upsert(db, pdb.models.System, [pdb.schemas.System(
+            id = system.get('systemid'),
             coreid = system.get('coreid'),
             type = system.get('systemtype'),
             name = system.get('systemname'),
-            pid = pids.get(_id, ''))
-        )
-    sync_projects(db, alogger=alogger, alert=True)
-    pdb.crud.set_stat(db, name='syncing_projects', value='False')
+            pid = pids.get(system.get('systemid'), '')) for system in systems])
+    alogger.debug(f'synced {len(systems)} systems: {_counts}')
+    _counts = sync_projects(db, alogger=alogger, alert=True)
+    pdb.crud.set_stat(db, name='project_sync_counts', value=json.dumps(_counts), desc='project counts and timings of the last full project sync', isstring=False)
@@ -9,8 +9,11 @@ import datetime
 import pitschi.config as config
 import pitschi.utils as utils
 import pitschi.mail as mail
-import pitschi.clowder_rest as clowderful
+import pitschi.clowder_rest_async as clowderful
+import pitschi.job_lock as job_lock
 import os, json
+import functools
+from anyio import from_thread
 from fastapi_utils.tasks import repeat_every
 
 router = APIRouter()
@@ -55,6 +58,7 @@ def check_all_files_in_dataset(db, dataset, project, logger):
 def ingest_dataset_to_clowder(db, dataset, project, logger):
     """
     Go over the files, pull it, check, 
+    Runs in a threadpool thread, the clowder requests are run on the event loop with from_thread
     """
     logger.debug(f"@ingest-dataset: Start ingesting datataset {dataset.name} with {len(dataset.files)} files")
     _clowder_key = config.get('clowder', 'api_key')
@@ -64,8 +68,8 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
     found = False
     if not dataset.space:
         logger.debug(f"finding space: {project.name}")
-        res = clowderful.get_spaces(_clowder_key, _clowder_api_url, project.name, False)
-        if res.ok:
+        res = from_thread.run(clowderful.get_spaces, _clowder_key, _clowder_api_url, project.name, False)
+        if res.is_success:
             for _space in res.json():
                 if _space.get('name') == project.name:
                     # update 
@@ -78,8 +82,8 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
     if dataset.space:
         if not dataset.datasetid:
             logger.debug(f"finding dataset: {dataset.name}")
-            res = clowderful.list_dataset_in_space(_clowder_key, _clowder_api_url, dataset.space)
-            if res.ok:
+            res = from_thread.run(clowderful.list_dataset_in_space, _clowder_key, _clowder_api_url, dataset.space)
+            if res.is_success:
                 _clwddatasets = res.json()
                 for _clwddataset in _clwddatasets:
                     if _clwddataset.get('name') == dataset.name:
@@ -90,7 +94,7 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
                         found = True
                 # not found, create new one
                 if not found:
-                    _ds_info = clowderful.create_dataset(_clowder_key, _clowder_api_url, dataset.space, dataset.name)
+                    _ds_info = from_thread.run(clowderful.create_dataset, _clowder_key, _clowder_api_url, dataset.space, dataset.name)
                     logger.debug(f"@ingest-dataset: dataset created: {_ds_info}")
                     pdb.crud.update_dataset_space_datasetid(db, dataset.id, None, _ds_info.get('id'))
                     dataset.datasetid = _ds_info.get('id')
@@ -108,10 +112,10 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
                         'PID': pdb.crud.get_system_pid(db, _dataset_booking.systemid),
                         'ROR': pdb.crud.get_system_ror(db, _dataset_booking.systemid)
                     }
-                    clowderful.upload_dataset_metadata(_clowder_key, _clowder_api_url, _ds_info.get('id'), _ds_metadata)
+                    from_thread.run(clowderful.upload_dataset_metadata, _clowder_key, _clowder_api_url, _ds_info.get('id'), _ds_metadata)
                     ### add tags
                     _ds_tags = [ dataset.originalmachine, _dataset_booking.username, str(_dataset_booking.projectid) ]
-                    clowderful.add_dataset_tags(_clowder_key, _clowder_api_url, _ds_info.get('id'), _ds_tags)
+                    from_thread.run(clowderful.add_dataset_tags, _clowder_key, _clowder_api_url, _ds_info.get('id'), _ds_tags)
             else:
                 found = False
                 logger.debug("@ingest-dataset: cannot find dataset, ERROR")
@@ -135,7 +139,7 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
     dataset_root = f"{config.get('rdm', 'prefix', default='/data')}/{qcollection}/{_relpathfromrootcollection}"
     folders = {}
     ignore_folders = []
-    _ds_folders = clowderful.get_dataset_folders(_clowder_key, _clowder_api_url, dataset.datasetid)
+    _ds_folders = from_thread.run(clowderful.get_dataset_folders, _clowder_key, _clowder_api_url, dataset.datasetid)
     for root, dirs, files in os.walk(dataset_root, topdown = True):
         # go to clowder and create those
         for dir in dirs:
@@ -156,7 +160,7 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
             if not _exist:
                 logger.debug (f"\nCreate folder {_current_dir_relativepath}")
                 try:
-                    _folder = clowderful.add_folder(_clowder_key, _clowder_api_url, dataset.datasetid, dir, parent_folder_id=_parent_folder_id)
+                    _folder = from_thread.run(functools.partial(clowderful.add_folder, parent_folder_id=_parent_folder_id), _clowder_key, _clowder_api_url, dataset.datasetid, dir)
                     folders[_current_dir_fullpath] = _folder['id']
                 except Exception as e:
                     logger.error (f">>>Exception 2 creating folder {e}")
@@ -190,7 +194,7 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
                     _to_be_ingested = False
             if _to_be_ingested:
                 try:
-                    _fileinfo = clowderful.add_server_file(_clowder_key, _clowder_api_url, dataset.datasetid, _file_fullpath, check_duplicate=True, parent_folderid=_parent_folder_id)
+                    _fileinfo = from_thread.run(functools.partial(clowderful.add_server_file, check_duplicate=True, parent_folderid=_parent_folder_id), _clowder_key, _clowder_api_url, dataset.datasetid, _file_fullpath)
                     logger.info(f"Done ingesting clowder file {_fileinfo}")
                     # update database
                     if _file_object:
@@ -243,20 +247,18 @@ def ingest_dataset_to_clowder(db, dataset, project, logger):
 def send_email(db, datasetinfo, result, messages):
     if result:
         title = f"Successfully ingested dataset"
-        to_address = datasetinfo.user.email
         # if assistant is present, then sent email to assisant
-        if datasetinfo.booking and datasetinfo.booking.assistant:
-            to_address = pdb.crud.get_ppms_user(db, datasetinfo.booking.assistant).email
+        to_address = datasetinfo.to_address
         pitschi_url = f"{config.get('clowder', 'url')}/datasets/{datasetinfo.datasetid}?space={datasetinfo.space}"
         _relpathfromrootcollection = datasetinfo.relpathfromrootcollection.replace("\\", "/")
-        cloud_rdm_url=f"https://cloud.rdm.uq.edu.au/index.php/apps/files/?dir=/{datasetinfo.project.collection}/{_relpathfromrootcollection}"
+        cloud_rdm_url=f"https://cloud.rdm.uq.edu.au/index.php/apps/files/?dir=/{datasetinfo.collection}/{_relpathfromrootcollection}"
         samba_url = 'smb:' + datasetinfo.networkpath.replace('\\', '/')
         contents = f"""
         <html>
             <head></head>
             <body>
-                <p>Dear {datasetinfo.user.name},<br /></p>
-                <p>Pitschi has successfully ingested dataset from {datasetinfo.system.name} into the Clowder space for project "{datasetinfo.project.name}".</p>
+                <p>Dear {datasetinfo.user_name},<br /></p>
+                <p>Pitschi has successfully ingested dataset from {datasetinfo.system_name} into the Clowder space for project "{datasetinfo.project_name}".</p>
 
                 <p>You can view the dataset using the following systems (please allow time for synchronization):</p>
                     <ul>
@@ -265,8 +267,8 @@ def send_email(db, datasetinfo, result, messages):
                         <li><b>Windows</b> Enter this location into File Explorer: <b>{datasetinfo.networkpath}</b>. Please use your UQ username (eg: uq\\uqxxxxxx) and password.</li>
                         <li><b>MacOS</b> Go to Finder and then on the menu Go-> Connect to Server.... Enter this text: <b>{samba_url}</b>. Please use your UQ username (eg: uq\\uqxxxxxx) and password.</li>
                         <li><b>Linux</b> Enter this location into File Manager (Caja, Nautilus, etc): <b>{samba_url}</b>. Please use your UQ username (eg: uq\\uqxxxxxx) and password.</li>
-                        <li><b>CVL</b> Go to collection: <b>{datasetinfo.project.collection.strip().split("-")[-1]}</b> and then {_relpathfromrootcollection}</li>
-                        <li><b>Image Processing Portal</b> <a href="https://ipp.rcc.uq.edu.au/?component=filesmanager&relpath={datasetinfo.project.collection.strip().split("-")[-1]}/{_relpathfromrootcollection}">here</a></li>
+                        <li><b>CVL</b> Go to collection: <b>{datasetinfo.collection.strip().split("-")[-1]}</b> and then {_relpathfromrootcollection}</li>
+                        <li><b>Image Processing Portal</b> <a href="https://ipp.rcc.uq.edu.au/?component=filesmanager&relpath={datasetinfo.collection.strip().split("-")[-1]}/{_relpathfromrootcollection}">here</a></li>
                     </ul>
                 </p>
                 Regards,<br />
@@ -286,10 +288,10 @@ def send_email(db, datasetinfo, result, messages):
                 <ul>
                     <li><b>Machine</b> {datasetinfo.originalmachine}</li>
                     <li><b>Location</b> {datasetinfo.originalpath}</li>
-                    <li><b>Booking id:</b> {datasetinfo.booking.id}</li>
-                    <li><b>system id:</b> {datasetinfo.booking.systemid}</li>
-                    <li><b>username:</b> {datasetinfo.booking.username}</li>
-                    <li><b>project id:</b> {datasetinfo.booking.projectid}</li>
+                    <li><b>Booking id:</b> {datasetinfo.bookingid}</li>
+                    <li><b>system id:</b> {datasetinfo.systemid}</li>
+                    <li><b>username:</b> {datasetinfo.username}</li>
+                    <li><b>project id:</b> {datasetinfo.projectid}</li>
                 </ul>
                 <p> Reasons: </p>
                 <ul>
@@ -311,49 +313,56 @@ def send_email(db, datasetinfo, result, messages):
 @router.on_event("startup")
 @repeat_every(seconds=60 * int(config.get('clowder', 'ingest_frequency')), wait_first=False, logger=logger)
 def ingest() -> None:
+    # runs in the threadpool, the clowder requests go back to the event loop through from_thread
     # first, check mount point
     if not utils.ok_for_ingest():
         logger.debug(">>> scheduled ingest: mount point is not ready")
         return
-    # db = SessionLocal()
-    with sessionmaker.context_session() as db:
-        logger.debug(">>> Repeated ingest: querying successfully imported datasets")
-        # first query datasets that are in imported mode success
-        _imported_datasets = pdb.crud.get_imported_success_datasets(db)
-        # for each dataset, first change it to imported - ongoing
-        logger.debug(f"There are {len(_imported_datasets)} datasets successfully imported")
-        for _dataset in _imported_datasets:
-            logger.debug(f"Looking into dataset {_dataset.id}")
-            _project = pdb.crud.get_project_from_booking(db, _dataset.bookingid)
-            if _project:
-                logger.debug(f"project {_project.name}")
-                # then for each file,
-                _dataset_ready = check_all_files_in_dataset(db, _dataset, _project, logger)
-                # proceed if datasaet is ready or the booking time is over by 24 hours
-                _dataset_booking =  pdb.crud.get_booking(db, _dataset.bookingid)
-                # this is brisbane time
-                _booking_start_time = datetime.datetime.fromisoformat(f"{_dataset_booking.bookingdate} {_dataset_booking.starttime}")
-                _booking_end_time = _booking_start_time + datetime.timedelta(minutes = _dataset_booking.duration)
-                # duration till booking finished
-                _lapsed_time_since_finish = datetime.datetime.now(pytz.timezone(config.get('ppms', 'timezone'))) - utils.localize_time(_booking_end_time)
-                # if ready, or time has passed wait_time_to_sync then start ingesting
-                if _dataset_ready or _lapsed_time_since_finish.total_seconds()/3600 > int(config.get('clowder', 'wait_time_to_sync')) :
-                    logger.debug(f"Processing dataset {_dataset.id}")
-                    pdb.crud.update_dataset_mode_status(db, _dataset.id, pdb.models.Mode.ingested, pdb.models.Status.ongoing)
-                    (result, messages) = ingest_dataset_to_clowder(db, _dataset, _project, logger)
-                    logger.debug(f"Done ingesting, result: {result} \n messages: {messages}")
-                    # send an email
-                    _dataset_info = pdb.crud.summarize_dataset_info(db, _dataset.id)
-                    if _dataset_info:
-                        send_email(db, _dataset_info, result, messages)
-                    if result:
-                        # success
-                        pdb.crud.update_dataset_mode_status(db, _dataset.id, pdb.models.Mode.ingested, pdb.models.Status.success)
-                    else:
-                        # fail
-                        pdb.crud.update_dataset_mode_status(db, _dataset.id, pdb.models.Mode.ingested, pdb.models.Status.failed)
+    with job_lock.hold('ingest') as _held:
+        if not _held:
+            return
+        with sessionmaker.context_session() as db:
+            ingest_imported_datasets(db)
+
+
+def ingest_imported_datasets(db: Session) -> None:
+    logger.debug(">>> Repeated ingest: querying successfully imported datasets")
+    # first query datasets that are in imported mode success
+    _imported_datasets = pdb.crud.get_imported_success_datasets(db)
+    # for each dataset, first change it to imported - ongoing
+    logger.debug(f"There are {len(_imported_datasets)} datasets successfully imported")
+    for _dataset in _imported_datasets:
+        logger.debug(f"Looking into dataset {_dataset.id}")
+        _project = pdb.crud.get_project_from_booking(db, _dataset.bookingid)
+        if _project:
+            logger.debug(f"project {_project.name}")
+            # then for each file,
+            _dataset_ready = check_all_files_in_dataset(db, _dataset, _project, logger)
+            # proceed if datasaet is ready or the booking time is over by 24 hours
+            _dataset_booking =  pdb.crud.get_booking(db, _dataset.bookingid)
+            # this is brisbane time
+            _booking_start_time = datetime.datetime.fromisoformat(f"{_dataset_booking.bookingdate} {_dataset_booking.starttime}")
+            _booking_end_time = _booking_start_time + datetime.timedelta(minutes = _dataset_booking.duration)
+            # duration till booking finished
+            _lapsed_time_since_finish = datetime.datetime.now(pytz.timezone(config.get('ppms', 'timezone'))) - utils.localize_time(_booking_end_time)
+            # if ready, or time has passed wait_time_to_sync then start ingesting
+            if _dataset_ready or _lapsed_time_since_finish.total_seconds()/3600 > int(config.get('clowder', 'wait_time_to_sync')) :
+                logger.debug(f"Processing dataset {_dataset.id}")
+                pdb.crud.update_dataset_mode_status(db, _dataset.id, pdb.models.Mode.ingested, pdb.models.Status.ongoing)
+                (result, messages) = ingest_dataset_to_clowder(db, _dataset, _project, logger)
+                logger.debug(f"Done ingesting, result: {result} \n messages: {messages}")
+                # send an email
+                _dataset_info = pdb.crud.summarize_dataset_info(db, _dataset.id)
+                if _dataset_info:
+                    send_email(db, _dataset_info, result, messages)
+                if result:
+                    # success
+                    pdb.crud.update_dataset_mode_status(db, _dataset.id, pdb.models.Mode.ingested, pdb.models.Status.success)
                 else:
-                    logger.info(f"project {_project.name} does not have all files in this cache")
+                    # fail
+                    pdb.crud.update_dataset_mode_status(db, _dataset.id, pdb.models.Mode.ingested, pdb.models.Status.failed)
             else:
-                logger.error(f"scheduled ingest: Error: Cannot find project for booking {_dataset.bookingid}")
-        # db.close()
+                logger.info(f"project {_project.name} does not have all files in this cache")
+        else:
+            logger.error(f"scheduled ingest: Error: Cannot find project for booking {_dataset.bookingid}")
+    # db.close()
@@ -1,12 +1,18 @@
 import logging
 import pitschi.config as config
 import datetime, pytz
+import asyncio
+import json
+from anyio import from_thread
 from fastapi import APIRouter, Depends, status
 from fastapi_utils.tasks import repeat_every
 import pitschi.db as pdb
-from pitschi.ppms import get_system_pids, get_daily_bookings, get_daily_training, get_booking_details
+import pitschi.ppms_async as ppms_async
+import pitschi.async_http as async_http
+import pitschi.job_lock as job_lock
 from pitschi.routers import ppms_utils
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter()
 logger = logging.getLogger('pitschixapi')
@@ -21,42 +27,163 @@ database_uri = (f"{config.get('database', 'type')}://"
 sessionmaker = FastAPISessionMaker(database_uri)
 
 
+def booking_detail_semaphore() -> asyncio.Semaphore:
+    return asyncio.Semaphore(max(1, int(config.get('ppms', 'booking_detail_concurrency', default=8))))
+
+
+async def get_bookings_details(bookings: list, semaphore: asyncio.Semaphore = None) -> list:
+    '''
+    fetch GetSessionDetails for each booking, at most booking_detail_concurrency at a time
+    pass a semaphore from booking_detail_semaphore() to share that bound between concurrent syncs
+    results are returned in the same order as bookings, a failed lookup gives None
+    '''
+    _semaphore = semaphore or booking_detail_semaphore()
+    async def _get_details(booking):
+        async with _semaphore:
+            try:
+                return await ppms_async.get_booking_details(booking.get('coreid'), booking.get('Ref (session)'))
+            except:
+                logger.warning(f'get booking details error: booking id {booking.get("Ref (session)")}', exc_info=True)
+                return None
+    return await asyncio.gather(*[_get_details(_booking) for _booking in bookings])
+
+
+def sync_window() -> tuple:
+    '''
+    first and last day of the regular booking sync, relative to today in the ppms timezone
+    '''
+    _today_tz = datetime.datetime.now(pytz.timezone(config.get('ppms', 'timezone'))).date()
+    return (_today_tz - datetime.timedelta(days=int(config.get('ppms', 'booking_sync_days_before', default=0))),
+            _today_tz + datetime.timedelta(days=int(config.get('ppms', 'booking_sync_days_after', default=0))))
+
+
 # every half hour
 @router.on_event('startup')
 @repeat_every(seconds=60 * int(config.get('ppms', 'booking_sync_minute')), wait_first=False, logger=logger)
 def sync_ppms_bookings() -> None:
+    # runs in the threadpool, the ppms requests go back to the event loop through from_thread
     # db = SessionLocal()
-    logger.debug('<<<<<<<<<<<<<< Start syncing PPMS bookings')
-    with sessionmaker.context_session() as db:
-        logger.debug('query ppms bookings of today')
-        _today_tz = datetime.datetime.now(pytz.timezone(config.get('ppms', 'timezone'))).date()
-        _bookings = get_daily_bookings(_today_tz)
-        pids = {p['System ID']: p['PID'] for p in get_system_pids() if p.get('PID')}
-        logger.debug(f'bookings: {len(_bookings)}')
-        # training sessions can have multiple records -- use the record with
-        # 'Training organised by' == 'User full Name' to set booking project/user
-        _training_sessions_by_id = {ts['SessionID']: {k: v for k, v in ts.items() if k != 'SessionID'}
-            for ts in get_daily_training(_today_tz) if ts['Training organised by'] == ts['User full Name']}
-        _training_count = 0
-        _booking_project_ids = {}
-        for _booking in _bookings:
+    with job_lock.hold('sync_ppms_bookings') as _held:
+        if not _held:
+            return
+        logger.debug('<<<<<<<<<<<<<< Start syncing PPMS bookings')
+        with sessionmaker.context_session() as db:
+            _startdate, _enddate = sync_window()
+            _counts = sync_bookings(db, _startdate, _enddate)
+            pdb.crud.set_stat(db, name='booking_sync_counts', value=json.dumps(_counts), desc='booking counts of the last booking sync', isstring=False)
+
+
+async def backfill_bookings(startdate: datetime.date, enddate: datetime.date, chunk_days: int = None, concurrency: int = None) -> dict:
+    '''
+    sync bookings for an arbitrary date range, split into chunks of chunk_days
+    at most concurrency chunks are synced at the same time, each in a threadpool thread with its own db session
+    the chunks share one booking_detail_concurrency bound on the session detail requests
+    '''
+    chunk_days = chunk_days or int(config.get('ppms', 'backfill_chunk_days', default=7))
+    concurrency = concurrency or int(config.get('ppms', 'backfill_concurrency', default=2))
+    _chunks = []
+    _chunk_start = startdate
+    while _chunk_start <= enddate:
+        _chunk_end = min(_chunk_start + datetime.timedelta(days=chunk_days - 1), enddate)
+        _chunks.append((_chunk_start, _chunk_end))
+        _chunk_start = _chunk_end + datetime.timedelta(days=1)
+    logger.info(f'backfill bookings from {startdate} to {enddate} in {len(_chunks)} chunks')
+    _semaphore = asyncio.Semaphore(max(1, concurrency))
+    _detail_semaphore = booking_detail_semaphore()
+    def _sync_chunk_session(chunk):
+        with sessionmaker.context_session() as db:
+            return sync_bookings(db, *chunk, detail_semaphore=_detail_semaphore)
+    async def _sync_chunk(chunk):
+        async with _semaphore:
+            return await run_in_threadpool(_sync_chunk_session, chunk)
+    _results = await asyncio.gather(*[_sync_chunk(_chunk) for _chunk in _chunks], return_exceptions=True)
+    _totals = {'bookings': 0, 'skipped': 0, 'unchanged': 0, 'changed': 0, 'failed_chunks': 0}
+    for _chunk, _result in zip(_chunks, _results):
+        if isinstance(_result, Exception):
+            logger.error(f'backfill bookings from {_chunk[0]} to {_chunk[1]} failed', exc_info=_result)
+            _totals['failed_chunks'] += 1
+        else:
+            for k, v in _result.items():
+                _totals[k] += v
+    logger.info(f'finished backfill bookings from {startdate} to {enddate}: {_totals}')
+    return _totals
+
+
+def run_backfill(startdate: datetime.date, enddate: datetime.date, chunk_days: int = None, concurrency: int = None) -> dict:
+    '''
+    backfill_bookings under the lease of the booking sync, so the two never overlap
+    must run in a threadpool thread, returns None if a booking sync holds the lease
+    '''
+    with job_lock.hold('sync_ppms_bookings') as _held:
+        if not _held:
+            logger.warning(f'backfill bookings from {startdate} to {enddate} skipped: a booking sync is running')
+            return None
+        return from_thread.run(backfill_bookings, startdate, enddate, chunk_days, concurrency)
+
+
+def sync_bookings(db: Session, startdate: datetime.date, enddate: datetime.date, detail_semaphore: asyncio.Semaphore = None) -> dict:
+    '''
+    sync ppms bookings from startdate to enddate (inclusive) into the db
+    must run in a threadpool thread, the ppms requests are run on the event loop with from_thread
+    returns the counts of bookings, skipped, unchanged and new/changed sessions
+    detail_semaphore bounds the session detail requests together with the other syncs sharing it
+    '''
+    logger.debug(f'query ppms bookings from {startdate} to {enddate}')
+    _bookings = from_thread.run(ppms_async.get_bookings, startdate, enddate)
+    pids = {p['System ID']: p['PID'] for p in from_thread.run(ppms_async.get_system_pids) if p.get('PID')}
+    logger.debug(f'bookings: {len(_bookings)}')
+    # training sessions can have multiple records -- use the record with
+    # 'Training organised by' == 'User full Name' to set booking project/user
+    _training_sessions_by_id = {ts['SessionID']: {k: v for k, v in ts.items() if k != 'SessionID'}
+        for ts in from_thread.run(ppms_async.get_training, startdate, enddate) if ts['Training organised by'] == ts['User full Name']}
+    _training_count = 0
+    _booking_project_ids = {}
+    # only fetch details for sessions whose report row changed, or were last checked too long ago
+    _fingerprints = pdb.crud.get_booking_fingerprints(db, [b.get('Ref (session)') for b in _bookings])
+    _max_age = datetime.timedelta(minutes=int(config.get('ppms', 'booking_details_max_age', default=120)))
+    _now = datetime.datetime.now(pytz.utc)
+    _to_check = []
+    for _booking in _bookings:
+        _booking_id = _booking.get('Ref (session)')
+        _report_hash = ppms_utils.fingerprint(_booking, _training_sessions_by_id.get(_booking_id))
+        _stored = _fingerprints.get(_booking_id)
+        # no fingerprint: the booking was stored without its system or user, check it again
+        if _stored and _stored['fingerprint'] and _stored['reporthash'] == _report_hash and _now - _stored['checked'] < _max_age:
+            continue
+        _to_check.append((_booking, _report_hash))
+    _skipped = len(_bookings) - len(_to_check)
+    _unchanged = []
+    _changed = []
+    _booking_details_lists = from_thread.run(get_bookings_details, [b for b, _ in _to_check], detail_semaphore)
+    # one transaction for the systems and fingerprint updates
+    with pdb.crud.unit_of_work(db):
+        for (_booking, _report_hash), _booking_details_list in zip(_to_check, _booking_details_lists):
             _booking_id = _booking.get('Ref (session)')
-            _booking_details_list = get_booking_details(_booking.get('coreid'), _booking_id)
+            if _booking_details_list is None:
+                # failed lookup, left as it is and tried again next run
+                continue
             if len(_booking_details_list) == 0:
-                logger.debug(f'get booking details error: booking id {_booking_id}')
+                logger.debug(f'no booking details: booking id {_booking_id}')
                 continue
+            _fingerprint = ppms_utils.fingerprint(_booking, _training_sessions_by_id.get(_booking_id), _booking_details_list)
+            _stored = _fingerprints.get(_booking_id)
+            if _stored and _stored['fingerprint'] == _fingerprint:
+                _unchanged.append(_booking_id)
+                continue
+            _changed.append((_booking, _report_hash, _fingerprint))
             _booking_details = _booking_details_list[0]
             _booking['systemId'] = None
             _id = _booking_details.get('systemId')
             if _id:
                 try:
-                    _system = pdb.crud.create_system(db, pdb.schemas.System(
-                        id = _id,
-                        coreid = _booking.get('coreid'),
-                        type = _booking_details.get('systemType'),
-                        name = _booking_details.get('systemName'),
-                        pid = pids.get(_id, ''))
-                    )
+                    with pdb.crud.savepoint(db):
+                        _system = pdb.crud.create_system(db, pdb.schemas.System(
+                            id = _id,
+                            coreid = _booking.get('coreid'),
+                            type = _booking_details.get('systemType'),
+                            name = _booking_details.get('systemName'),
+                            pid = pids.get(_id, ''))
+                        )
                     _booking['systemId'] = _system.id
                 except:
                     logger.warning(f'get booking system error: booking id {_booking_id}', exc_info=True)
@@ -88,31 +215,84 @@ def sync_ppms_bookings() -> None:
                     _booking_project_ids[_project_id].append(_booking['assistantId'])
             else:
                 _booking['projectId'] = None
-        logger.debug(f'get project and user details for {len(_bookings)} bookings ({_training_count} training)')
-        # sync project and user info for the daily bookings
+        pdb.crud.touch_booking_fingerprints(db, _unchanged)
+    logger.debug(f'get project and user details for {len(_changed)} bookings ({_training_count} training)')
+    # sync project and user info for the new/changed bookings
+    if _booking_project_ids:
         ppms_utils.sync_projects(db, alogger=logger, project_ids=_booking_project_ids)
-        # create/update daily db bookings now the related project and user data is up to date
-        for _booking in _bookings:
-            logger.debug(f'_booking: {_booking}')
-            try:
-                _booking_user = pdb.crud.get_ppms_user_by_uid(db, _booking.get('userId'))
-                _booking_object = pdb.schemas.Booking(
-                        id = _booking.get('Ref (session)'),
-                        bookingdate = datetime.datetime.strptime(_booking.get('Date'), '%Y/%m/%d').date(),
-                        starttime = datetime.time.fromisoformat(_booking.get('Start time')),
-                        duration = _booking.get('Duration booked (minutes)'),
-                        cancelled = _booking.get('Cancelled'),
-                        systemid = _booking.get('systemId'),
-                        status = _booking.get('status'),
-                        projectid = _booking.get('projectId'),
-                        username = _booking_user[0].username if len(_booking_user) else None
-                    )
-                if _booking.get('assistantId'):
-                    _assistant = pdb.crud.get_ppms_user_by_uid(db, _booking['assistantId'])
-                    _booking_object.assistant = _assistant[0].username if len(_assistant) else None
-                    logger.debug(f'booking assistant: {_booking_object.assistant}')
-                pdb.crud.create_booking(db, _booking_object)
-            except Exception as e:
-                logger.error(f'problem creating booking id {_booking.get("Ref (session)")}', exc_info=True)
-
-        logger.debug(f'finished syncing {len(_bookings)} bookings')
+    # create/update db bookings now the related project and user data is up to date
+    _usernames = pdb.crud.get_ppms_usernames_by_uid(db, [b.get('userId') for b, _, _ in _changed] +
+                                                        [b.get('assistantId') for b, _, _ in _changed if b.get('assistantId')])
+    _booking_objects = []
+    _booking_fingerprints = []
+    for _booking, _report_hash, _fingerprint in _changed:
+        logger.debug(f'_booking: {_booking}')
+        try:
+            _booking_object = pdb.schemas.Booking(
+                    id = _booking.get('Ref (session)'),
+                    bookingdate = datetime.datetime.strptime(_booking.get('Date'), '%Y/%m/%d').date(),
+                    starttime = datetime.time.fromisoformat(_booking.get('Start time')),
+                    duration = _booking.get('Duration booked (minutes)'),
+                    cancelled = _booking.get('Cancelled'),
+                    systemid = _booking.get('systemId'),
+                    status = _booking.get('status'),
+                    projectid = _booking.get('projectId'),
+                    username = _usernames.get(_booking.get('userId'))
+                )
+            if _booking.get('assistantId'):
+                _booking_object.assistant = _usernames.get(_booking['assistantId'])
+                logger.debug(f'booking assistant: {_booking_object.assistant}')
+            _booking_objects.append(_booking_object)
+            # only a booking stored with its system and users is done with, the rest are synced again next run
+            _resolved = _booking_object.systemid and _booking_object.username and \
+                        (not _booking.get('assistantId') or _booking_object.assistant)
+            if not _resolved:
+                logger.warning(f'booking {_booking_object.id} stored without its system or user, syncing it again next run')
+            _booking_fingerprints.append((_booking_object.id, _report_hash, _fingerprint if _resolved else None))
+        except Exception as e:
+            logger.error(f'problem creating booking id {_booking.get("Ref (session)")}', exc_info=True)
+    with pdb.crud.unit_of_work(db):
+        try:
+            with pdb.crud.savepoint(db):
+                pdb.crud.upsert_bookings(db, _booking_objects)
+        except Exception:
+            # one bad booking fails the whole statement, fall back to one at a time
+            logger.error(f'problem upserting {len(_booking_objects)} bookings, creating them one by one', exc_info=True)
+            _created = []
+            for _booking_object, _booking_fingerprint in zip(_booking_objects, _booking_fingerprints):
+                try:
+                    with pdb.crud.savepoint(db):
+                        pdb.crud.create_booking(db, _booking_object)
+                    _created.append(_booking_fingerprint)
+                except Exception:
+                    logger.error(f'problem creating booking id {_booking_object.id}', exc_info=True)
+            _booking_fingerprints = _created
+        pdb.crud.set_booking_fingerprints(db, _booking_fingerprints)
+
+    _counts = {'bookings': len(_bookings), 'skipped': _skipped, 'unchanged': len(_unchanged), 'changed': len(_changed)}
+    logger.info(f'finished syncing {len(_bookings)} bookings: {_skipped} skipped, '
+                f'{len(_unchanged)} details unchanged, {len(_changed)} new or changed')
+    return _counts
+
+
+def main(argv=None):
+    """
+    backfill bookings from the command line
+    python -m pitschi.routers.sync_ppms_bookings 2023-01-01 2023-03-31 [--chunk-days 7] [--concurrency 2]
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Sync PPMS bookings for a date range')
+    parser.add_argument('startdate', type=datetime.date.fromisoformat)
+    parser.add_argument('enddate', type=datetime.date.fromisoformat)
+    parser.add_argument('--chunk-days', type=int, default=None)
+    parser.add_argument('--concurrency', type=int, default=None)
+    args = parser.parse_args(argv)
+    async def _backfill():
+        try:
+            return await run_in_threadpool(run_backfill, args.startdate, args.enddate, args.chunk_days, args.concurrency)
+        finally:
+            await async_http.close()
+    print(asyncio.run(_backfill()))
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,42 @@
 import pitschi.config as config
 import datetime, pytz
 import os
+from functools import lru_cache
 from chardet import detect
 from random import randrange
 
+@lru_cache()
+def ppms_timezone():
+    # looked up once, converting listed datasets calls this for every timestamp
+    return pytz.timezone(config.get('ppms', 'timezone'))
+
 def localize_time(datetimeobject):
     if datetimeobject.tzinfo:
         return datetimeobject
     else:
-        return pytz.timezone(config.get('ppms', 'timezone')).localize(datetimeobject, is_dst=None)
+        return ppms_timezone().localize(datetimeobject, is_dst=None)
 
 #converts navive datetime object to UTC and then convert it to ppms timezone
 def convert_to_xapi_tz(datetimeobject):
-    return pytz.timezone('utc').localize(datetimeobject, is_dst=None).astimezone(pytz.timezone(config.get('ppms', 'timezone')))
+    return pytz.timezone('utc').localize(datetimeobject, is_dst=None).astimezone(ppms_timezone())
 
 def convert_utc_to_ppms(datetimeobject):
-    return datetimeobject.astimezone(pytz.timezone(config.get('ppms', 'timezone')))
+    return datetimeobject.astimezone(ppms_timezone())
 
 def convert_to_utc(datetimeobject):
     if datetimeobject.tzinfo:
         return datetimeobject.astimezone(pytz.utc)
     else:
-        return pytz.timezone(config.get('ppms', 'timezone')).localize(datetimeobject, is_dst=None).astimezone(pytz.utc)
+        return ppms_timezone().localize(datetimeobject, is_dst=None).astimezone(pytz.utc)
+
+def ppms_day_range(dateobject):
+    """
+    start and end (exclusive) of a day in the ppms timezone, in utc
+    """
+    _tz = ppms_timezone()
+    _start = _tz.localize(datetime.datetime.combine(dateobject, datetime.time.min))
+    _end = _tz.localize(datetime.datetime.combine(dateobject + datetime.timedelta(days=1), datetime.time.min))
+    return _start.astimezone(pytz.utc), _end.astimezone(pytz.utc)
 
 
 def get_encoding_type(file):
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import signal
+from logging.handlers import TimedRotatingFileHandler
+
+import pitschi.config as config
+
+logger = logging.getLogger('pitschixapi')
+
+##################
+# Scheduled jobs outside the API process
+# pitschi-worker runs the project sync, the booking sync and the ingest on the
+# same schedules as the API used to, so the API can run any number of uvicorn
+# workers with [api] scheduled_jobs=no. Options in [worker] named section.option
+# override that option in the worker process only, e.g. ppms.concurrency_max=16
+##################
+
+def job_routers() -> list:
+    """
+    Routers of the scheduled jobs switched on in config, their startup handlers start the jobs
+    """
+    # imported here, the job modules read their schedules from config when they are loaded
+    from pitschi.routers import sync_ppms_projects, sync_ppms_bookings, scheduledingest
+    _routers = []
+    if config.get('ppms', 'syncing_ppms_project', default = "no") == "yes":
+        logger.debug("Syncing project on")
+        _routers.append(sync_ppms_projects.router)
+    else:
+        logger.debug("Syncing projects with ppms off")
+    if config.get('ppms', 'syncing_ppms_bookings', default = "no") == "yes":
+        logger.debug("Syncing bookings on")
+        _routers.append(sync_ppms_bookings.router)
+    else:
+        logger.debug("Syncing bookings with ppms off")
+    if config.get('clowder', 'ingesting', default = "yes") == "yes":
+        logger.debug("ingsting on")
+        _routers.append(scheduledingest.router)
+    else:
+        logger.debug("ingesting off")
+    return _routers
+
+def apply_overrides():
+    """
+    Copy the section.option entries of [worker] over the options they name
+    """
+    if not config.config.has_section('worker'):
+        return
+    for _key, _value in config.config.items('worker', raw=True):
+        if '.' in _key:
+            _section, _option = _key.split('.', 1)
+            if not config.config.has_section(_section):
+                config.config.add_section(_section)
+            config.config.set(_section, _option, _value)
+
+async def run():
+    import pitschi.async_http as async_http
+    _stop = asyncio.Event()
+    _loop = asyncio.get_running_loop()
+    for _signal in (signal.SIGINT, signal.SIGTERM):
+        _loop.add_signal_handler(_signal, _stop.set)
+    _routers = job_routers()
+    if not _routers:
+        logger.warning("pitschi-worker: no scheduled jobs switched on")
+        return
+    # repeat_every handlers schedule their job loops and return straight away
+    for _router in _routers:
+        for _handler in _router.on_startup:
+            await _handler()
+    logger.info("Start pitschi-worker")
+    await _stop.wait()
+    logger.info("Stop pitschi-worker")
+    await async_http.close()
+
+def main():
+    apply_overrides()
+    logger.setLevel(logging.DEBUG)
+    fh = TimedRotatingFileHandler(config.get('logging', 'worker_log_file', default = "/var/log/pitschi/pitschi-worker.log"),
+                                  when='midnight', backupCount=7)
+    fh.setLevel(logging.DEBUG)
+    fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(fh)
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,10 @@ setup(
         # ('conf', ['conf/pitschi.conf'])
     # ],
     zip_safe=False,
+    entry_points={
+        'console_scripts': ['pitschi-worker=pitschi.worker:main',
+                            'pitschi-migrate=pitschi.db.migrate:main'],
+    },
     install_requires=[
             "fastapi==0.74.1",
             "uvicorn==0.16.0",
@@ -22,6 +26,7 @@ setup(
             "sqlalchemy_json==0.4.0",
             "psycopg2-binary==2.8.6",
             "requests==2.25.1",
+            "httpx==0.23.0",
             "fastapi-utils==0.2.1",
             "pytz==2022.1",
             "requests-toolbelt==0.9.1",
@@ -0,0 +1,53 @@
+"""
+pitschi reads its config and creates its tables when pitschi.db is imported, so the tests
+point PITSCHI_XAPI_CONFIG at a scratch sqlite database before anything imports it
+"""
+import os, tempfile
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_scratch = tempfile.mkdtemp(prefix='pitschi-tests-')
+with open(os.path.join(_scratch, 'pitschixapi.conf'), 'w') as _conf:
+    _conf.write('[database]\ntype = sqlite\nhost =\nusername =\npassword =\n'
+                f'name = {_scratch}/pitschi.db\n\n'
+                '[ppms]\ntimezone = Australia/Brisbane\n')
+os.environ['PITSCHI_XAPI_CONFIG'] = os.path.join(_scratch, 'pitschixapi.conf')
+
+import pitschi.db as pdb
+
+
+@pytest.fixture(scope='session')
+def engine():
+    _engine = pdb.database.engine
+    # the column defaults call postgresql's timezone(), sqlite has no such function
+    @event.listens_for(_engine, 'connect')
+    def _timezone(dbapi_connection, connection_record):
+        dbapi_connection.create_function('timezone', 2, lambda zone, timestamp: timestamp)
+    _engine.dispose()
+    return _engine
+
+
+@pytest.fixture
+def db(engine):
+    """
+    session on the scratch database, emptied again after the test
+    """
+    with Session(engine) as session:
+        yield session
+        session.rollback()
+        for table in reversed(pdb.models.Base.metadata.sorted_tables):
+            session.execute(table.delete())
+        session.commit()
+
+
+@pytest.fixture
+def statements(engine):
+    """
+    list of the statements run on the scratch database during the test
+    """
+    _statements = []
+    _capture = lambda conn, cursor, statement, parameters, context, executemany: _statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', _capture)
+    yield _statements
+    event.remove(engine, 'before_cursor_execute', _capture)
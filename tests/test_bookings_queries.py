@@ -0,0 +1,58 @@
+import datetime
+import pytest
+import pitschi.db as pdb
+
+SYSTEM = 1
+DAY = datetime.date(2099, 1, 1)
+CACHES = 3
+
+
+def seed(db, first: int, last: int):
+    """
+    bookings first to last-1 on the same system and day, each in its own project and
+    collection with CACHES caches, the core, system, user and caches are added with the first
+    """
+    m = pdb.models
+    if first == 0:
+        db.add(m.Core(id=1, institution='test', shortname='test', longname='test', rorid=''))
+        db.add(m.System(id=SYSTEM, coreid=1, type='test', name='test', pid=''))
+        db.add(m.User(username='test-user', name='Test User', email='test@example.edu.au'))
+        db.add_all([m.Cache(name=f'cache-{c}', path=f'/cache/{c}') for c in range(CACHES)])
+    for i in range(first, last):
+        db.add(m.Collection(name=f'collection-{i}'))
+        db.add(m.Project(id=i + 1, coreid=1, name=f'project {i}', type='test', phase=0, collection=f'collection-{i}'))
+        db.add_all([m.CollectionCache(collection_name=f'collection-{i}', cache_name=f'cache-{c}', priority=c)
+                    for c in range(CACHES)])
+        db.add(m.UserProject(username='test-user', projectid=i + 1, enabled=True))
+        db.add(m.Booking(id=i + 1, bookingdate=DAY, starttime=datetime.time(9), duration=60, systemid=SYSTEM,
+                         username='test-user', projectid=i + 1))
+    db.commit()
+
+
+@pytest.mark.parametrize('lookup', [
+    lambda db: pdb.crud.get_bookings_filter_system(db, SYSTEM, DAY),
+    lambda db: pdb.crud.get_bookings_filter_system_and_user(db, SYSTEM, DAY, 'Test-User'),
+], ids=['system', 'system_and_user'])
+def test_booking_lookups_run_a_constant_number_of_statements(db, statements, lookup):
+    counts = []
+    seeded = 0
+    for count in (1, 10, 50):
+        seed(db, seeded, count)
+        seeded = count
+        db.expunge_all()
+        statements.clear()
+        bookings = lookup(db)
+        assert len(bookings) == count
+        counts.append(len(statements))
+    assert counts[0] > 0
+    assert counts == [counts[0]] * len(counts)
+
+
+def test_booking_project_caches_are_dicts_highest_priority_first(db):
+    seed(db, 0, 5)
+    bookings = pdb.crud.get_bookings_filter_system(db, SYSTEM, DAY)
+    assert len(bookings) == 5
+    for booking in bookings:
+        assert booking.project.id == booking.projectid
+        assert booking.project.caches == [{'name': f'cache-{c}', 'path': f'/cache/{c}', 'priority': c}
+                                          for c in reversed(range(CACHES))]
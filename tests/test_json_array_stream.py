@@ -0,0 +1,27 @@
+import pytest
+from pitschi.ppms import JSONArrayStream
+
+
+def parse(chunks: list) -> list:
+    parser = JSONArrayStream()
+    items = []
+    for chunk in chunks:
+        items += parser.feed(chunk)
+    parser.close()
+    return items
+
+
+@pytest.mark.parametrize('chunks, items', [
+    ([b'[1, -3.', b'5]'], [1, -3.5]),
+    ([b'[1.5e', b'3]'], [1.5e3]),
+    ([b'[1, 2', b'3 ,{"a":', b'1}, "x"', b' , true]'], [1, 23, {'a': 1}, 'x', True]),
+    ([b'[{"login": "a"}, {"log', b'in": "b"}]'], [{'login': 'a'}, {'login': 'b'}]),
+    ([b'[', b']'], []),
+])
+def test_elements_split_across_chunks(chunks, items):
+    assert parse(chunks) == items
+
+
+def test_truncated_array_raises():
+    with pytest.raises(ValueError):
+        parse([b'[1, 2'])